@@ -65,11 +65,15 @@ def create_pipeline_app():
     """
     from anubis.config import config
     from anubis.views.pipeline import register_pipeline_views
+    from anubis.utils.http.compression import GzipRequestMiddleware
 
     # Create app
     app = Flask(__name__)
     app.config.from_object(config)
 
+    # The pipeline gzips large reports
+    app.wsgi_app = GzipRequestMiddleware(app.wsgi_app)
+
     # Initialize app with all the extra services
     init_services(app)
 
@@ -29,6 +29,12 @@ class Config:
             self.CACHE_REDIS_HOST = os.environ.get("REDIS_HOST", default="redis-master")
             self.CACHE_REDIS_PASSWORD = os.environ.get("REDIS_PASS", default="anubis")
 
+            # Submission log store (shared volume)
+            self.LOG_STORE_PATH = os.environ.get("LOG_STORE_PATH", default="/var/lib/anubis/logs")
+
+            # Static file store (shared volume)
+            self.STATIC_STORE_PATH = os.environ.get("STATIC_STORE_PATH", default="/var/lib/anubis/static")
+
         # MINDEBUG
         else:
             os.makedirs('.data/', exist_ok=True)
@@ -40,6 +46,16 @@ class Config:
             # cache
             self.CACHE_TYPE = 'NullCache'
 
+            # Submission log store (next to the sqlite db)
+            self.LOG_STORE_PATH = os.environ.get("LOG_STORE_PATH", default=os.path.join(
+                os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '.data', 'logs',
+            ))
+
+            # Static file store (next to the sqlite db)
+            self.STATIC_STORE_PATH = os.environ.get("STATIC_STORE_PATH", default=os.path.join(
+                os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '.data', 'static',
+            ))
+
         # OAuth
         self.OAUTH_NYU_CONSUMER_KEY = os.environ.get("OAUTH_NYU_CONSUMER_KEY", default="DEBUG")
         self.OAUTH_NYU_CONSUMER_SECRET = os.environ.get("OAUTH_NYU_CONSUMER_SECRET", default="DEBUG")
@@ -48,6 +64,9 @@ class Config:
         self.OAUTH_GITHUB_CONSUMER_KEY = os.environ.get("OAUTH_GITHUB_CONSUMER_KEY", default="DEBUG")
         self.OAUTH_GITHUB_CONSUMER_SECRET = os.environ.get("OAUTH_GITHUB_CONSUMER_SECRET", default="DEBUG")
 
+        # Github webhook secret (webhook signatures are not checked if unset)
+        self.GITHUB_WEBHOOK_SECRET = os.environ.get("GITHUB_WEBHOOK_SECRET", default=None)
+
         # Logger
         self.LOGGER_NAME = os.environ.get("LOGGER_NAME", default="anubis-api")
 
@@ -1,9 +1,9 @@
 import traceback
-from datetime import datetime
+from datetime import datetime, timedelta
 from typing import Union, List, Dict, Tuple, Optional, Any
 
 from dateutil.parser import parse as date_parse, ParserError
-from sqlalchemy import or_
+from sqlalchemy import or_, func
 
 from anubis.models import (
     db,
@@ -17,20 +17,31 @@ from anubis.models import (
     LateException,
 )
 from anubis.utils.data import is_debug
+from anubis.lms.autograde import invalidate_student_assignment_bests
 from anubis.lms.courses import assert_course_admin, get_student_course_ids
 from anubis.lms.courses import is_course_admin
 from anubis.lms.questions import ingest_questions
-from anubis.utils.cache import cache
+from anubis.utils.cache import cache, tagged_memoize, cache_tag, limit_cache_timeout, invalidate_cache_tags_on_commit
 from anubis.utils.logging import logger
 
 
-@cache.memoize(timeout=30, unless=is_debug)
+@tagged_memoize(
+    timeout=60 * 60,
+    tags=lambda assignment_id: ['assignment:' + assignment_id],
+    unless=is_debug,
+    local_timeout=60,
+)
 def get_assignment_grace(assignment_id: str) -> datetime:
     assignment: Assignment = Assignment.query.filter(Assignment.id == assignment_id).first()
     return assignment.grace_date
 
 
-@cache.memoize(timeout=30, unless=is_debug)
+@tagged_memoize(
+    timeout=60 * 60,
+    tags=lambda assignment_id: ['assignment:' + assignment_id],
+    unless=is_debug,
+    local_timeout=60,
+)
 def get_assignment_due(assignment_id: str) -> datetime:
     assignment: Assignment = Assignment.query.filter(Assignment.id == assignment_id).first()
     return assignment.due_date
@@ -87,18 +98,27 @@ def get_assignment_data(user_id: str, assignment_id: str) -> Dict[str, Any]:
     return assignment_data
 
 
-@cache.memoize(timeout=10, unless=is_debug, source_check=True)
-def get_assignments(netid: str, course_id=None) -> Optional[List[Dict[str, Any]]]:
+@tagged_memoize(
+    timeout=60 * 60,
+    tags=lambda user_id, course_id=None: [
+        'user:' + user_id, 'user_submissions:' + user_id, 'user_repos:' + user_id, 'courses',
+    ],
+    unless=is_debug,
+)
+def get_assignments(user_id: str, course_id=None) -> Optional[List[Dict[str, Any]]]:
     """
-    Get all the current assignments for a netid. Optionally specify a class_name
+    Get all the current assignments for a user. Optionally specify a class_name
     to filter by class.
 
-    :param netid: netid of user
+    * cached until the user, their courses or assignments change, or
+    until the next release or due date passes *
+
+    :param user_id: id of user
     :param course_id: optional class name
     :return: List[Assignment.data]
     """
     # Load user
-    user = User.query.filter_by(netid=netid).first()
+    user = User.query.filter(User.id == user_id).first()
 
     # Verify user exists
     if user is None:
@@ -107,9 +127,19 @@ def get_assignments(netid: str, course_id=None) -> Optional[List[Dict[str, Any]]
     # Get the list of course ids
     course_ids = get_student_course_ids(user, default=course_id)
 
+    # Drop the entry if anything in the courses change
+    # (ie: an assignment is added).
+    cache_tag(*['course:' + _course_id for _course_id in course_ids])
+
     # Build a list of all the assignments visible
     # to this user for each of the specified courses.
     assignments: List[Assignment] = []
+
+    # The assignment data depends on the time (release and due dates). Track
+    # the next time one of these dates will pass so the entry can expire then.
+    now = datetime.now()
+    next_change: Optional[datetime] = None
+
     for _course_id in course_ids:
         # Query filters
         filters = []
@@ -118,9 +148,18 @@ def get_assignments(netid: str, course_id=None) -> Optional[List[Dict[str, Any]]
         # we should filter out assignments that have not been released,
         # and those marked as hidden.
         if not is_course_admin(_course_id, user_id=user.id):
-            filters.append(Assignment.release_date <= datetime.now())
+            filters.append(Assignment.release_date <= now)
             filters.append(Assignment.hidden == False)
 
+            # Find the next assignment to be released in this course
+            next_release = db.session.query(func.min(Assignment.release_date)).filter(
+                Assignment.course_id == _course_id,
+                Assignment.release_date > now,
+                Assignment.hidden == False,
+            ).scalar()
+            if next_release is not None:
+                next_change = min(next_change or next_release, next_release)
+
         # Get the assignment objects that should be visible to this user.
         course_assignments = Assignment.query.join(Course).filter(
             Course.id == _course_id,
@@ -143,6 +182,25 @@ def get_assignments(netid: str, course_id=None) -> Optional[List[Dict[str, Any]]
     for assignment_data in response:
         fill_user_assignment_data(user.id, assignment_data)
 
+        # Drop the entry if the assignment changes
+        cache_tag('assignment:' + assignment_data['id'])
+
+        # The due date may be moved by a late exception, so
+        # use the due date in the assignment data for past_due.
+        due_date = date_parse(assignment_data['due_date'])
+        if due_date > now:
+            next_change = min(next_change or due_date, due_date)
+
+    # Check the dates used for visible_to_students and ide_active
+    for assignment in assignments:
+        for date in [assignment.release_date, assignment.due_date + timedelta(days=3 * 7)]:
+            if date > now:
+                next_change = min(next_change or date, date)
+
+    # Expire the entry once the next date passes
+    if next_change is not None:
+        limit_cache_timeout((next_change - now).total_seconds() + 1)
+
     return response
 
 
@@ -206,17 +264,7 @@ def assignment_sync(assignment_data: dict) -> Tuple[Union[dict, str], bool]:
             AssignmentTest.assignment_id == assignment.id,
             AssignmentTest.name.notin_(assignment_data["tests"]),
     ).all():
-        # Delete any and all submission test results that are still outstanding
-        # for an assignment test that will be deleted.
-        SubmissionTestResult.query.filter(
-            SubmissionTestResult.assignment_test_id == assignment_test.id,
-        ).delete()
-
-        # Delete the assignment test
-        AssignmentTest.query.filter(
-            AssignmentTest.assignment_id == assignment.id,
-            AssignmentTest.name == assignment_test.name,
-        ).delete()
+        delete_assignment_test(assignment_test)
 
     # Run though the tests in the assignment data
     for test_name in assignment_data["tests"]:
@@ -227,10 +275,13 @@ def assignment_sync(assignment_data: dict) -> Tuple[Union[dict, str], bool]:
             AssignmentTest.name == test_name,
         ).first()
 
-        # Create the assignment test if it did not already exist
+        # Create the assignment test if it did not already exist. The
+        # number of tests changed, so every student's best submission
+        # needs to be recalculated.
         if assignment_test is None:
             assignment_test = AssignmentTest(assignment=assignment, name=test_name)
             db.session.add(assignment_test)
+            invalidate_student_assignment_bests(assignment.id)
 
     # Sync the questions in the assignment data
     question_message = None
@@ -246,6 +297,41 @@ def assignment_sync(assignment_data: dict) -> Tuple[Union[dict, str], bool]:
     return {"assignment": assignment.data, "questions": question_message}, True
 
 
+def delete_assignment_test(assignment_test: AssignmentTest):
+    """
+    Delete an assignment test, along with all the submission test
+    results that point to it.
+
+    * Does not commit changes *
+
+    :param assignment_test:
+    :return:
+    """
+
+    # The test results are removed with a bulk delete, which skips the
+    # orm events. The submissions they belonged to need their cached
+    # data dropped explicitly.
+    invalidate_cache_tags_on_commit(db.session, [
+        f'submission:{submission_id}'
+        for submission_id, in db.session.query(SubmissionTestResult.submission_id).filter(
+            SubmissionTestResult.assignment_test_id == assignment_test.id,
+        ).distinct().all()
+    ])
+
+    # Delete any and all submission test results that are still outstanding
+    # for an assignment test that will be deleted.
+    SubmissionTestResult.query.filter(
+        SubmissionTestResult.assignment_test_id == assignment_test.id,
+    ).delete(synchronize_session=False)
+
+    # Delete the assignment test
+    db.session.delete(assignment_test)
+
+    # The number of tests changed, so every student's best
+    # submission needs to be recalculated.
+    invalidate_student_assignment_bests(assignment_test.assignment_id)
+
+
 def fill_user_assignment_data(user_id: str, assignment_data: Dict[str, Any]):
     assignment_id: str = assignment_data['id']
 
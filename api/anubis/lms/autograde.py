@@ -1,30 +1,43 @@
 from datetime import datetime
+from typing import List, Dict, Optional, Tuple
 
 from parse import parse
-
-from anubis.models import db, Submission, SubmissionBuild, SubmissionTestResult, Assignment, AssignmentTest
+from sqlalchemy import func, case
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from anubis.models import (
+    db,
+    Submission,
+    SubmissionBuild,
+    SubmissionTestResult,
+    Assignment,
+    AssignmentTest,
+    StudentAssignmentBest,
+)
 from anubis.utils.data import is_debug
 from anubis.utils.http import error_response
 from anubis.lms.students import get_students_in_class
-from anubis.utils.cache import cache
+from anubis.utils.cache import cache, tagged_memoize
 
 
-@cache.memoize(timeout=60, unless=is_debug, source_check=True)
+@tagged_memoize(timeout=60 * 60, tags=lambda assignment_id: ['assignment:' + assignment_id], unless=is_debug)
 def _get_assignment_test_count(assignment_id) -> int:
     return AssignmentTest.query.filter(
         AssignmentTest.assignment_id == assignment_id,
     ).count()
 
 
-@cache.memoize(timeout=5 * 60, unless=is_debug, source_check=True)
 def autograde(student_id, assignment_id, max_time: datetime = None):
     """
     Get the stats for a specific student on a specific assignment.
 
-    Pulls all submissions, then finds the most recent one that
-    has the most tests that passed.
+    The best submission for each student is kept up to date in the
+    student_assignment_best table as pipeline reports come in. Reading
+    the current best is a single row lookup. If a max_time is specified,
+    then the best submission is calculated from the submissions instead.
 
-    * This function is heavily cached as it is IO intensive on the DB *
+    * Does not commit changes *
 
     :param student_id:
     :param assignment_id:
@@ -32,62 +45,265 @@ def autograde(student_id, assignment_id, max_time: datetime = None):
     :return:
     """
 
+    # The materialized best only tracks the current best
+    if max_time is not None:
+        return bulk_best_submission_ids(assignment_id, [student_id], max_time=max_time).get(student_id, None)
+
+    # Read the materialized best submission
+    return get_student_assignment_bests(assignment_id, [student_id]).get(student_id, None)
+
+
+def bulk_best_submission_ids(
+        assignment_id: str, student_ids: List[str] = None, max_time: datetime = None
+) -> Dict[str, str]:
+    """
+    Calculate the best submission for every student on an assignment
+    with a single aggregate query.
+
+    :param assignment_id:
+    :param student_ids: optional subset of students to calculate
+    :param max_time:
+    :return: dict of student_id -> best submission_id
+    """
+    return {
+        owner_id: submission_id
+        for owner_id, (submission_id, _) in _best_submissions(
+            assignment_id, student_ids, max_time=max_time,
+        ).items()
+    }
+
+
+def _best_submissions(
+        assignment_id: str, student_ids: List[str] = None, max_time: datetime = None
+) -> Dict[str, Tuple[str, int]]:
+    """
+    Set based version of autograde. Instead of walking each student's
+    submissions in python, this function calculates the best submission
+    for every student on an assignment with a single aggregate query.
+
+    The passed test counts are calculated per submission with a group by,
+    then a row_number window partitioned by owner picks the best submission.
+    The ordering within each owner matches the autograde function exactly:
+
+    * If any submission passes all the tests, the most recent of those wins
+    * Otherwise the submission with the most tests passed wins, with the
+      oldest one winning ties
+
+    :param assignment_id:
+    :param student_ids: optional subset of students to calculate
+    :param max_time:
+    :return: dict of student_id -> (best submission_id, tests passed)
+    """
+
+    # An explicit empty list of students means there is nothing to do
+    if student_ids is not None and len(student_ids) == 0:
+        return {}
+
     # List of filters for submission query
-    submission_filters = []
+    submission_filters = [
+        Submission.assignment_id == assignment_id,
+        Submission.processed == True,
+        Submission.accepted == True,
+    ]
+
+    # Limit to a subset of students
+    if student_ids is not None:
+        submission_filters.append(Submission.owner_id.in_(student_ids))
 
     # maximum time to check
     if max_time is not None:
         submission_filters.append(Submission.created <= max_time)
 
-    # best is the best submission seen so far
-    best = None
-
-    # best_count is the most tests that have
-    # passed for this student so far
-    best_count = -1
-
     # Get the max number of assignment tests that can be passed
-    # so we can stop early if we find a submission that has all
-    # tests passing
     max_correct = _get_assignment_test_count(assignment_id)
 
-    # Iterate over all submissions for this student, tracking
-    # the best submission so far (based on number of tests passed).
-    # We start from the oldest submission and move to the newest.
-    for submission in (
-            Submission.query.filter(
-                Submission.assignment_id == assignment_id,
-                Submission.owner_id == student_id,
-                Submission.processed == True,
-                Submission.accepted == True,
-                *submission_filters
-            )
-                    .order_by(Submission.created.desc())
-                    .all()
-    ):
+    # Count the number of passed tests for each submission. The outer
+    # join makes sure submissions without any test results are still
+    # candidates (with zero tests passed).
+    passed_count = func.coalesce(
+        func.sum(case((SubmissionTestResult.passed == True, 1), else_=0)), 0
+    ).label('passed_count')
+    counts = (
+        db.session.query(
+            Submission.id.label('id'),
+            Submission.owner_id.label('owner_id'),
+            Submission.created.label('created'),
+            passed_count,
+        )
+            .outerjoin(SubmissionTestResult, SubmissionTestResult.submission_id == Submission.id)
+            .filter(*submission_filters)
+            .group_by(Submission.id, Submission.owner_id, Submission.created)
+            .subquery()
+    )
+
+    # Submissions that pass every test are ranked newest first. Everything
+    # else is ranked by most tests passed, then oldest first.
+    all_passed = counts.c.passed_count >= max_correct
+    rank = func.row_number().over(
+        partition_by=counts.c.owner_id,
+        order_by=[
+            case((all_passed, 1), else_=0).desc(),
+            counts.c.passed_count.desc(),
+            case((all_passed, counts.c.created), else_=None).desc(),
+            counts.c.created.asc(),
+            counts.c.id.asc(),
+        ],
+    ).label('rank')
+    ranked = db.session.query(counts.c.id, counts.c.owner_id, counts.c.passed_count, rank).subquery()
+
+    # Pick the top ranked submission for each owner
+    return {
+        owner_id: (submission_id, int(tests_passed))
+        for submission_id, owner_id, tests_passed in db.session.query(
+            ranked.c.id, ranked.c.owner_id, ranked.c.passed_count,
+        ).filter(
+            ranked.c.rank == 1,
+        ).all()
+    }
+
+
+def refresh_student_assignment_bests(assignment_id: str, student_ids: List[str]) -> Dict[str, Optional[str]]:
+    """
+    Recalculate the best submissions for a set of students on an
+    assignment, and write them to the student_assignment_best table.
+    Students without any accepted submissions get a row with a null
+    submission so that we know they have already been calculated.
+
+    * Does not commit changes *
+
+    :param assignment_id:
+    :param student_ids:
+    :return: dict of student_id -> best submission_id
+    """
+
+    # Skip students that are not set (dangling submissions)
+    student_ids = list(set(filter(lambda x: x is not None, student_ids)))
+    if len(student_ids) == 0:
+        return {}
+
+    # Calculate the current bests
+    bests = _best_submissions(assignment_id, student_ids)
+
+    # Build the rows to write
+    now = datetime.now()
+    rows = []
+    for student_id in student_ids:
+        submission_id, tests_passed = bests.get(student_id, (None, 0))
+        rows.append({
+            'owner_id': student_id,
+            'assignment_id': assignment_id,
+            'submission_id': submission_id,
+            'tests_passed': tests_passed,
+            'created': now,
+            'last_updated': now,
+        })
 
-        # Calculate the number of tests that passed in this submission
-        correct_count = sum(
-            map(lambda result: 1 if result.passed else 0, submission.test_results)
+    # Write the rows. Pipeline reports for the same student may be
+    # handled at the same time, so this needs to be an atomic upsert.
+    _upsert_student_assignment_bests(rows)
+
+    return {row['owner_id']: row['submission_id'] for row in rows}
+
+
+def refresh_student_assignment_best(student_id: str, assignment_id: str) -> Optional[str]:
+    """
+    Recalculate the best submission for a single student on an assignment.
+
+    * Does not commit changes *
+
+    :param student_id:
+    :param assignment_id:
+    :return: best submission_id
+    """
+    return refresh_student_assignment_bests(assignment_id, [student_id]).get(student_id, None)
+
+
+def invalidate_student_assignment_bests(assignment_id: str):
+    """
+    Drop the materialized best submissions for every student on an
+    assignment. Use this when a change affects every student at once
+    (ie: a test is added or removed, changing what the best submission
+    is). The rows are recalculated in bulk the next time they are read.
+
+    * Does not commit changes *
+
+    :param assignment_id:
+    :return:
+    """
+    StudentAssignmentBest.query.filter(
+        StudentAssignmentBest.assignment_id == assignment_id,
+    ).delete(synchronize_session=False)
+
+
+def _upsert_student_assignment_bests(rows: List[dict]):
+    """
+    Insert or update student_assignment_best rows in one statement.
+    Mariadb uses on duplicate key update, while sqlite (MINDEBUG)
+    uses on conflict do update.
+
+    :param rows:
+    :return:
+    """
+
+    # Use the dialect specific upsert
+    if db.engine.dialect.name == 'sqlite':
+        stmt = sqlite_insert(StudentAssignmentBest.__table__).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['owner_id', 'assignment_id'],
+            set_={
+                'submission_id': stmt.excluded.submission_id,
+                'tests_passed': stmt.excluded.tests_passed,
+                'last_updated': stmt.excluded.last_updated,
+            },
+        )
+    else:
+        stmt = mysql_insert(StudentAssignmentBest.__table__).values(rows)
+        stmt = stmt.on_duplicate_key_update(
+            submission_id=stmt.inserted.submission_id,
+            tests_passed=stmt.inserted.tests_passed,
+            last_updated=stmt.inserted.last_updated,
         )
 
-        # If the number of passed tests in this assignment is as good
-        # or better as the best seen so far, update the running best.
-        if correct_count >= best_count:
-            best_count = correct_count
-            best = submission
+    db.session.execute(stmt)
 
-        # If the number of passed tests is equal to the number
-        # of tests then we can stop and use this assignment.
-        if best_count == max_correct:
-            break
 
-    # return the submission id of the best if there is one, otherwise None
-    return best.id if best is not None else None
+def get_student_assignment_bests(assignment_id: str, student_ids: List[str]) -> Dict[str, Optional[str]]:
+    """
+    Read the best submissions for a set of students on an assignment
+    from the student_assignment_best table. Students that do not have
+    a row yet are calculated and backfilled.
+
+    * Does not commit changes. The backfilled rows are only flushed,
+    and are kept if the caller commits. *
+
+    :param assignment_id:
+    :param student_ids:
+    :return: dict of student_id -> best submission_id
+    """
+
+    # Read the materialized rows
+    bests = {
+        owner_id: submission_id
+        for owner_id, submission_id in db.session.query(
+            StudentAssignmentBest.owner_id,
+            StudentAssignmentBest.submission_id,
+        ).filter(
+            StudentAssignmentBest.assignment_id == assignment_id,
+            StudentAssignmentBest.owner_id.in_(student_ids),
+        ).all()
+    } if len(student_ids) > 0 else {}
+
+    # Backfill any students that have not been calculated yet
+    missing = [student_id for student_id in student_ids if student_id not in bests]
+    if len(missing) > 0:
+        bests.update(refresh_student_assignment_bests(assignment_id, missing))
+        db.session.flush()
+
+    return bests
 
 
 def autograde_submission_result_wrapper(assignment: Assignment, user_id: str, netid: str, name: str,
-                                        submission_id: str) -> dict:
+                                        submission_id: str, submission: Optional[Submission] = None) -> dict:
     """
     The autograde results require quite of bit more information than
     just the id of the best submission. This function takes some high level
@@ -101,6 +317,7 @@ def autograde_submission_result_wrapper(assignment: Assignment, user_id: str, ne
     :param netid:
     :param name:
     :param submission_id:
+    :param submission: optional already loaded submission object
     :return:
     """
     if submission_id is None:
@@ -123,7 +340,9 @@ def autograde_submission_result_wrapper(assignment: Assignment, user_id: str, ne
         }
 
     else:
-        submission = Submission.query.filter(Submission.id == submission_id).first()
+        # Load the submission if the caller did not already
+        if submission is None:
+            submission = Submission.query.filter(Submission.id == submission_id).first()
         repo_path = parse("https://github.com/{}", submission.repo.repo_url)[0]
         best_count = sum(map(lambda x: 1 if x.passed else 0, submission.test_results))
         late = "past due" if assignment.due_date < submission.created else "on time"
@@ -158,8 +377,9 @@ def bulk_autograde(assignment_id, netids=None, offset=0, limit=20):
     The offset and limit are used here to have the results of this function
     move as a window of the results.
 
-    * Calculating the autograde results is very IO intensive on the db. For this,
-    these results are heavily cached. *
+    * The best submissions are read from the student_assignment_best table,
+    so the remaining cost is serializing the submissions. These results are
+    still cached. *
 
     :param assignment_id:
     :param netids:
@@ -182,12 +402,25 @@ def bulk_autograde(assignment_id, netids=None, offset=0, limit=20):
     # Get the list of students to get autograde results for
     students = get_students_in_class(assignment.course_id, offset=offset, limit=limit)
     if netids is not None:
-        students = filter(lambda x: x["netid"] in netids, students)
-
-    # Run through each of the students, getting the autograde results for each
+        students = list(filter(lambda x: x["netid"] in netids, students))
+
+    # Read the best submission for all the students at once
+    best_ids = get_student_assignment_bests(assignment.id, [student["id"] for student in students])
+
+    # Load all the best submissions in one pass, along with the
+    # relationships the result wrapper (and admin_data) needs.
+    from anubis.lms.submissions import submission_data_options
+    best_submission_ids = [submission_id for submission_id in best_ids.values() if submission_id is not None]
+    submissions = {
+        submission.id: submission
+        for submission in Submission.query.filter(
+            Submission.id.in_(best_submission_ids),
+        ).options(*submission_data_options()).all()
+    } if len(best_submission_ids) > 0 else {}
+
+    # Run through each of the students, building the autograde results for each
     for student in students:
-        # Get the best submission for this student from this assignment
-        submission_id = autograde(student["id"], assignment.id)
+        submission_id = best_ids.get(student["id"], None)
         bests.append(
             # Use the stats_wrapper function to add all the necessary
             # metadata for the submission.
@@ -197,6 +430,7 @@ def bulk_autograde(assignment_id, netids=None, offset=0, limit=20):
                 student["netid"],
                 student["name"],
                 submission_id,
+                submission=submissions.get(submission_id, None),
             )
         )
 
@@ -29,7 +29,7 @@ from anubis.models import (
 from anubis.utils.auth.user import current_user
 from anubis.utils.data import is_debug
 from anubis.utils.exceptions import AuthenticationError, LackCourseContext
-from anubis.utils.cache import cache
+from anubis.utils.cache import cache, tagged_memoize, cache_tag
 from anubis.utils.logging import logger
 
 
@@ -327,17 +327,19 @@ def valid_join_code(join_code: str) -> bool:
     return all(c in valid_chars for c in join_code)
 
 
-@cache.memoize(timeout=60, unless=is_debug)
-def get_courses(netid: str):
+@tagged_memoize(timeout=60 * 60, tags=lambda user_id: ['user:' + user_id, 'courses'], unless=is_debug)
+def get_courses(user_id: str):
     """
-    Get all classes a given netid is in
+    Get all classes a given user is in
 
-    :param netid:
+    * cached until the user or their courses change *
+
+    :param user_id:
     :return:
     """
 
     # Get user
-    user = User.query.filter(User.netid == netid).first()
+    user = User.query.filter(User.id == user_id).first()
 
     # Get course ids
     course_ids = get_student_course_ids(user)
@@ -345,6 +347,9 @@ def get_courses(netid: str):
     # Query for classes
     classes = Course.query.filter(Course.id.in_(course_ids)).all()
 
+    # Drop the entry if any of the courses change
+    cache_tag(*['course:' + course_id for course_id in course_ids])
+
     # Convert to list of data representation
     return [c.data for c in classes]
 
@@ -463,12 +468,17 @@ def get_courses_with_visuals() -> List[Dict[str, Any]]:
     ]
 
 
-@cache.memoize(timeout=3600, source_check=True, unless=is_debug)
+@tagged_memoize(
+    timeout=60 * 60,
+    tags=lambda course_id: ['course_admins:' + course_id],
+    unless=is_debug,
+    local_timeout=60,
+)
 def get_course_admin_ids(course_id: str) -> List[str]:
     """
     Get a list of course admin id values.
 
-    * highly cached *
+    * highly cached, in process and in redis *
 
     :param course_id:
     :return:
@@ -1,7 +1,9 @@
 import io
-import random
 import zipfile
+from datetime import datetime
 from typing import List, Dict, Optional
+
+import numpy as np
 import yaml
 
 from anubis.models import (
@@ -10,10 +12,9 @@ from anubis.models import (
     AssignmentQuestion,
     AssignedStudentQuestion,
     AssignedQuestionResponse,
-    User,
     InCourse,
 )
-from anubis.utils.data import _verify_data_shape, is_debug
+from anubis.utils.data import _verify_data_shape, is_debug, rand, req_assert
 from anubis.lms.students import get_students
 from anubis.utils.cache import cache
 
@@ -57,25 +58,20 @@ def reset_question_assignments(assignment: Assignment, commit: bool = True):
     :return:
     """
 
-    # Get all the question assignments for this assignment
-    assigned_student_questions = AssignedStudentQuestion.query.filter(
-        AssignedStudentQuestion.assignment_id == assignment.id
-    ).all()
-
-    # Break them down into ids
-    assigned_student_question_ids = list(map(lambda x: x.id, assigned_student_questions))
-
-    # Delete all responses for the assignment
+    # Delete all responses for the assignment. The question assignments
+    # are matched in a subquery, so they never have to be loaded.
     AssignedQuestionResponse.query.filter(
         AssignedQuestionResponse.assigned_question_id.in_(
-            assigned_student_question_ids
+            db.session.query(AssignedStudentQuestion.id).filter(
+                AssignedStudentQuestion.assignment_id == assignment.id
+            )
         ),
-    ).delete()
+    ).delete(synchronize_session=False)
 
     # Delete the question assignments
     AssignedStudentQuestion.query.filter(
         AssignedStudentQuestion.assignment_id == assignment.id
-    ).delete()
+    ).delete(synchronize_session=False)
 
     # Commit the delete
     if commit:
@@ -106,48 +102,86 @@ def hard_reset_questions(assignment: Assignment, commit: bool = True):
         db.session.commit()
 
 
-def assign_questions(assignment: Assignment):
+def assign_questions(assignment: Assignment, seed: Optional[int] = None):
     """
     Assign existing questions to students for a given assignment.
 
+    The questions for every student in every pool are drawn at once,
+    and the assignments are written with a single bulk insert.
+
     * This will reset question assignments when called *
 
+    Questions can not be re-assigned once students have started
+    responding to them. Use reset_question_assignments to throw
+    the responses away first.
+
     :param assignment:
+    :param seed: seed for the random question draws (for reproducible assignments)
     :return:
     """
 
+    # Never throw away student responses here
+    has_responses = db.session.query(AssignedQuestionResponse.id).filter(
+        AssignedQuestionResponse.assigned_question_id.in_(
+            db.session.query(AssignedStudentQuestion.id).filter(
+                AssignedStudentQuestion.assignment_id == assignment.id
+            )
+        ),
+    ).first() is not None
+    req_assert(not has_responses, message='questions have already been answered, and can not be re-assigned')
+
     # Delete any existing question assignments
     AssignedStudentQuestion.query.filter(
         AssignedStudentQuestion.assignment_id == assignment.id
-    ).delete()
+    ).delete(synchronize_session=False)
 
     # Find the questions that have been created for this assignment
     raw_questions = AssignmentQuestion.query.filter(
         AssignmentQuestion.assignment_id == assignment.id,
-    ).all()
+    ).order_by(AssignmentQuestion.id).all()
 
     questions = get_question_pool_mapping(raw_questions)
 
-    # Go through students in the class and assign them questions
+    # Get the ids of the students in the class
+    student_ids = [
+        owner_id for owner_id, in db.session.query(InCourse.owner_id).filter(
+            InCourse.course_id == assignment.course_id,
+        ).order_by(InCourse.owner_id).all()
+    ]
+
+    # Nothing to assign
+    if len(student_ids) == 0 or len(questions) == 0:
+        db.session.commit()
+        return []
+
+    # Draw a random question from each pool for every student
+    rng = np.random.default_rng(seed)
+    now = datetime.now()
+    rows = []
     assigned_questions = []
-    students = (
-        User.query.join(InCourse)
-            .filter(InCourse.course_id == assignment.course_id)
-            .all()
-    )
-    for student in students:
-        for sequence, qs in questions.items():
-            # Get a random question from the pool at this sequence
-            selected_question = random.choice(qs)
+    for pool in sorted(questions.keys()):
+        qs = questions[pool]
+        choices = rng.integers(0, len(qs), size=len(student_ids))
+
+        for student_id, choice in zip(student_ids, choices):
+            selected_question = qs[choice]
 
             # Assign them the question
-            assigned_question = AssignedStudentQuestion(
-                owner=student,
-                assignment=assignment,
-                question=selected_question,
-            )
-            assigned_questions.append(assigned_question.data)
-            db.session.add(assigned_question)
+            row_id = rand(32)
+            rows.append({
+                'id': row_id,
+                'owner_id': student_id,
+                'assignment_id': assignment.id,
+                'question_id': selected_question.id,
+                'created': now,
+                'last_updated': now,
+            })
+
+            # The new assignments do not have responses yet
+            assigned_questions.append(AssignedStudentQuestion.build_data(row_id, selected_question))
+
+    # Write all the assignments at once
+    db.session.bulk_insert_mappings(AssignedStudentQuestion, rows)
 
     # Commit assignments
     db.session.commit()
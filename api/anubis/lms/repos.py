@@ -2,10 +2,10 @@ from typing import List
 
 from anubis.models import AssignmentRepo, Assignment
 from anubis.utils.data import is_debug
-from anubis.utils.cache import cache
+from anubis.utils.cache import tagged_memoize, cache_tag
 
 
-@cache.memoize(timeout=10, source_check=True, unless=is_debug)
+@tagged_memoize(timeout=60 * 60, tags=lambda user_id: ['user_repos:' + user_id], unless=is_debug)
 def get_repos(user_id: str):
     repos: List[AssignmentRepo] = (
         AssignmentRepo.query.join(Assignment)
@@ -14,4 +14,8 @@ def get_repos(user_id: str):
             .all()
     )
 
+    # The repo data includes assignment and course fields
+    for repo in repos:
+        cache_tag('assignment:' + repo.assignment_id, 'course:' + repo.assignment.course_id)
+
     return [repo.data for repo in repos]
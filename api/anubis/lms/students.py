@@ -1,8 +1,11 @@
-from typing import List, Dict
+from typing import List, Dict, Optional, Tuple
+
+from sqlalchemy import func
 
 from anubis.models import User, InCourse, Course
 from anubis.utils.data import is_debug
 from anubis.utils.cache import cache
+from anubis.utils.pagination import keyset_paginate
 
 
 @cache.memoize(timeout=60, unless=is_debug)
@@ -37,6 +40,24 @@ def get_students(course_id: str = None, course_code: str = None) -> List[Dict[st
     ]
 
 
+# Students are sorted by name. Names can be null, so they are
+# sorted (and paged) as empty strings.
+_student_name_sort = func.coalesce(User.name, '')
+
+
+def _students_in_class_query(course_id: str):
+    """
+    Build the query for all the students in a course.
+
+    :param course_id:
+    :return:
+    """
+    return User.query.join(InCourse).filter(
+        InCourse.course_id == course_id,
+        InCourse.owner_id == User.id,
+    )
+
+
 @cache.memoize(timeout=60, unless=is_debug)
 def get_students_in_class(course_id, offset=None, limit=None):
     """
@@ -53,23 +74,35 @@ def get_students_in_class(course_id, offset=None, limit=None):
     :return:
     """
 
+    # Order by name, with the id to keep the order stable
+    # between pages for students with the same name.
+    query = _students_in_class_query(course_id).order_by(_student_name_sort.desc(), User.id.desc())
+
     # If a limit and offset was specified, then use them
     # in the query.
     if offset is not None and limit is not None:
-        # Get the users, and break them into their data props
-        return [
-            u.data
-            for u in User.query.join(InCourse).join(Course).filter(
-                Course.id == course_id,
-                InCourse.owner_id == User.id,
-            ).order_by(User.name.desc()).limit(limit).offset(offset).all()
-        ]
+        query = query.limit(limit).offset(offset)
 
     # Get the users, and break them into their data props
-    return [
-        u.data
-        for u in User.query.join(InCourse).join(Course).filter(
-            Course.id == course_id,
-            InCourse.owner_id == User.id,
-        ).order_by(User.name.desc()).all()
-    ]
+    return [u.data for u in query.all()]
+
+
+@cache.memoize(timeout=60, unless=is_debug)
+def get_students_in_class_page(course_id: str, limit: int = 50, cursor: str = None) -> Tuple[List[Dict], Optional[str]]:
+    """
+    Get a page of the students in a course, starting after the
+    cursor from the previous page. Students are in the same order
+    as get_students_in_class.
+
+    * This response is cached for up to 60 seconds *
+
+    :param course_id:
+    :param limit:
+    :param cursor: cursor from the previous page, or None for the first page
+    :return: list of student data, cursor for the next page
+    """
+    students, next_cursor = keyset_paginate(
+        _students_in_class_query(course_id), [_student_name_sort, User.id], cursor, limit,
+    )
+
+    return [u.data for u in students], next_cursor
@@ -1,10 +1,12 @@
+from collections import defaultdict
 from datetime import datetime
-from typing import List, Union, Dict, Optional, Tuple
+from typing import List, Union, Dict, Optional, Set, Tuple
+
+from sqlalchemy.orm import selectinload, joinedload, undefer
 
 from anubis.models import (
     db,
     User,
-    Course,
     Submission,
     AssignmentRepo,
     SubmissionTestResult,
@@ -17,9 +19,38 @@ from anubis.rpc.batch import rpc_bulk_regrade
 from anubis.utils.data import is_debug, split_chunks
 from anubis.utils.http import error_response, success_response
 from anubis.lms.assignments import get_assignment_due_date
-from anubis.utils.cache import cache
+from anubis.lms.autograde import refresh_student_assignment_best, refresh_student_assignment_bests
+from anubis.utils.cache import tagged_memoize, cache_tag
+from anubis.utils.log_store import set_stdout
 from anubis.utils.logging import logger
-from anubis.utils.rpc import rpc_enqueue, enqueue_autograde_pipeline
+from anubis.utils.pagination import keyset_paginate
+from anubis.utils.rpc import rpc_enqueue_many, enqueue_autograde_pipeline, enqueue_autograde_pipelines
+
+
+def submission_data_options() -> list:
+    """
+    Loader options for submissions that will be serialized with data,
+    full_data or admin_data. Everything the serialization touches
+    (assignment, course, repo, build, test results and their tests,
+    including the deferred stdout and message columns) is loaded up
+    front for the whole page of submissions. That way serialization
+    is done in memory, instead of with queries for every submission
+    and every test.
+
+    ex: Submission.query.options(*submission_data_options())
+
+    :return:
+    """
+    return [
+        selectinload(Submission.assignment).selectinload(Assignment.course),
+        selectinload(Submission.repo),
+        selectinload(Submission.build).undefer(SubmissionBuild.stdout),
+        selectinload(Submission.test_results).options(
+            undefer(SubmissionTestResult.stdout),
+            undefer(SubmissionTestResult.message),
+            joinedload(SubmissionTestResult.assignment_test),
+        ),
+    ]
 
 
 def bulk_regrade_submissions(submissions: List[Submission]) -> List[dict]:
@@ -32,20 +63,46 @@ def bulk_regrade_submissions(submissions: List[Submission]) -> List[dict]:
     # Running list of regrade dictionaries
     response = []
 
-    # enqueue regrade jobs for each submissions
+    # Running list of submissions to enqueue
+    submission_ids = []
+
+    # Students whose best submission needs to be updated, by assignment
+    students: Dict[str, Set[str]] = defaultdict(set)
+
+    # Reset each of the submissions
     for submission in submissions:
-        response.append(regrade_submission(submission, queue='regrade'))
+        submission_response = regrade_submission(submission, enqueue=False, refresh_best=False)
+        response.append(submission_response)
+
+        # Track the submissions that were reset
+        if submission_response['success']:
+            submission_ids.append(submission_response['data']['submission_id'])
+            students[submission_response['data']['assignment_id']].add(
+                submission_response['data']['owner_id']
+            )
+
+    # Update the best submissions for the batch, an assignment at a time
+    for assignment_id, student_ids in students.items():
+        refresh_student_assignment_bests(assignment_id, list(student_ids))
+    db.session.commit()
+
+    # Enqueue all the regrade jobs at once
+    enqueue_autograde_pipelines(submission_ids, queue='regrade')
 
     # Pass back a list of all the regrade return dictionaries
     return response
 
 
-def regrade_submission(submission: Union[Submission, str], queue: str = 'default') -> dict:
+def regrade_submission(
+        submission: Union[Submission, str], queue: str = 'default', enqueue: bool = True, refresh_best: bool = True,
+) -> dict:
     """
     Regrade a submission
 
     :param submission: Union[Submissions, str]
     :param queue:
+    :param enqueue: enqueue the pipeline job for the submission
+    :param refresh_best: update the best submission for the student
     :return: dict response
     """
 
@@ -71,12 +128,16 @@ def regrade_submission(submission: Union[Submission, str], queue: str = 'default
     submission.last_updated = datetime.now()
 
     # Reset the accompanying database objects
-    init_submission(submission)
+    init_submission(submission, refresh_best=refresh_best)
 
     # Enqueue the submission job
-    enqueue_autograde_pipeline(submission.id, queue=queue)
+    if enqueue:
+        enqueue_autograde_pipeline(submission.id, queue=queue)
 
     return success_response({
+        "submission_id": submission.id,
+        "assignment_id": submission.assignment_id,
+        "owner_id": submission.owner_id,
         "message": "regrade started"
     })
 
@@ -99,6 +160,9 @@ def fix_dangling():
     # Running list of fixed submissions
     fixed = []
 
+    # Running list of submissions to enqueue
+    enqueue_ids = []
+
     # Find Assignment Repos that do not have an owner_id
     dangling_repos = AssignmentRepo.query.filter(
         AssignmentRepo.owner_id == None,
@@ -133,7 +197,7 @@ def fix_dangling():
                 # Check if the submission should be accepted
                 if dangling_repo.assignment.accept_late and submission.created < due_date:
                     # Enqueue a autograde job for the submission
-                    enqueue_autograde_pipeline(submission.id)
+                    enqueue_ids.append(submission.id)
 
                 # Reject the submission if it was late
                 else:
@@ -173,29 +237,76 @@ def fix_dangling():
             # Check if the submission should be accepted
             if submission.assignment.accept_late and submission.created < due_date:
                 # Enqueue a autograde job for the submission
-                enqueue_autograde_pipeline(submission.id)
+                enqueue_ids.append(submission.id)
 
             # Reject the submission if it was late
             else:
                 reject_late_submission(submission)
 
+    # Enqueue all the autograde jobs at once
+    enqueue_autograde_pipelines(enqueue_ids, queue='default')
+
     return fixed
 
 
-@cache.memoize(timeout=5, unless=is_debug, source_check=True)
+def _submissions_query(owner_id: str, course_id: str = None, assignment_id: str = None):
+    """
+    Build the query for a user's submissions (in courses they are in).
+    Optionally filter by course and / or assignment.
+
+    :param owner_id:
+    :param course_id:
+    :param assignment_id:
+    :return:
+    """
+
+    # Build filters
+    filters = []
+    if course_id is not None and course_id != "":
+        filters.append(Assignment.course_id == course_id)
+    if assignment_id is not None:
+        filters.append(Submission.assignment_id == assignment_id)
+
+    return Submission.query.join(Assignment).filter(
+        Submission.owner_id == owner_id,
+
+        # Only submissions in courses the owner is in
+        db.session.query(InCourse).filter(
+            InCourse.owner_id == owner_id,
+            InCourse.course_id == Assignment.course_id,
+        ).exists(),
+
+        *filters,
+    )
+
+
+@tagged_memoize(
+    timeout=60 * 60,
+    tags=lambda user_id=None, *_, **__: [
+        'user:{}'.format(user_id), 'user_submissions:{}'.format(user_id), 'user_repos:{}'.format(user_id),
+    ],
+    unless=is_debug,
+)
 def get_submissions(
-        user_id=None, course_id=None, assignment_id=None, limit=None, offset=None,
-) -> Optional[Tuple[List[Dict[str, str]], int]]:
+        user_id=None, course_id=None, assignment_id=None, limit=None, offset=None, cursor=None,
+) -> Optional[Tuple[List[Dict[str, str]], Optional[str]]]:
     """
-    Get all submissions for a given netid. Cache the results. Optionally specify
+    Get all submissions for a given user. Cache the results. Optionally specify
     a class_name and / or assignment_name for additional filtering.
 
+    Pages can be requested either with a limit and offset, or with a
+    limit and a cursor from the previous page. Cursor pages cost the
+    same no matter how deep they are.
+
+    * cached until the user or their submissions change *
+
     :param offset:
     :param limit:
     :param user_id:
     :param course_id:
     :param assignment_id: id of assignment
-    :return:
+    :param cursor: cursor for the next page (from the previous page, empty for the first page)
+    :return: list of submission data, cursor for the next page (if using cursors)
     """
 
     # Load user
@@ -205,35 +316,56 @@ def get_submissions(
     if owner is None:
         return None
 
-    # Build filters
-    filters = []
-    if course_id is not None and course_id != "":
-        filters.append(Course.id == course_id)
-    if user_id is not None and user_id != "":
-        filters.append(User.id == user_id)
-    if assignment_id is not None:
-        filters.append(Assignment.id == assignment_id)
+    # Load everything the serialization needs for the whole page
+    query = _submissions_query(owner.id, course_id, assignment_id).options(*submission_data_options())
 
-    query = (
-        Submission.query.join(Assignment)
-            .join(Course)
-            .join(InCourse)
-            .join(User)
-            .filter(Submission.owner_id == owner.id, *filters)
+    next_cursor = None
+    if cursor is not None:
+        # Get the page after the cursor
+        submissions, next_cursor = keyset_paginate(
+            query, [Submission.created, Submission.id], cursor, limit or 10,
+        )
 
-            .order_by(Submission.created.desc())
-    )
+    else:
+        query = query.order_by(Submission.created.desc(), Submission.id.desc())
+        if limit is not None:
+            query = query.limit(limit)
+        if offset is not None:
+            query = query.offset(offset)
+
+        submissions = query.all()
 
-    all_total = query.count()
+    # Drop the entry if any of the submissions (or their
+    # tests and builds), assignments or courses change.
+    for submission in submissions:
+        cache_tag(
+            'submission:' + submission.id,
+            'assignment:' + submission.assignment_id,
+            'course:' + submission.assignment.course_id,
+        )
+
+    return [s.full_data for s in submissions], next_cursor
 
-    if limit is not None:
-        query = query.limit(limit)
-    if offset is not None:
-        query = query.offset(offset)
 
-    submissions = query.all()
+@tagged_memoize(
+    timeout=60 * 60,
+    tags=lambda user_id, *_, **__: ['user:' + user_id, 'user_submissions:' + user_id],
+    unless=is_debug,
+)
+def get_submissions_count(user_id: str, course_id: str = None, assignment_id: str = None) -> int:
+    """
+    Get the total number of submissions get_submissions can return for
+    a user. This is kept separate from the pages so that the count is
+    only run once, instead of for every page.
 
-    return [s.full_data for s in submissions], all_total
+    * cached until the user or their submissions change *
+
+    :param user_id:
+    :param course_id:
+    :param assignment_id:
+    :return:
+    """
+    return _submissions_query(user_id, course_id, assignment_id).count()
 
 
 def recalculate_late_submissions(student: User, assignment: Assignment):
@@ -251,36 +383,48 @@ def recalculate_late_submissions(student: User, assignment: Assignment):
 
     # Get the submissions that need to be rejected
     s_reject = Submission.query.filter(
+        Submission.assignment_id == assignment.id,
+        Submission.owner_id == student.id,
         Submission.created > due_date,
         Submission.accepted == True,
     ).all()
 
     # Get the submissions that need to be accepted
     s_accept = Submission.query.filter(
+        Submission.assignment_id == assignment.id,
+        Submission.owner_id == student.id,
         Submission.created < due_date,
         Submission.accepted == False,
     ).all()
 
     # Go through, and reset and enqueue regrade
     s_accept_ids = list(map(lambda x: x.id, s_accept))
-    for chunk in split_chunks(s_accept_ids, 32):
-        rpc_enqueue(rpc_bulk_regrade, 'regrade', args=[chunk])
+    rpc_enqueue_many(rpc_bulk_regrade, 'regrade', [
+        (chunk,) for chunk in split_chunks(s_accept_ids, 32)
+    ])
 
     # Reject the submissions that need to be updated
     for submission in s_reject:
-        reject_late_submission(submission)
+        reject_late_submission(submission, refresh_best=False)
+
+    # Update the best submission for the student now that the
+    # late submissions have been rejected. The accepted submissions
+    # will update it when their regrade is processed.
+    refresh_student_assignment_best(student.id, assignment.id)
 
     # Commit the changes
     db.session.commit()
 
 
-def reject_late_submission(submission: Submission):
+def reject_late_submission(submission: Submission, refresh_best: bool = True):
     """
     Set all the fields that need to be set when
     rejecting a submission.
 
     * Does not commit changes *
 
+    :param submission:
+    :param refresh_best: update the best submission for the student
     :return:
     """
 
@@ -289,12 +433,12 @@ def reject_late_submission(submission: Submission):
         test_result: SubmissionTestResult
         test_result.passed = False
         test_result.message = 'Late submissions not accepted'
-        test_result.stdout = ''
+        set_stdout(test_result, '')
         db.session.add(test_result)
 
     # Go through build results, and set them to rejected
     submission.build.passed = False
-    submission.build.stdout = 'Late submissions not accepted'
+    set_stdout(submission.build, 'Late submissions not accepted')
     db.session.add(submission.build)
 
     # Set the fields on self to be rejected
@@ -303,11 +447,19 @@ def reject_late_submission(submission: Submission):
     submission.state = "Late submissions not accepted"
     db.session.add(submission)
 
+    # The rejected submission can no longer be the best submission
+    if refresh_best:
+        refresh_student_assignment_best(submission.owner_id, submission.assignment_id)
 
-def init_submission(submission: Submission, commit: bool = True):
+
+def init_submission(submission: Submission, commit: bool = True, refresh_best: bool = True):
     """
     Create adjacent submission models.
 
+    :param submission:
+    :param commit:
+    :param refresh_best: update the best submission for the student (the
+                         results of the submission were just reset)
     :return:
     """
 
@@ -339,6 +491,39 @@ def init_submission(submission: Submission, commit: bool = True):
     submission.state = "Waiting for resources..."
     db.session.add(submission)
 
+    # The reset submission can no longer be the best submission
+    if refresh_best and submission.owner_id is not None:
+        refresh_student_assignment_best(submission.owner_id, submission.assignment_id)
+
     if commit:
         # Commit new models
         db.session.commit()
+
+
+def offload_submission_logs(limit: int = 1000) -> int:
+    """
+    Move build and test stdout that is still stored inline (from before
+    the log store) into the log store. At most limit rows of each are
+    moved, so this can be called repeatedly to work through a backlog.
+
+    :param limit:
+    :return: number of rows moved
+    """
+
+    moved = 0
+    for model in [SubmissionBuild, SubmissionTestResult]:
+        # Find rows with inline stdout
+        rows = model.query.filter(
+            model.stdout_key == None,
+            model.stdout != None,
+            model.stdout != '',
+        ).options(undefer(model.stdout)).limit(limit).all()
+
+        # Move them into the log store
+        for row in rows:
+            set_stdout(row, row.stdout)
+        moved += len(rows)
+
+        db.session.commit()
+
+    return moved
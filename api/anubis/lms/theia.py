@@ -1,29 +1,47 @@
+import json
+import time
 from datetime import datetime
-from typing import List, Tuple, Union, Dict
+from typing import List, Tuple, Union, Dict, Iterator, Optional
 
+from redis.client import PubSub
+from redis.exceptions import RedisError
 from werkzeug.utils import redirect
 
+from anubis.config import config
 from anubis.models import TheiaSession, User, Config
 from anubis.utils.auth.token import create_token
 from anubis.utils.data import is_debug
-from anubis.utils.cache import cache
+from anubis.utils.cache import cache, get_redis_connection
 from anubis.utils.config import get_config_int
+from anubis.utils.logging import logger
+from anubis.utils.pagination import keyset_paginate
+
+# Redis pub/sub channel for theia session updates. Each session
+# gets its own channel so that listeners only get woken up for the
+# session they are waiting on.
+THEIA_SESSION_CHANNEL = 'anubis:theia:session:{}'
+
+# Session states where the session is no longer starting up
+THEIA_SESSION_DONE_STATES = {"Running", "Ended", "Failed"}
 
 
 @cache.memoize(timeout=5, source_check=True)
-def get_recent_sessions(user_id: str, limit: int = 10, offset: int = 10) -> List[Dict]:
-    student = User.query.filter(
-        User.id == user_id,
-    ).first()
+def get_recent_sessions(user_id: str, limit: int = 10, cursor: str = None) -> Tuple[List[Dict], Optional[str]]:
+    """
+    Get the most recent theia sessions for a user, newest first. Older
+    sessions can be paged through with the cursor from the previous page.
 
-    sessions: List[TheiaSession] = TheiaSession.query.filter(
-        TheiaSession.owner_id == student.id,
-    ).order_by(TheiaSession.created.desc()).limit(limit).offset(offset).all()
+    :param user_id:
+    :param limit:
+    :param cursor: cursor from the previous page, or None for the first page
+    :return: list of session data, cursor for the next page
+    """
+    sessions, next_cursor = keyset_paginate(
+        TheiaSession.query.filter(TheiaSession.owner_id == user_id),
+        [TheiaSession.created, TheiaSession.id], cursor, limit,
+    )
 
-    return [
-        session.data
-        for session in sessions
-    ]
+    return [session.data for session in sessions], next_cursor
 
 
 @cache.memoize(timeout=5, unless=is_debug)
@@ -65,7 +83,7 @@ def theia_redirect(theia_session: TheiaSession, user: User):
 
 
 @cache.memoize(timeout=3, unless=is_debug)
-def theia_list_all(user_id: str, limit: int = 10):
+def theia_list_all(user_id: str, limit: int = 10, cursor: str = None):
     """
     List all theia sessions that are currently active. Order by the time
     they were created.
@@ -74,15 +92,12 @@ def theia_list_all(user_id: str, limit: int = 10):
 
     :param user_id:
     :param limit:
+    :param cursor: cursor from the previous page, or None for the first page
     :return:
     """
-    theia_sessions: List[TheiaSession] = (
-        TheiaSession.query.filter(
-            TheiaSession.owner_id == user_id,
-        )
-            .order_by(TheiaSession.created.desc())
-            .limit(limit)
-            .all()
+    theia_sessions, _ = keyset_paginate(
+        TheiaSession.query.filter(TheiaSession.owner_id == user_id),
+        [TheiaSession.created, TheiaSession.id], cursor, limit,
     )
 
     return [theia_session.data for theia_session in theia_sessions]
@@ -117,6 +132,106 @@ def theia_poll_ide(theia_session_id: str, user_id: str) -> Union[None, dict]:
     return theia_session.data
 
 
+def theia_session_status(session_data: dict) -> dict:
+    """
+    Build the status response for a theia session. This is what
+    the frontend uses to decide if it should keep showing the
+    loading spinner.
+
+    :param session_data: theia_session.data
+    :return:
+    """
+
+    # Check to see if it is still initializing
+    session_state = session_data["state"]
+    loading = session_state not in THEIA_SESSION_DONE_STATES
+
+    # Map of session state code to the status message that should
+    # be displayed on the frontend.
+    status, variant = {
+        "Running": ("Session is now ready.", "success"),
+        # "Ended": ("Session ended.", "warning"),
+        "Failed": ("Session failed to start. Please try again.", "error"),
+    }.get(session_state, (None, None))
+
+    return {
+        "loading": loading,
+        "session": session_data,
+        "status": status,
+        "variant": variant,
+    }
+
+
+def publish_theia_session(theia_session: TheiaSession):
+    """
+    Publish the current state of a theia session to its pub/sub
+    channel. Anyone waiting on the session (ie: the ide events
+    endpoint) will be woken up with the new session data.
+
+    A failure to publish is logged, but never raised. Listeners
+    will still pick up the change when they time out.
+
+    :param theia_session:
+    :return:
+    """
+
+    # There is no redis in MINDEBUG
+    if config.MINDEBUG:
+        return
+
+    try:
+        get_redis_connection().publish(
+            THEIA_SESSION_CHANNEL.format(theia_session.id),
+            json.dumps(theia_session.data),
+        )
+    except RedisError as e:
+        logger.warning('unable to publish theia session {} {}'.format(theia_session.id, e))
+
+
+def subscribe_theia_session(theia_session_id: str) -> Optional[PubSub]:
+    """
+    Subscribe to updates for a theia session. The subscription is
+    made right away so that nothing published after this call is
+    missed. Returns None if there is no redis (ie: MINDEBUG).
+
+    :param theia_session_id:
+    :return:
+    """
+
+    # There is no redis in MINDEBUG. The caller will
+    # need to fall back to polling.
+    if config.MINDEBUG:
+        return None
+
+    pubsub = get_redis_connection().pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe(THEIA_SESSION_CHANNEL.format(theia_session_id))
+    return pubsub
+
+
+def listen_theia_session(pubsub: PubSub, timeout: float = 25.0) -> Iterator[Optional[dict]]:
+    """
+    Listen on a theia session subscription. Session data is yielded
+    for each update that is published. None is yielded every second
+    without an update so that the caller can send keepalives. The
+    generator ends after timeout seconds. The caller is responsible
+    for closing the subscription.
+
+    :param pubsub: subscription from subscribe_theia_session
+    :param timeout:
+    :return:
+    """
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        message = pubsub.get_message(timeout=1.0)
+
+        # Nothing was published
+        if message is None:
+            yield None
+            continue
+
+        yield json.loads(message["data"])
+
+
 def mark_session_ended(theia_session: TheiaSession):
     """
     Mark the database entries for the
@@ -130,5 +245,64 @@ def mark_session_ended(theia_session: TheiaSession):
     theia_session.ended = datetime.now()
 
 
+def publish_theia_sessions(theia_session_ids: List[str]):
+    """
+    Publish the current state of many theia sessions. The
+    sessions are loaded in a single query. This should only
+    be called after the changes to the sessions have been
+    committed.
+
+    :param theia_session_ids:
+    :return:
+    """
+
+    # Nothing to publish, or no redis in MINDEBUG
+    if len(theia_session_ids) == 0 or config.MINDEBUG:
+        return
+
+    theia_sessions = TheiaSession.query.filter(
+        TheiaSession.id.in_(theia_session_ids),
+    ).all()
+    for theia_session in theia_sessions:
+        publish_theia_session(theia_session)
+
+
+def mark_sessions_ended(theia_session_ids: List[str]) -> List[str]:
+    """
+    Mark the database entries for many theia sessions
+    as ended in a single update. Sessions that have
+    already been marked as inactive are left alone.
+
+    The ids of the sessions that were ended are returned
+    so that their state can be published once the update
+    is committed.
+
+    :param theia_session_ids:
+    :return: ids of the sessions that were ended
+    """
+
+    # Find the sessions that are actually being ended
+    ended_ids = [
+        theia_session_id
+        for theia_session_id, in TheiaSession.query.filter(
+            TheiaSession.id.in_(theia_session_ids),
+            TheiaSession.active == True,
+        ).with_entities(TheiaSession.id).all()
+    ]
+
+    if len(ended_ids) == 0:
+        return ended_ids
+
+    TheiaSession.query.filter(
+        TheiaSession.id.in_(ended_ids),
+    ).update({
+        TheiaSession.active: False,
+        TheiaSession.state: "Ended",
+        TheiaSession.ended: datetime.now(),
+    }, synchronize_session=False)
+
+    return ended_ids
+
+
 def get_theia_pod_name(theia_session: TheiaSession) -> str:
     return f"theia-{theia_session.owner.netid}-{theia_session.id}"
@@ -1,6 +1,26 @@
-from anubis.models import db, User, AssignmentRepo
-from anubis.lms.repos import get_repos
-from anubis.utils.cache import cache
+import hashlib
+import hmac
+from datetime import timedelta
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy.exc import IntegrityError
+
+from anubis.config import config
+from anubis.models import (
+    db,
+    User,
+    Assignment,
+    AssignmentRepo,
+    Course,
+    InCourse,
+    Submission,
+    WebhookDelivery,
+)
+from anubis.utils.cache import tagged_memoize
+from anubis.utils.data import is_debug, req_assert
+from anubis.lms.assignments import get_assignment_due_date
+from anubis.lms.submissions import reject_late_submission, init_submission
+from anubis.utils.logging import logger
 
 
 def parse_webhook(webhook):
@@ -29,6 +49,61 @@ def parse_webhook(webhook):
     )
 
 
+@tagged_memoize(
+    timeout=60 * 60, tags=lambda: ['assignment_codes'], unless=is_debug,
+    local_timeout=60 * 60, local_maxsize=1, local_copy=False,
+)
+def get_assignment_code_index() -> Dict[str, str]:
+    """
+    Get the index of assignment unique codes to assignment ids. The
+    index is loaded once per process, and reloaded whenever an
+    assignment is written.
+
+    * The index is shared, do not modify it *
+
+    :return:
+    """
+    return dict(db.session.query(Assignment.unique_code, Assignment.id).all())
+
+
+@tagged_memoize(
+    timeout=60 * 60, tags=lambda: ['github_usernames'], unless=is_debug,
+    local_timeout=60 * 60, local_maxsize=1, local_copy=False,
+)
+def get_github_username_index() -> Dict[str, str]:
+    """
+    Get the index of github usernames to user ids. The index is
+    loaded once per process, and reloaded whenever a user is written.
+
+    * The index is shared, do not modify it *
+
+    :return:
+    """
+    return dict(db.session.query(User.github_username, User.id).filter(
+        User.github_username != None,
+        User.github_username != '',
+    ).all())
+
+
+def get_repo_assignment(repo_name: str) -> Optional[Assignment]:
+    """
+    Match the name of an assignment repo to its assignment. The
+    unique code of the assignment is one of the dash separated
+    parts of the repo name.
+
+    :param repo_name:
+    :return:
+    """
+    assignment_codes = get_assignment_code_index()
+
+    for code in repo_name.split("-"):
+        assignment_id = assignment_codes.get(code, None)
+        if assignment_id is not None:
+            return Assignment.query.filter(Assignment.id == assignment_id).first()
+
+    return None
+
+
 def guess_github_username(assignment, repo_name):
     """
     In order to match a webhook to a user, we need to know the github username
@@ -47,10 +122,11 @@ def guess_github_username(assignment, repo_name):
     repo_name_split = repo_name_split[unique_code_index + 1:]
     github_username1 = "-".join(repo_name_split)
     github_username2 = "-".join(repo_name_split[:-1])
-    user = User.query.filter(
-        User.github_username.in_([github_username1, github_username2]),
-        User.github_username != ''
-    ).first()
+
+    # Look the user up in the username index
+    github_usernames = get_github_username_index()
+    user_id = github_usernames.get(github_username1, None) or github_usernames.get(github_username2, None)
+    user = User.query.filter(User.id == user_id).first() if user_id is not None else None
 
     github_username_guess = github_username1
     if user is None:
@@ -62,7 +138,7 @@ def guess_github_username(assignment, repo_name):
     return user, github_username_guess
 
 
-def check_repo(assignment, repo_url, github_username, user=None) -> AssignmentRepo:
+def check_repo(assignment, repo_url, github_username, user=None, commit: bool = True) -> AssignmentRepo:
     """
     While processing the webhook, we need to check to see if we have
     record of the repo. This function takes what it needs to create
@@ -72,6 +148,7 @@ def check_repo(assignment, repo_url, github_username, user=None) -> AssignmentRe
     :param repo_url:
     :param github_username:
     :param user:
+    :param commit: commit the new repo (otherwise it is only flushed)
     :return:
     """
 
@@ -99,10 +176,221 @@ def check_repo(assignment, repo_url, github_username, user=None) -> AssignmentRe
             github_username=github_username,
         )
         db.session.add(repo)
-        db.session.commit()
-
-        if user is not None:
-            cache.delete_memoized(get_repos, user.id)
+        if commit:
+            db.session.commit()
+        else:
+            db.session.flush()
 
     # Return the repo object
     return repo
+
+
+def verify_webhook_signature(body: bytes, signature: Optional[str]) -> bool:
+    """
+    Verify the X-Hub-Signature-256 header github sends with each
+    webhook. The signature is an hmac sha256 of the raw body, keyed
+    with the webhook secret. If no secret is configured, then every
+    webhook passes.
+
+    :param body: raw request body
+    :param signature: value of the X-Hub-Signature-256 header
+    :return:
+    """
+
+    # Nothing to check against
+    if not config.GITHUB_WEBHOOK_SECRET:
+        return True
+
+    if signature is None:
+        return False
+
+    expected = 'sha256=' + hmac.new(
+        config.GITHUB_WEBHOOK_SECRET.encode(), body, hashlib.sha256,
+    ).hexdigest()
+
+    return hmac.compare_digest(expected, signature)
+
+
+def record_webhook_delivery(delivery_id: str, webhook) -> bool:
+    """
+    Write the record of a push webhook delivery, to be processed
+    later. Github retries deliveries that are slow to respond, so
+    the delivery id is used as an idempotency key. Deliveries that
+    were already recorded are not recorded again.
+
+    :param delivery_id: X-GitHub-Delivery
+    :param webhook: push webhook payload
+    :return: True if the delivery is new
+    """
+
+    # Load the basics from the webhook
+    repo_url, repo_name, pusher_username, commit, before, ref = parse_webhook(webhook)
+
+    delivery = WebhookDelivery(
+        id=delivery_id,
+        repo_url=repo_url,
+        repo_name=repo_name,
+        pusher_username=pusher_username,
+        commit=commit,
+        before=before,
+        ref=ref,
+    )
+
+    # The primary key on the delivery id keeps two copies of
+    # the same delivery from both being recorded.
+    try:
+        db.session.add(delivery)
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return False
+
+    return True
+
+
+def process_webhook_delivery(delivery: WebhookDelivery) -> Tuple[str, Optional[Submission]]:
+    """
+    Process a recorded push webhook. The push is matched to an
+    assignment and repo, and a submission is created for the commit.
+
+    Deliveries that can not be processed raise an AssertError. Anything
+    done before the error (ie: dangling repos and submissions) is kept.
+
+    Processing a delivery more than once is safe. Submissions are
+    matched on their commit, so the same push never makes two.
+
+    * Does not commit changes *
+
+    :param delivery:
+    :return: status message, submission to enqueue (if there is one)
+    """
+
+    # Attempt to find records for the relevant models
+    assignment = get_repo_assignment(delivery.repo_name)
+
+    # Verify that we can match this push to an assignment
+    req_assert(assignment is not None, message='assignment not found', status_code=406)
+
+    # Get github username from the repository name
+    user, github_username_guess = guess_github_username(assignment, delivery.repo_name)
+
+    # The before Hash will be all 0s on for the first hash.
+    # We will want to ignore both this first push (the initialization of the repo)
+    # and all branches that are not master.
+    if delivery.before == "0000000000000000000000000000000000000000":
+        # Record that a new repo was created (and therefore, someone just
+        # started their assignment)
+        logger.debug(
+            "new student repo ",
+            extra={
+                "repo_url": delivery.repo_url,
+                "github_username": github_username_guess,
+                "pusher": delivery.pusher_username,
+                "commit": delivery.commit,
+            },
+        )
+
+        repo = check_repo(assignment, delivery.repo_url, github_username_guess, user, commit=False)
+
+        if repo.owner_id is None:
+            return "initial dangling", None
+
+        return "initial commit", None
+
+    repo = (
+        AssignmentRepo.query
+            .join(Assignment).join(Course).join(InCourse).join(User)
+            .filter(
+            User.github_username == github_username_guess,
+            Assignment.unique_code == assignment.unique_code,
+            AssignmentRepo.repo_url == delivery.repo_url,
+        )
+            .first()
+    )
+
+    logger.debug(
+        "webhook data",
+        extra={
+            "assignment": assignment.name,
+            "repo_url": delivery.repo_url,
+            "commit": delivery.commit,
+            "unique_code": assignment.unique_code,
+        },
+    )
+
+    org_name = assignment.course.github_org
+    if not is_debug() and org_name is not None and org_name != '':
+        # Make sure that the repo we're about to process actually belongs to
+        # a github organization that matches the course.
+        if not delivery.repo_url.startswith(f'https://github.com/{org_name}'):
+            logger.error(
+                "Invalid github organization in webhook.",
+                extra={
+                    "repo_url": delivery.repo_url,
+                    "pusher_username": delivery.pusher_username,
+                    "commit": delivery.commit,
+                },
+            )
+            req_assert(False, message='invalid repo', status_code=406)
+
+    # if we dont have a record of the repo, then add it
+    if repo is None:
+        repo = check_repo(assignment, delivery.repo_url, github_username_guess, user, commit=False)
+
+    req_assert(
+        delivery.ref == 'refs/heads/master' or delivery.ref == 'refs/heads/main',
+        message='not a push to master or main',
+    )
+
+    # Try to find a submission matching the commit
+    submission = Submission.query.filter_by(commit=delivery.commit).first()
+
+    # If the submission does not exist, then create one. The submission
+    # is dated to when the push came in, not when it was processed.
+    if submission is None:
+        # Create a shiny new submission
+        submission = Submission(
+            assignment=assignment,
+            repo=repo,
+            owner=user,
+            commit=delivery.commit,
+            state="Waiting for resources...",
+            created=delivery.created,
+        )
+        db.session.add(submission)
+        db.session.flush()
+
+    # If the submission did already exist, then we can just pass
+    # back that status
+    elif submission.created < delivery.created - timedelta(minutes=3):
+        return 'already created', None
+
+    delivery.submission_id = submission.id
+
+    # Create the related submission models
+    init_submission(submission, commit=False)
+
+    # If a user has not given us their github username
+    # the submission will stay in a "dangling" state
+    req_assert(user is not None, message='dangling submission')
+
+    # If the github username is not found, create a dangling submission
+    if assignment.autograde_enabled:
+
+        # Check that the current assignment is still accepting submissions
+        # at the time of the push.
+        if not assignment.accept_late and delivery.created > get_assignment_due_date(
+                user.id, assignment.id, grace=True
+        ):
+            reject_late_submission(submission)
+
+    else:
+        submission.processed = True
+        submission.accepted = False
+        submission.state = 'autograde disabled for this assignment'
+
+    # If the submission was accepted, then it should be enqueued
+    if submission.accepted:
+        return "submission accepted", submission
+
+    return "submission accepted", None
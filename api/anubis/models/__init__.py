@@ -8,6 +8,7 @@ from sqlalchemy.orm import deferred
 from sqlalchemy_json import MutableJson
 
 from anubis.utils.data import rand
+from anubis.utils.log_store import get_stdout_preview
 
 db = SQLAlchemy()
 
@@ -175,6 +176,11 @@ class ProfessorForCourse(db.Model):
 
 class InCourse(db.Model):
     __tablename__ = "in_course"
+    __table_args__ = (
+        # The primary key covers lookups by owner. This
+        # covers listing the students in a course.
+        db.Index("ix_in_course_course_id_owner_id", "course_id", "owner_id"),
+    )
 
     # Foreign Keys
     owner_id = db.Column(db.String(128), db.ForeignKey(User.id), primary_key=True)
@@ -277,7 +283,7 @@ class AssignmentRepo(db.Model):
 
     # Fields
     github_username = db.Column(db.TEXT, nullable=False)
-    repo_url = db.Column(db.String(512), nullable=False)
+    repo_url = db.Column(db.String(512), nullable=False, index=True)
 
     # State booleans
     repo_created = db.Column(db.Boolean, default=False)
@@ -402,14 +408,28 @@ class AssignedStudentQuestion(db.Model):
             AssignedQuestionResponse.assigned_question_id == self.id,
         ).order_by(AssignedQuestionResponse.created.desc()).first()
 
-        response_data = {'submitted': None, 'late': True, 'text': self.question.placeholder}
+        return self.build_data(self.id, self.question, response)
+
+    @staticmethod
+    def build_data(assigned_question_id: str, question: AssignmentQuestion, response=None):
+        """
+        Build the dictionary representation of a question assignment
+        without needing the row itself (ie: for bulk inserted rows).
+
+        :param assigned_question_id:
+        :param question:
+        :param response: latest AssignedQuestionResponse, if any
+        :return:
+        """
+
+        response_data = {'submitted': None, 'late': True, 'text': question.placeholder}
         if response is not None:
             response_data = response.data
 
         return {
-            "id": self.id,
+            "id": assigned_question_id,
             "response": response_data,
-            "question": self.question.data,
+            "question": question.data,
         }
 
     @property
@@ -450,6 +470,18 @@ class AssignedQuestionResponse(db.Model):
 
 class Submission(db.Model):
     __tablename__ = "submission"
+    __table_args__ = (
+        # Listing a user's submissions (optionally for one assignment),
+        # newest first. These let pages be read straight off the index.
+        db.Index("ix_submission_owner_id_created", "owner_id", "created"),
+        db.Index("ix_submission_assignment_id_owner_id_created", "assignment_id", "owner_id", "created"),
+
+        # Finding the accepted submissions of students for autograde
+        db.Index(
+            "ix_submission_assignment_id_owner_id_processed_accepted",
+            "assignment_id", "owner_id", "processed", "accepted", "created",
+        ),
+    )
 
     # id
     id = default_id()
@@ -466,7 +498,7 @@ class Submission(db.Model):
     )
 
     # Timestamps
-    created = db.Column(db.DateTime, default=datetime.now)
+    created = db.Column(db.DateTime, default=datetime.now, index=True)
     last_updated = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
 
     # Fields
@@ -490,19 +522,18 @@ class Submission(db.Model):
         Get a list of dictionaries of the matching Test, and TestResult
         for the current submission.
 
+        The test results are already loaded with the submission. Load
+        submissions with submission_data_options (lms.submissions) to
+        avoid a query for each test.
+
         :return:
         """
 
-        # Query for matching AssignmentTests, and TestResults
-        tests = SubmissionTestResult.query.join(AssignmentTest).filter(
-            SubmissionTestResult.submission_id == self.id,
-            AssignmentTest.hidden == False,
-        ).all()
-
         # Convert to dictionary data
         return [
             {"test": result.assignment_test.data, "result": result.data}
-            for result in tests
+            for result in self.test_results
+            if result.assignment_test is not None and result.assignment_test.hidden is False
         ]
 
     @property
@@ -511,18 +542,18 @@ class Submission(db.Model):
         Get a list of dictionaries of the matching Test, and TestResult
         for the current submission.
 
+        The test results are already loaded with the submission. Load
+        submissions with submission_data_options (lms.submissions) to
+        avoid a query for each test.
+
         :return:
         """
 
-        # Query for matching AssignmentTests, and TestResults
-        tests = SubmissionTestResult.query.join(AssignmentTest).filter(
-            SubmissionTestResult.submission_id == self.id,
-        ).all()
-
         # Convert to dictionary data
         return [
             {"test": result.assignment_test.data, "result": result.data}
-            for result in tests
+            for result in self.test_results
+            if result.assignment_test is not None
         ]
 
     @property
@@ -571,7 +602,7 @@ class SubmissionTestResult(db.Model):
 
     # Foreign Keys
     submission_id = db.Column(
-        db.String(128), db.ForeignKey(Submission.id), primary_key=True
+        db.String(128), db.ForeignKey(Submission.id), primary_key=True, index=True
     )
     assignment_test_id = db.Column(
         db.String(128), db.ForeignKey(AssignmentTest.id), primary_key=True
@@ -586,17 +617,24 @@ class SubmissionTestResult(db.Model):
     message = deferred(db.Column(db.Text))
     passed = db.Column(db.Boolean)
 
+    # Pointer to the stdout in the log store
+    stdout_key = db.Column(db.String(64), nullable=True, default=None)
+    stdout_size = db.Column(db.Integer, nullable=True, default=None)
+
     # Relationships
     assignment_test = db.relationship(AssignmentTest)
 
     @property
     def data(self):
+        stdout, truncated = get_stdout_preview(self)
         return {
             "id": self.id,
             "test_name": self.assignment_test.name,
             "passed": self.passed,
             "message": self.message,
-            "stdout": self.stdout,
+            "stdout": stdout,
+            "stdout_truncated": truncated,
+            "stdout_url": "/api/public/submissions/log/test/" + self.id if truncated else None,
             "created": str(self.created),
             "last_updated": str(self.last_updated),
         }
@@ -628,14 +666,21 @@ class SubmissionBuild(db.Model):
     stdout = deferred(db.Column(db.Text))
     passed = db.Column(db.Boolean, default=None)
 
+    # Pointer to the stdout in the log store
+    stdout_key = db.Column(db.String(64), nullable=True, default=None)
+    stdout_size = db.Column(db.Integer, nullable=True, default=None)
+
     # Timestamps
     created = db.Column(db.DateTime, default=datetime.now)
     last_updated = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
 
     @property
     def data(self):
+        stdout, truncated = get_stdout_preview(self)
         return {
-            "stdout": self.stdout,
+            "stdout": stdout,
+            "stdout_truncated": truncated,
+            "stdout_url": "/api/public/submissions/log/build/" + self.id if truncated else None,
             "passed": self.passed,
         }
 
@@ -648,6 +693,16 @@ class SubmissionBuild(db.Model):
 
 class TheiaSession(db.Model):
     __tablename__ = "theia_session"
+    __table_args__ = (
+        # Listing a user's sessions newest first
+        db.Index("ix_theia_session_owner_id_created", "owner_id", "created"),
+
+        # Finding active sessions that have been proxied to recently
+        db.Index(
+            "ix_theia_session_active_k8s_requested_last_proxy",
+            "active", "k8s_requested", "last_proxy", "course_id",
+        ),
+    )
 
     # id
     id = default_id(32)
@@ -678,8 +733,8 @@ class TheiaSession(db.Model):
     k8s_requested = db.Column(db.Boolean, default=False)
 
     # Timestamps
-    created = db.Column(db.DateTime, default=datetime.now)
-    ended = db.Column(db.DateTime, nullable=True, default=None)
+    created = db.Column(db.DateTime, default=datetime.now, index=True)
+    ended = db.Column(db.DateTime, nullable=True, default=None, index=True)
     last_proxy = db.Column(db.DateTime, default=datetime.now)
     last_updated = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
 
@@ -723,6 +778,51 @@ class TheiaSession(db.Model):
         }
 
 
+class WebhookDelivery(db.Model):
+    __tablename__ = "webhook_delivery"
+    __table_args__ = (
+        # Finding pending deliveries, oldest first
+        db.Index("ix_webhook_delivery_state_created", "state", "created"),
+    )
+
+    # GitHub delivery id (X-GitHub-Delivery)
+    id = db.Column(db.String(128), primary_key=True)
+
+    # The parts of the push payload needed to process it
+    repo_url = db.Column(db.String(512), nullable=False)
+    repo_name = db.Column(db.String(256), nullable=False)
+    pusher_username = db.Column(db.String(256), nullable=True)
+    commit = db.Column(db.String(128), nullable=False)
+    before = db.Column(db.String(128), nullable=False)
+    ref = db.Column(db.String(256), nullable=False)
+
+    # Processing state (pending, processed, rejected or failed)
+    state = db.Column(db.String(16), default="pending")
+    message = db.Column(db.TEXT, nullable=True)
+    submission_id = db.Column(db.String(128), db.ForeignKey(Submission.id), nullable=True)
+
+    # Number of times processing the delivery has failed
+    attempts = db.Column(db.Integer, default=0)
+
+    # Timestamps
+    created = db.Column(db.DateTime, default=datetime.now)
+    processed = db.Column(db.DateTime, nullable=True, default=None)
+
+    @property
+    def data(self):
+        return {
+            'id': self.id,
+            'repo_url': self.repo_url,
+            'commit': self.commit,
+            'ref': self.ref,
+            'state': self.state,
+            'message': self.message,
+            'submission_id': self.submission_id,
+            'created': str(self.created),
+            'processed': str(self.processed),
+        }
+
+
 class StaticFile(db.Model):
     __tablename__ = "static_file"
 
@@ -736,6 +836,11 @@ class StaticFile(db.Model):
     blob = deferred(db.Column(db.LargeBinary(length=(2 ** 32) - 1)))
     hidden = db.Column(db.Boolean, default=False)
 
+    # Pointer to the file in the static store. The key is the
+    # sha256 of the file, and is used as its ETag.
+    blob_key = db.Column(db.String(64), nullable=True, default=None)
+    size = db.Column(db.Integer, nullable=True, default=None)
+
     # Timestamps
     created = db.Column(db.DateTime, default=datetime.now)
     last_updated = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
@@ -750,6 +855,8 @@ class StaticFile(db.Model):
             "filename": self.filename,
             "path": self.path,
             "hidden": self.hidden,
+            "etag": self.blob_key,
+            "size": self.size,
             "uploaded": str(self.created)
         }
 
@@ -778,6 +885,81 @@ class LateException(db.Model):
         }
 
 
+class StudentAssignmentBest(db.Model):
+    __tablename__ = "student_assignment_best"
+
+    owner_id = db.Column(db.String(128), db.ForeignKey(User.id), primary_key=True)
+    assignment_id = db.Column(db.String(128), db.ForeignKey(Assignment.id), primary_key=True)
+
+    # Best submission (null if there are no accepted submissions)
+    submission_id = db.Column(db.String(128), db.ForeignKey(Submission.id), nullable=True, index=True)
+
+    # Fields
+    tests_passed = db.Column(db.Integer, default=0)
+
+    # Timestamps
+    created = db.Column(db.DateTime, default=datetime.now)
+    last_updated = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
+
+    @property
+    def data(self):
+        return {
+            'owner_id': self.owner_id,
+            'assignment_id': self.assignment_id,
+            'submission_id': self.submission_id,
+            'tests_passed': self.tests_passed,
+        }
+
+
+class UsageRollup(db.Model):
+    __tablename__ = "usage_rollup"
+    __table_args__ = (
+        # Reading the series for a course
+        db.Index("ix_usage_rollup_course_id_period_bucket", "course_id", "period", "bucket"),
+    )
+
+    # Bucket ('hour' or 'day', and the start of the bucket)
+    period = db.Column(db.String(8), primary_key=True)
+    bucket = db.Column(db.DateTime, primary_key=True)
+
+    # Foreign keys
+    assignment_id = db.Column(db.String(128), db.ForeignKey(Assignment.id), primary_key=True)
+    course_id = db.Column(db.String(128), db.ForeignKey(Course.id), nullable=False)
+
+    # Counters
+    submissions = db.Column(db.Integer, default=0)
+    submitters = db.Column(db.Integer, default=0)
+    ide_starts = db.Column(db.Integer, default=0)
+    ide_minutes = db.Column(db.Float, default=0.0)
+
+    @property
+    def data(self):
+        return {
+            'period': self.period,
+            'bucket': str(self.bucket),
+            'assignment_id': self.assignment_id,
+            'course_id': self.course_id,
+            'submissions': self.submissions,
+            'submitters': self.submitters,
+            'ide_starts': self.ide_starts,
+            'ide_minutes': self.ide_minutes,
+        }
+
+
+class RollupWatermark(db.Model):
+    __tablename__ = "rollup_watermark"
+
+    # Name of the rollup (or github:<org> for the github repo reconciler)
+    name = db.Column(db.String(128), primary_key=True)
+
+    # Rows created before this time have been rolled up
+    watermark = db.Column(db.DateTime, nullable=False)
+
+    # Timestamps
+    created = db.Column(db.DateTime, default=datetime.now)
+    last_updated = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
+
+
 class LectureNotes(db.Model):
     __tablename__ = "lecture_notes"
 
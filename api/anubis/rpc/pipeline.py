@@ -2,7 +2,7 @@ from kubernetes import config, client
 
 from anubis.models import db, Config, Submission
 from anubis.utils.data import with_context
-from anubis.utils.k8s.pipeline import create_pipeline_job_obj, reap_pipeline_jobs
+from anubis.utils.k8s.pipeline import create_pipeline_job_obj
 from anubis.utils.logging import logger
 from anubis.utils.config import get_config_int
 
@@ -13,10 +13,13 @@ def create_submission_pipeline(submission_id: str):
     This function should launch the appropriate testing container
     for the assignment, passing along the function arguments.
 
+    * The submission should already hold a pipeline slot from the
+    scheduler. If the job cannot be created, then the slot is released. *
+
     :param submission_id: submission.id of to test
     """
-    from anubis.utils.rpc import enqueue_autograde_pipeline
     from anubis.lms.submissions import init_submission
+    from anubis.utils.pipeline.scheduler import release_pipeline_slot, set_pipeline_slot_job
 
     # Log the creation event
     logger.info(
@@ -26,23 +29,9 @@ def create_submission_pipeline(submission_id: str):
         },
     )
 
-    # Calculate the maximum number of jobs allowed in the cluster
-    max_jobs = get_config_int('PIPELINE_MAX_JOBS', default=10)
-
     # Initialize kube client
     config.load_incluster_config()
 
-    # Cleanup finished jobs
-    active_jobs = reap_pipeline_jobs()
-
-    if active_jobs > max_jobs:
-        logger.info(
-            "TOO many jobs - re-enqueue {}".format(submission_id),
-            extra={"submission_id": submission_id},
-        )
-        enqueue_autograde_pipeline(submission_id)
-        exit(0)
-
     # Get the database entry for the submission
     submission = Submission.query.filter(
         Submission.id == submission_id
@@ -56,6 +45,7 @@ def create_submission_pipeline(submission_id: str):
                 "submission_id": submission_id,
             },
         )
+        release_pipeline_slot(submission_id)
         return
 
     # If the build field is not present, then
@@ -73,6 +63,61 @@ def create_submission_pipeline(submission_id: str):
     # Log the pipeline job creation
     logger.debug("creating pipeline job: " + job.to_str())
 
+    # Record the job as the holder of the slot before it exists,
+    # so that every event for the job can be matched to the slot.
+    set_pipeline_slot_job(submission_id, job.metadata.name)
+
     # Send to kube api
     batch_v1 = client.BatchV1Api()
-    batch_v1.create_namespaced_job(body=job, namespace="anubis")
+    try:
+        batch_v1.create_namespaced_job(body=job, namespace="anubis")
+    except client.exceptions.ApiException:
+        logger.error(
+            "Unable to create pipeline job {}".format(submission_id),
+            extra={"submission_id": submission_id},
+        )
+        release_pipeline_slot(submission_id)
+        raise
+
+
+@with_context
+def schedule_submission_pipelines():
+    """
+    Launch pipeline jobs for pending submissions while there are
+    free pipeline slots. If there are no free slots, then this returns
+    right away. The pipeline scheduler will call this again when a
+    pipeline job finishes and a slot frees up.
+
+    :return: list of submission ids that were launched
+    """
+    from anubis.utils.pipeline.scheduler import claim_pipeline_slots
+
+    # Calculate the maximum number of jobs allowed in the cluster
+    max_jobs = get_config_int('PIPELINE_MAX_JOBS', default=10)
+
+    # Initialize kube client
+    config.load_incluster_config()
+
+    # Claim the free slots for the highest priority pending submissions
+    submission_ids = claim_pipeline_slots(max_jobs)
+
+    # Log the claimed slots
+    if len(submission_ids) > 0:
+        logger.info(
+            "Scheduling {} submission pipelines".format(len(submission_ids)),
+            extra={"submission_ids": submission_ids},
+        )
+
+    # Launch the pipeline job for each claimed slot
+    launched = []
+    for submission_id in submission_ids:
+        try:
+            create_submission_pipeline(submission_id)
+            launched.append(submission_id)
+        except Exception as e:
+            logger.error(
+                "Failed to launch submission pipeline {} {}".format(submission_id, e),
+                extra={"submission_id": submission_id},
+            )
+
+    return launched
@@ -1,3 +1,7 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import func
+
 from anubis.models import (
     db,
     SubmissionTestResult,
@@ -17,10 +21,15 @@ from anubis.models import (
     ProfessorForCourse,
     StaticFile,
     LateException,
+    StudentAssignmentBest,
     LectureNotes,
+    UsageRollup,
+    RollupWatermark,
+    WebhookDelivery,
 )
 from anubis.utils.data import with_context
 from anubis.lms.questions import assign_questions
+from anubis.utils.visuals.rollups import update_usage_rollups
 from anubis.utils.testing.seed import (
     create_assignment,
     create_students,
@@ -32,6 +41,10 @@ from anubis.utils.testing.seed import (
 @with_context
 def seed():
     # Yeet
+    UsageRollup.query.delete()
+    RollupWatermark.query.delete()
+    WebhookDelivery.query.delete()
+    StudentAssignmentBest.query.delete()
     LateException.query.delete()
     TheiaSession.query.delete()
     AssignedQuestionResponse.query.delete()
@@ -104,3 +117,9 @@ def seed():
     assign_questions(mmds_assignment)
 
     db.session.commit()
+
+    # Roll up the usage for the seeded data. Seeded submissions are
+    # dated around the due date of their assignment, which can be
+    # in the future, so roll up to just past the newest one.
+    newest_submission = db.session.query(func.max(Submission.created)).scalar()
+    update_usage_rollups(until=max(datetime.now(), newest_submission) + timedelta(seconds=1))
@@ -9,6 +9,7 @@ from anubis.utils.k8s.theia import (
     create_theia_k8s_pod_pvc,
     reap_old_theia_sessions,
     reap_theia_session,
+    reap_theia_sessions,
     list_theia_pods,
 )
 from anubis.utils.logging import logger
@@ -164,9 +165,8 @@ def reap_theia_sessions_in_course(course_id: str):
     Reap all theia sessions within a specific course. This will
     kick everyone off their IDEs.
 
-    There may be many database entries that this function updates
-    so we will batch commits to help speed things up, while
-    keeping things relatively consistent in the cluster.
+    There may be many sessions, so they are all reaped with a
+    single kubernetes delete and a single database update.
 
     :param course_id:
     :return:
@@ -180,22 +180,17 @@ def reap_theia_sessions_in_course(course_id: str):
 
     # Find all theia sessions in the database that are
     # marked as active.
-    theia_sessions = TheiaSession.query.filter(
-        TheiaSession.active == True,
-        TheiaSession.course_id == course_id,
-    ).all()
-
-    # Iterate through all active theia sessions in the database, deleting and
-    # updating as we go.
-    for n, theia_session in enumerate(theia_sessions):
-        # Reap the session
-        reap_theia_session(theia_session, commit=False)
-
-        # Batch commits in size of 5
-        if n % 5 == 0:
-            db.session.commit()
+    theia_session_ids = [
+        theia_session_id
+        for theia_session_id, in db.session.query(TheiaSession.id).filter(
+            TheiaSession.active == True,
+            TheiaSession.course_id == course_id,
+        ).all()
+    ]
 
-    db.session.commit()
+    # Delete the resources and update the database entries for
+    # all the sessions at once.
+    reap_theia_sessions(theia_session_ids)
 
 
 @with_context
@@ -3,9 +3,10 @@ from typing import List
 from datetime import datetime, timedelta
 
 from anubis.config import config
-from anubis.models import Assignment, Course
+from anubis.models import db, Assignment, Course
 from anubis.utils.data import with_context
 from anubis.utils.visuals.assignments import get_assignment_sundial
+from anubis.utils.visuals.rollups import update_usage_rollups
 from anubis.utils.visuals.usage import get_usage_plot
 from anubis.utils.config import get_config_int
 
@@ -18,6 +19,10 @@ def create_visuals(*_, **__):
     :return:
     """
 
+    # Roll up the usage since the last run. The usage
+    # visuals are read from the rollups.
+    update_usage_rollups()
+
     course_with_visuals: List[Course] = Course.query.filter(
         Course.display_visuals == True,
     ).all()
@@ -43,3 +48,6 @@ def create_visuals(*_, **__):
 
         # Generate new sundial data
         get_assignment_sundial(assignment.id)
+
+        # Keep any best submissions that were backfilled
+        db.session.commit()
@@ -0,0 +1,130 @@
+import traceback
+from datetime import datetime, timedelta
+
+from sqlalchemy import func
+
+from anubis.models import db, WebhookDelivery
+from anubis.utils.data import with_context
+from anubis.utils.exceptions import AssertError
+from anubis.utils.logging import logger
+
+# Pending deliveries older than this are assumed to have been dropped
+# (ie: the enqueue failed, or the worker died mid batch) and are
+# enqueued again by the reaper.
+WEBHOOK_PENDING_TIMEOUT = timedelta(minutes=2)
+
+# Max number of times a failed delivery is retried
+WEBHOOK_MAX_ATTEMPTS = 5
+
+
+@with_context
+def process_webhook_deliveries(limit: int = 100):
+    """
+    Process pending webhook deliveries in a batch. All the work for the
+    batch is committed at once, then the accepted submissions are
+    enqueued together.
+
+    If a delivery fails unexpectedly, the batch is rolled back and only
+    that delivery is marked as failed. The rest of the batch stays
+    pending for the next run (processing a delivery again is safe).
+
+    :param limit: max number of deliveries to process
+    :return:
+    """
+    from anubis.lms.webhook import process_webhook_delivery
+    from anubis.utils.rpc import enqueue_autograde_pipelines, enqueue_webhook_deliveries
+
+    # Get the oldest pending deliveries. The rows are locked so that two
+    # workers can not process the same delivery. A second worker waits on
+    # the lock, and by the time it gets the rows they are no longer pending.
+    # (SKIP LOCKED would avoid the wait, but needs mariadb 10.6)
+    deliveries = WebhookDelivery.query.filter(
+        WebhookDelivery.state == 'pending',
+    ).order_by(WebhookDelivery.created).limit(limit).with_for_update().all()
+
+    # Nothing to do
+    if len(deliveries) == 0:
+        db.session.commit()
+        return
+
+    submission_ids = []
+    for delivery in deliveries:
+        try:
+            message, submission = process_webhook_delivery(delivery)
+            delivery.state = 'processed'
+            delivery.message = message
+            if submission is not None:
+                submission_ids.append(submission.id)
+
+        # Deliveries that could not be matched to a submission
+        except AssertError as e:
+            delivery.state = 'rejected'
+            delivery.message, _ = e.response()
+
+        # Anything else is a bug. Roll back the batch, and set
+        # the delivery aside so it does not block the others.
+        except Exception as e:
+            logger.error(
+                "Unable to process webhook delivery",
+                extra={"delivery_id": delivery.id, "error": traceback.format_exc()},
+            )
+            delivery_id = delivery.id
+            db.session.rollback()
+            WebhookDelivery.query.filter(WebhookDelivery.id == delivery_id).update({
+                'state': 'failed',
+                'message': str(e),
+                'attempts': func.coalesce(WebhookDelivery.attempts, 0) + 1,
+                'processed': datetime.now(),
+            }, synchronize_session=False)
+            db.session.commit()
+
+            # Pick the rest of the batch back up
+            enqueue_webhook_deliveries()
+            return
+
+        delivery.processed = datetime.now()
+
+    # Commit the whole batch
+    db.session.commit()
+
+    logger.info(f'Processed {len(deliveries)} webhook deliveries')
+
+    # Fresh pushes go on the default queue so they are scheduled
+    # ahead of any regrades.
+    enqueue_autograde_pipelines(submission_ids, queue='default')
+
+    # There may be more deliveries waiting
+    if len(deliveries) == limit:
+        enqueue_webhook_deliveries()
+
+
+@with_context
+def retry_webhook_deliveries() -> int:
+    """
+    Pick back up deliveries that were dropped. Deliveries that have been
+    pending for a while (the enqueue failed, or the worker died) and
+    deliveries that failed (fewer than WEBHOOK_MAX_ATTEMPTS times) are
+    enqueued for processing again.
+
+    :return: number of deliveries picked back up
+    """
+    from anubis.utils.rpc import enqueue_webhook_deliveries
+
+    # Put failed deliveries back in the pending state
+    retried = WebhookDelivery.query.filter(
+        WebhookDelivery.state == 'failed',
+        func.coalesce(WebhookDelivery.attempts, 0) < WEBHOOK_MAX_ATTEMPTS,
+    ).update({'state': 'pending'}, synchronize_session=False)
+    db.session.commit()
+
+    # Count the pending deliveries that should have been processed by now
+    stale = WebhookDelivery.query.filter(
+        WebhookDelivery.state == 'pending',
+        WebhookDelivery.created < datetime.now() - WEBHOOK_PENDING_TIMEOUT,
+    ).count()
+
+    if retried + stale > 0:
+        logger.info(f'Retrying webhook deliveries (failed={retried} stale={stale})')
+        enqueue_webhook_deliveries()
+
+    return retried + stale
@@ -1,7 +1,50 @@
+import copy
+import functools
+import hashlib
+import inspect
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Optional, Callable, Iterable, List, Dict, Set
+
 from flask_caching import Cache
+from redis import Redis, ConnectionPool
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from anubis.config import config
+from anubis.utils.logging import logger
 
 cache = Cache()
 
+# Process wide redis connection pool. This is created
+# lazily so that importing this module does not require
+# a redis connection (ie: MINDEBUG).
+_redis_pool: Optional[ConnectionPool] = None
+
+
+def get_redis_connection() -> Redis:
+    """
+    Get a redis client that uses the process wide connection
+    pool. Connections are reused between calls instead of doing
+    a new tcp handshake every time.
+
+    :return:
+    """
+    global _redis_pool
+
+    # Create the pool on first use
+    if _redis_pool is None:
+        _redis_pool = ConnectionPool(
+            host=config.CACHE_REDIS_HOST,
+            password=config.CACHE_REDIS_PASSWORD,
+        )
+
+    return Redis(connection_pool=_redis_pool)
+
 
 @cache.memoize(timeout=1)
 def cache_health():
@@ -13,3 +56,469 @@ def cache_health():
     :return:
     """
     return None
+
+
+# Tagged cache
+#
+# Entries made by tagged_memoize are tagged with the entities they were built
+# from (ie: user:<id>, assignment:<id>, course:<id>). A user's submissions
+# and repos have their own tags (user_submissions:<id>, user_repos:<id>) so
+# that submission updates from the pipeline do not drop the user's other
+# entries. Each tag has a version stored in the cache. An entry remembers the
+# versions of its tags at the time it was built, and is only served while all
+# of those versions are current. Invalidating a tag is then just giving it a
+# new version.
+#
+# Tags are invalidated automatically when models are committed. The
+# CACHE_TAG_COLUMNS map below says which tags a row of each table affects.
+#
+# Functions that are called many times per request (ie: config lookups) can
+# also keep entries in a small in process cache (local_timeout). The local
+# caches in every process are cleared of invalidated tags over a redis
+# pub/sub channel, so there is no round trip to redis on a local hit.
+
+# Prefix for the tag version keys
+_TAG_VERSION_PREFIX = 'anubis:tag:'
+
+# Redis pub/sub channel that invalidated tags are published to
+_LOCAL_INVALIDATE_CHANNEL = 'anubis:cache:invalidate'
+
+# Map of table name to the tags that a write to a row should invalidate.
+# Each tag is a (tag_name, column) pair. The column value is appended to the
+# tag name (ie: ('user', 'owner_id') -> user:<owner_id>). If the column is
+# None, then the tag name is used as is.
+CACHE_TAG_COLUMNS: Dict[str, List[tuple]] = {
+    'anubis_config': [('config', 'key')],
+    'user': [('user', 'id'), ('github_usernames', None)],
+    'course': [('course', 'id'), ('courses', None)],
+    'in_course': [('user', 'owner_id')],
+    'ta_for_course': [('user', 'owner_id'), ('course_admins', 'course_id')],
+    'professor_for_course': [('user', 'owner_id'), ('course_admins', 'course_id')],
+    'assignment': [('assignment', 'id'), ('course', 'course_id'), ('assignment_codes', None)],
+    'assignment_test': [('assignment', 'assignment_id')],
+    'assignment_repo': [('user_repos', 'owner_id')],
+    'late_exception': [('user', 'user_id')],
+    'submission': [('user_submissions', 'owner_id'), ('submission', 'id')],
+    'submission_build': [('submission', 'submission_id')],
+    'submission_test_result': [('submission', 'submission_id')],
+    'static_file': [('static_file', 'id')],
+}
+
+# Stack of the tagged computations running in this thread. Tags and
+# timeout limits from nested calls are added to the top of the stack.
+_tag_context = threading.local()
+
+
+class _TaggedComputation(object):
+    def __init__(self, tags: Set[str], timeout: int):
+        self.tags = set()
+        self.timeout = timeout
+
+        # Versions of the tags from before their data was read
+        self.versions: Dict[str, Optional[str]] = {}
+        self.add_tags(tags)
+
+    def add_tags(self, tags: Iterable[str]):
+        """
+        Add tags to the computation, taking their current versions. The
+        versions are taken when the tag is added (before the function reads
+        any more data), so that a write committed while the function is
+        running is caught when the versions are checked again at the end.
+        """
+        new_tags = set(tags) - self.tags
+        if len(new_tags) == 0:
+            return
+        self.tags.update(new_tags)
+        self.versions.update(_get_or_create_tag_versions(new_tags))
+
+
+def _tag_stack() -> List[_TaggedComputation]:
+    if not hasattr(_tag_context, 'stack'):
+        _tag_context.stack = []
+    return _tag_context.stack
+
+
+def cache_tag(*tags: str):
+    """
+    Add tags to the tagged cache entry that is currently being
+    built. Use this for tags that can only be known once the
+    function is running (ie: the courses a user is in). This
+    is a no-op when not called within a tagged_memoize function.
+
+    :param tags:
+    :return:
+    """
+    stack = _tag_stack()
+    if len(stack) > 0:
+        stack[-1].add_tags(tags)
+
+
+def limit_cache_timeout(timeout: int):
+    """
+    Make the tagged cache entry that is currently being built expire
+    in at most `timeout` seconds. This is for results that depend on
+    the time (ie: a due date passing), which no write will invalidate.
+
+    :param timeout:
+    :return:
+    """
+    stack = _tag_stack()
+    if len(stack) > 0:
+        stack[-1].timeout = max(1, min(stack[-1].timeout, int(timeout)))
+
+
+class _LocalCache(object):
+    """
+    Size bounded, in process LRU cache with a TTL on each entry.
+    Entries also hold their tags so they can be invalidated.
+    """
+
+    def __init__(self, name: str, maxsize: int):
+        self.name = name
+        self.maxsize = maxsize
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[tuple]:
+        with self._lock:
+            entry = self._entries.get(key, None)
+            if entry is None:
+                return None
+
+            # Drop expired entries
+            value, tags, expires = entry
+            if expires <= time.monotonic():
+                del self._entries[key]
+                return None
+
+            # Mark as recently used
+            self._entries.move_to_end(key)
+            return value, tags
+
+    def set(self, key: str, value, tags: Set[str], timeout: int):
+        with self._lock:
+            self._entries[key] = (value, tags, time.monotonic() + timeout)
+            self._entries.move_to_end(key)
+
+            # Drop the least recently used entries
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate_tags(self, tags: Set[str]):
+        with self._lock:
+            for key in [key for key, (_, entry_tags, _) in self._entries.items() if not entry_tags.isdisjoint(tags)]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# All the local caches in this process
+_local_caches: List[_LocalCache] = []
+
+# Hit and miss counters for tagged functions in this process
+_cache_stats: Dict[str, Dict[str, int]] = {}
+
+# Pid of the process the invalidation listener was started in. Gunicorn
+# preloads the app before forking, so a listener started in the parent
+# will not be running in the workers.
+_listener_pid: Optional[int] = None
+
+
+def _invalidate_local_caches(tags: Set[str]):
+    for local_cache in _local_caches:
+        local_cache.invalidate_tags(tags)
+
+
+def _clear_local_caches():
+    for local_cache in _local_caches:
+        local_cache.clear()
+
+
+def _invalidation_listener():
+    """
+    Listen for invalidated tags from other processes, dropping them
+    from the local caches. The local caches are cleared each time
+    we (re)subscribe, as anything published while we were not
+    subscribed was missed.
+
+    * Runs forever in a daemon thread *
+    """
+    while True:
+        try:
+            pubsub = get_redis_connection().pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(_LOCAL_INVALIDATE_CHANNEL)
+            _clear_local_caches()
+
+            for message in pubsub.listen():
+                _invalidate_local_caches(set(json.loads(message['data'])))
+
+        except Exception as e:
+            logger.warning('cache invalidation listener error {}'.format(e))
+            _clear_local_caches()
+            time.sleep(1)
+
+
+def _ensure_invalidation_listener():
+    global _listener_pid
+
+    # There is no redis in MINDEBUG. Only this process
+    # can invalidate its local caches.
+    if config.MINDEBUG or _listener_pid == os.getpid():
+        return
+
+    _listener_pid = os.getpid()
+    threading.Thread(target=_invalidation_listener, name='cache-invalidation', daemon=True).start()
+
+
+def get_cache_stats() -> Dict[str, Dict[str, int]]:
+    """
+    Get the hit and miss counters for the tagged functions in this
+    process. local_hits are served from the in process cache, hits
+    from redis, and misses called the function.
+
+    :return:
+    """
+    stats = copy.deepcopy(_cache_stats)
+    for local_cache in _local_caches:
+        stats.setdefault(local_cache.name, {})['local_size'] = len(local_cache)
+    return stats
+
+
+def _set_tag_versions(tags: Iterable[str]):
+    cache.set_many({
+        _TAG_VERSION_PREFIX + tag: uuid.uuid4().hex
+        for tag in tags
+    }, timeout=0)
+
+
+def invalidate_cache_tags(tags: Iterable[str]):
+    """
+    Invalidate all tagged cache entries that have any of the given
+    tags. This includes the local caches of every process.
+
+    :param tags:
+    :return:
+    """
+    tags = set(tags)
+    if len(tags) == 0:
+        return
+
+    _set_tag_versions(tags)
+
+    # Clear this process, then let everyone else know
+    _invalidate_local_caches(tags)
+    if not config.MINDEBUG:
+        get_redis_connection().publish(_LOCAL_INVALIDATE_CHANNEL, json.dumps(sorted(tags)))
+
+
+def invalidate_cache_tags_on_commit(session, tags: Iterable[str]):
+    """
+    Invalidate tags once the current transaction on the session is
+    committed. Bulk query.delete() and query.update() statements do
+    not go through the orm events, so the tags for the rows they
+    touch need to be added with this.
+
+    :param session:
+    :param tags:
+    :return:
+    """
+    session.info.setdefault('cache_tags', set()).update(tags)
+
+
+def _get_tag_versions(tags: Set[str]) -> Dict[str, Optional[str]]:
+    tags = sorted(tags)
+    versions = cache.get_many(*[_TAG_VERSION_PREFIX + tag for tag in tags])
+    return dict(zip(tags, versions))
+
+
+def _get_or_create_tag_versions(tags: Set[str]) -> Dict[str, Optional[str]]:
+    # Any tag that does not have a version yet is given one so that a
+    # version can never go back to missing (ie: if the tag is evicted).
+    tag_versions = _get_tag_versions(tags)
+    missing = [tag for tag, version in tag_versions.items() if version is None]
+    if len(missing) > 0:
+        _set_tag_versions(missing)
+        tag_versions = _get_tag_versions(tags)
+    return tag_versions
+
+
+def tagged_memoize(
+        timeout: int = 60 * 60,
+        tags: Callable[..., Iterable[str]] = None,
+        unless: Callable[[], bool] = None,
+        local_timeout: int = 0,
+        local_maxsize: int = 256,
+        local_copy: bool = True,
+):
+    """
+    Memoize a function with a tagged cache entry. The entry is dropped as
+    soon as any of its tags is invalidated, so long timeouts can be used
+    without serving stale data.
+
+    Tags come from the `tags` function (called with the same arguments as
+    the memoized function), from cache_tag calls made while the function
+    runs, and from any tagged functions it calls.
+
+    If local_timeout is set, entries are also kept in a size bounded in
+    process cache for up to local_timeout seconds. Values from the local
+    cache are copied so callers can not change them for everyone else.
+    Large values that callers only ever read (ie: lookup indexes) can be
+    served without the copy by turning off local_copy.
+
+    :param timeout: maximum seconds to keep the entry
+    :param tags: function that returns tags for the function arguments
+    :param unless: skip the cache if this returns True (ie: is_debug)
+    :param local_timeout: seconds to keep the entry in process (0 to disable)
+    :param local_maxsize: maximum number of entries to keep in process
+    :param local_copy: copy values going in and out of the in process cache
+    :return:
+    """
+
+    def decorator(function):
+        signature = inspect.signature(function)
+        name = '{}.{}'.format(function.__module__, function.__qualname__)
+        stats = _cache_stats.setdefault(name, {'local_hits': 0, 'hits': 0, 'misses': 0})
+
+        # Changes to the function source will change the key
+        source_hash = hashlib.md5(function.__code__.co_code).hexdigest()[:8]
+        key_prefix = 'anubis:tagged:{}:{}:'.format(name, source_hash)
+
+        # Create the in process cache
+        local_cache = None
+        if local_timeout > 0:
+            local_cache = _LocalCache(name, local_maxsize)
+            _local_caches.append(local_cache)
+
+        def get_or_compute(key: str, args, kwargs) -> tuple:
+            # If there is an entry, then check that its tags are still current
+            entry = cache.get(key)
+            if entry is not None:
+                value, tag_versions = entry
+                if _get_tag_versions(set(tag_versions.keys())) == tag_versions:
+                    stats['hits'] += 1
+                    return value, set(tag_versions.keys()), timeout
+
+            stats['misses'] += 1
+
+            # Build the value, collecting tags as we go. The versions of the
+            # tags are taken before the function reads anything.
+            computation = _TaggedComputation(
+                set(tags(*args, **kwargs)) if tags is not None else set(),
+                timeout,
+            )
+            stack = _tag_stack()
+            stack.append(computation)
+            try:
+                value = function(*args, **kwargs)
+            finally:
+                stack.pop()
+
+            # If any tag was invalidated while the function was running, then
+            # the value may have been built from stale data. Pass it back,
+            # but do not save it. The same goes if a tagged function it
+            # called could not save its value.
+            if computation.timeout <= 0 or _get_tag_versions(computation.tags) != computation.versions:
+                return value, computation.tags, 0
+
+            cache.set(key, (value, computation.versions), timeout=computation.timeout)
+
+            return value, computation.tags, computation.timeout
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if unless is not None and unless():
+                return function(*args, **kwargs)
+
+            # Build the cache key from the normalized arguments
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            key = key_prefix + hashlib.md5(repr(bound.arguments).encode()).hexdigest()
+
+            # Check the in process cache first
+            if local_cache is not None:
+                _ensure_invalidation_listener()
+                entry = local_cache.get(key)
+                if entry is not None:
+                    stats['local_hits'] += 1
+                    value, entry_tags = entry
+                    cache_tag(*entry_tags)
+                    return copy.deepcopy(value) if local_copy else value
+
+            value, entry_tags, entry_timeout = get_or_compute(key, args, kwargs)
+
+            # Keep the value in process (unless it was not safe to save)
+            if local_cache is not None and entry_timeout > 0:
+                local_cache.set(
+                    key, copy.deepcopy(value) if local_copy else value,
+                    entry_tags, min(local_timeout, entry_timeout),
+                )
+
+            # Pass the tags and timeout up to any tagged function calling this one
+            cache_tag(*entry_tags)
+            limit_cache_timeout(entry_timeout)
+            if entry_timeout <= 0 and len(_tag_stack()) > 0:
+                _tag_stack()[-1].timeout = 0
+
+            return value
+
+        return wrapper
+
+    return decorator
+
+
+def get_row_cache_tags(obj) -> Set[str]:
+    """
+    Get the cache tags that a write to a model object should invalidate.
+
+    :param obj:
+    :return:
+    """
+    tags = set()
+    for tag_name, column in CACHE_TAG_COLUMNS.get(getattr(obj, '__tablename__', None), []):
+        if column is None:
+            tags.add(tag_name)
+            continue
+
+        value = getattr(obj, column, None)
+        if value is not None:
+            tags.add('{}:{}'.format(tag_name, value))
+    return tags
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_cache_tags(session, _):
+    """
+    Collect the cache tags for all the rows written in a flush. They
+    are held on the session until the transaction is committed.
+    """
+    tags: Set[str] = session.info.setdefault('cache_tags', set())
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        tags.update(get_row_cache_tags(obj))
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_cache_tags(session):
+    """
+    Invalidate the tags for everything written in the transaction
+    once it has been committed.
+    """
+    tags = session.info.pop('cache_tags', None)
+    if not tags:
+        return
+
+    # The commit has already gone through, so a cache failure
+    # should not turn into a failed request.
+    try:
+        invalidate_cache_tags(tags)
+    except Exception as e:
+        logger.error('unable to invalidate cache tags {} {}'.format(tags, e))
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_cache_tags(session):
+    session.info.pop('cache_tags', None)
@@ -1,10 +1,10 @@
 from typing import Optional
 
 from anubis.models import Config
-from anubis.utils.cache import cache
+from anubis.utils.cache import tagged_memoize
 
 
-@cache.memoize(timeout=10, source_check=True)
+@tagged_memoize(timeout=60 * 60, tags=lambda key, default=None: ['config:' + key], local_timeout=60)
 def get_config_str(key: str, default: Optional[str] = None) -> Optional[str]:
     """
     Get a config str entry for a given config key. Optionally specify a
@@ -28,7 +28,7 @@ def get_config_str(key: str, default: Optional[str] = None) -> Optional[str]:
     return config_value.value
 
 
-@cache.memoize(timeout=10, source_check=True)
+@tagged_memoize(timeout=60 * 60, tags=lambda key, default=None: ['config:' + key], local_timeout=60)
 def get_config_int(key: str, default: Optional[int] = None) -> Optional[int]:
     """
     Get a config int entry for a given config key. Optionally specify a
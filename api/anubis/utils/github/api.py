@@ -1,11 +1,166 @@
 import os
+import threading
+import time
 import traceback
-from typing import Optional, Dict, Any
+from collections import OrderedDict
+from typing import Optional, Dict, Any, Tuple
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 from anubis.utils.logging import logger
 
+# Base url of the github api
+GITHUB_API_URL = 'https://api.github.com'
+
+# Size of the connection pool to api.github.com. This is also the
+# most requests that can be in flight at once from one process.
+GITHUB_POOL_SIZE = 16
+
+# Max number of times a request is retried after being told
+# to back off by github (secondary rate limits).
+GITHUB_MAX_BACKOFFS = 3
+
+# Requests are only paced out over the rate limit window once
+# fewer than this many are left in the budget.
+GITHUB_RATE_LIMIT_RESERVE = 500
+
+# Max number of GET responses kept for conditional requests
+GITHUB_ETAG_CACHE_SIZE = 512
+
+# Max seconds a request will wait on the rate limits by default. Requests
+# made while handling an http request should fail fast rather than tie up
+# the worker. Jobs can pass max_wait=None to wait out the reset.
+GITHUB_REQUEST_MAX_WAIT = 10.0
+
+
+class GithubRateLimited(Exception):
+    """
+    Raised when a request to the github api would have to wait
+    longer than its max_wait on the rate limits.
+    """
+
+
+# Process wide session, rate limiters and etag cache
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+_etag_cache: 'OrderedDict[str, Tuple[str, Any]]' = OrderedDict()
+_etag_lock = threading.Lock()
+
+
+class RateLimiter(object):
+    """
+    Thread safe limiter for requests to the github api.
+
+    Every response from github says how many requests are left and when
+    the budget resets. While plenty of the budget is left, requests go out
+    as fast as the connection pool allows. Once fewer than the reserve are
+    left, the limiter turns into a token bucket that spreads what is left
+    evenly over what is left of the window. Once the budget is spent,
+    requests wait for the reset (up to their max_wait).
+    """
+
+    def __init__(self, burst: int = GITHUB_POOL_SIZE, reserve: int = GITHUB_RATE_LIMIT_RESERVE):
+        """
+        :param burst: max number of tokens held at once when throttled
+        :param reserve: remaining budget at which requests start being paced
+        """
+        self.burst = burst
+        self.reserve = reserve
+        self.throttled = False
+        self.rate = 1.0
+        self.tokens = float(burst)
+        self.last = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+
+    def acquire(self, max_wait: Optional[float] = None) -> bool:
+        """
+        Wait until a request is allowed to go out.
+
+        :param max_wait: max seconds to wait, or None to wait as long as it takes
+        :return: False if the request would not be allowed within max_wait
+        """
+        deadline = time.monotonic() + max_wait if max_wait is not None else None
+        while True:
+            with self.lock:
+                now = time.monotonic()
+
+                # Github asked us to back off
+                if now < self.paused_until:
+                    wait = self.paused_until - now
+
+                # Plenty of budget left
+                elif not self.throttled:
+                    return True
+
+                # Running low on budget, take a token from the bucket
+                else:
+                    self._refill()
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return True
+                    wait = (1 - self.tokens) / self.rate
+
+            # Give up now rather than sleep past the deadline
+            if deadline is not None and time.monotonic() + wait > deadline:
+                return False
+            time.sleep(wait)
+
+    def update(self, headers):
+        """
+        Re-tune the limiter from the X-RateLimit-* headers of a response.
+
+        :param headers: response headers
+        :return:
+        """
+        try:
+            remaining = int(headers['X-RateLimit-Remaining'])
+            reset = int(headers['X-RateLimit-Reset'])
+        except (KeyError, ValueError):
+            return
+
+        with self.lock:
+
+            # Do not pace anything while there is plenty left
+            if remaining > self.reserve:
+                self.throttled = False
+                return
+
+            # Seconds until the budget resets
+            window = max(reset - time.time(), 1.0)
+
+            # Spread what is left over what is left of the window. When
+            # nothing is left, the next token shows up at the reset.
+            self._refill()
+            self.throttled = True
+            self.rate = max(remaining, 1) / window
+            self.tokens = min(self.tokens, float(remaining))
+
+    def wait(self, seconds: float):
+        """
+        Hold off all requests for a while. Used when
+        github asks us to back off.
+
+        :param seconds:
+        :return:
+        """
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+# Github keeps a separate budget for the rest and graphql apis
+_rate_limiters: Dict[str, RateLimiter] = {
+    'core': RateLimiter(),
+    'graphql': RateLimiter(),
+}
+
 
 def get_github_token() -> Optional[str]:
 
@@ -20,33 +175,168 @@ def get_github_token() -> Optional[str]:
     return token
 
 
-def github_rest(url, body=None, method: str = 'get'):
+def get_github_session() -> requests.Session:
+    """
+    Get the process wide session for the github api. Connections are
+    pooled and kept alive, and requests that fail on a bad gateway
+    are retried with a backoff.
 
-    # Get the github api token
-    token = get_github_token()
+    :return:
+    """
+    global _session
 
-    url = 'https://api.github.com' + url
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+
+            # Only idempotent methods are retried on a bad gateway. A
+            # retried POST could (for example) create a repo twice.
+            retry = Retry(
+                total=3,
+                backoff_factor=0.5,
+                status_forcelist=(502, 503, 504),
+                raise_on_status=False,
+            )
+            adapter = HTTPAdapter(
+                pool_connections=1,
+                pool_maxsize=GITHUB_POOL_SIZE,
+                max_retries=retry,
+            )
+            session.mount('https://', adapter)
+            session.headers.update({
+                'Authorization': 'token %s' % get_github_token(),
+            })
+            _session = session
+
+    return _session
+
+
+def _backoff_seconds(r: requests.Response) -> Optional[float]:
+    """
+    Check if github is asking us to back off, and if so for how long.
+
+    :param r:
+    :return: seconds to wait, or None if the request was not throttled
+    """
+    if r.status_code not in (403, 429):
+        return None
+
+    # Secondary rate limits come with a Retry-After
+    if 'Retry-After' in r.headers:
+        return float(r.headers['Retry-After'])
+
+    # Primary rate limit is spent, wait for the reset
+    if r.headers.get('X-RateLimit-Remaining') == '0':
+        return max(int(r.headers.get('X-RateLimit-Reset', 0)) - time.time(), 1.0)
+
+    return None
+
+
+def github_request(
+        method: str, url: str, resource: str = 'core',
+        max_wait: Optional[float] = GITHUB_REQUEST_MAX_WAIT, **kwargs,
+) -> requests.Response:
+    """
+    Make a throttled request to the github api with the shared session.
+    Requests wait for a token from the rate limiter for the resource
+    before they go out, and are retried when github asks us to back off.
+
+    A GithubRateLimited is raised if the request would have to wait more
+    than max_wait seconds in total. Pass max_wait=None to wait as long as
+    it takes (only do this in jobs, the primary limit resets hourly).
+
+    :param method: http method
+    :param url: full url
+    :param resource: rate limit resource (core or graphql)
+    :param max_wait: max seconds to wait on the rate limits, or None for no limit
+    :param kwargs: passed to requests
+    :return:
+    """
+    session = get_github_session()
+    limiter = _rate_limiters[resource]
+    deadline = time.monotonic() + max_wait if max_wait is not None else None
+
+    def remaining() -> Optional[float]:
+        return max(deadline - time.monotonic(), 0.0) if deadline is not None else None
+
+    attempt = 0
+    while True:
+        if not limiter.acquire(remaining()):
+            raise GithubRateLimited(f'Github api {resource} rate limit would take over {max_wait}s')
+        r = session.request(method, url, **kwargs)
+        limiter.update(r.headers)
+
+        # Wait it out if github asks us to back off
+        wait = _backoff_seconds(r)
+        if wait is None or attempt >= GITHUB_MAX_BACKOFFS:
+            return r
+        if deadline is not None and wait > remaining():
+            raise GithubRateLimited(f'Github api {resource} rate limited for {wait:.0f}s')
+        attempt += 1
+        logger.warning(f'Github api rate limited, backing off for {wait:.0f}s')
+        limiter.wait(wait)
+
+
+def _get_etag(url: str) -> Optional[Tuple[str, Any]]:
+    with _etag_lock:
+        entry = _etag_cache.get(url, None)
+        if entry is not None:
+            _etag_cache.move_to_end(url)
+        return entry
+
+
+def _set_etag(url: str, etag: str, data: Any):
+    with _etag_lock:
+        _etag_cache[url] = (etag, data)
+        _etag_cache.move_to_end(url)
+        while len(_etag_cache) > GITHUB_ETAG_CACHE_SIZE:
+            _etag_cache.popitem(last=False)
+
+
+def github_rest(url, body=None, method: str = 'get', max_wait: Optional[float] = GITHUB_REQUEST_MAX_WAIT):
+
+    url = GITHUB_API_URL + url
     headers = {
         'Accept': 'application/vnd.github.v3+json',
-        'Authorization': 'token %s' % token,
     }
 
-    req_function = {
-        'put': requests.put,
-        'get': requests.get,
-        'del': requests.delete,
-        'delete': requests.delete,
+    method = {
+        'put': 'PUT',
+        'get': 'GET',
+        'post': 'POST',
+        'patch': 'PATCH',
+        'del': 'DELETE',
+        'delete': 'DELETE',
     }[method.lower()]
 
+    # Make GETs conditional on the last response we got. A 304
+    # does not count against the rate limit.
+    cached = None
+    if method == 'GET':
+        cached = _get_etag(url)
+        if cached is not None:
+            headers['If-None-Match'] = cached[0]
+
     r = None
     try:
         if body is not None:
-            r = req_function(url, headers=headers, json=body)
+            r = github_request(method, url, max_wait=max_wait, headers=headers, json=body)
         else:
-            r = req_function(url, headers=headers)
+            r = github_request(method, url, max_wait=max_wait, headers=headers)
+        if r.status_code == 304 and cached is not None:
+            return cached[1]
         if r.status_code == 204:
             return dict()
-        return r.json()
+        data = r.json()
+
+        # Hold onto the response for the next conditional request
+        if method == 'GET' and r.status_code == 200 and 'ETag' in r.headers:
+            _set_etag(url, r.headers['ETag'], data)
+
+        return data
+    except GithubRateLimited as e:
+        logger.warning(f'Request to github api not made {e}')
+        return None
     except Exception as e:
         if r is not None and isinstance(r, requests.Response):
             logger.error(str(r))
@@ -56,23 +346,26 @@ def github_rest(url, body=None, method: str = 'get'):
         return None
 
 
-def github_graphql(query: str, variables: Dict[str, Any] = None) -> Optional[Dict[str, Any]]:
+def github_graphql(
+        query: str, variables: Dict[str, Any] = None, max_wait: Optional[float] = GITHUB_REQUEST_MAX_WAIT,
+) -> Optional[Dict[str, Any]]:
 
     # Default values for variables
     if variables is None:
         variables = dict()
 
-    token = get_github_token()
-
     # Set up request options
-    url = 'https://api.github.com/graphql'
+    url = GITHUB_API_URL + '/graphql'
     json = {'query': query, 'variables': variables}
-    headers = {'Authorization': 'token %s' % token}
 
     # Make the graph request over http
+    r = None
     try:
-        r = requests.post(url=url, json=json, headers=headers)
+        r = github_request('POST', url, resource='graphql', max_wait=max_wait, json=json)
         return r.json()['data']
+    except GithubRateLimited as e:
+        logger.warning(f'Request to github api not made {e}')
+        return None
     except KeyError as e:
         logger.error(traceback.format_exc())
         logger.error(r.content)
@@ -80,4 +373,4 @@ def github_graphql(query: str, variables: Dict[str, Any] = None) -> Optional[Dic
     except Exception as e:
         logger.error(traceback.format_exc())
         logger.error(f'Request to github api Failed {e}')
-        return None
\ No newline at end of file
+        return None
@@ -1,5 +1,6 @@
+from collections import defaultdict
 from datetime import datetime, timedelta
-from typing import List
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 
 from sqlalchemy.sql import or_
 
@@ -9,14 +10,26 @@ from anubis.models import (
     Assignment,
     Submission,
     AssignmentRepo,
+    RollupWatermark,
 )
 from anubis.utils.github.api import github_graphql
-from anubis.utils.github.repos import create_assignment_repo
+from anubis.utils.github.repos import create_assignment_repos
 from anubis.utils.logging import logger
 
+# Number of repos fetched from the github graphql api per page
+GITHUB_REPO_PAGE_SIZE = 50
+
+# Number of recent commits checked on each repo
+GITHUB_COMMIT_HISTORY_SIZE = 20
+
+# Repos pushed to shortly before the watermark are checked again. A push
+# that lands while a pass is running may not show up until after it.
+GITHUB_WATERMARK_OVERLAP = timedelta(minutes=10)
+
 
 def fix_github_broken_repos():
-    # Search for broken repos
+    # Search for broken repos. Repos are given a minute for the
+    # request that created them to finish.
     broken_repos: List[AssignmentRepo] = AssignmentRepo.query.filter(or_(
         # Repo not created
         AssignmentRepo.repo_created == False,
@@ -24,145 +37,271 @@ def fix_github_broken_repos():
         # Collaborator not configured
         AssignmentRepo.collaborator_configured == False,
     ),
-        AssignmentRepo.created > datetime.now() + timedelta(minutes=1),
-        AssignmentRepo.created < datetime.now() - timedelta(hours=1),
+        AssignmentRepo.created < datetime.now() - timedelta(minutes=1),
+        AssignmentRepo.created > datetime.now() - timedelta(hours=1),
     ).all()
 
-    # Iterate over broken repos, fixing as we go
+    # Group the broken repos by assignment
+    broken_by_assignment: Dict[str, List[AssignmentRepo]] = defaultdict(list)
     for repo in broken_repos:
+        broken_by_assignment[repo.assignment_id].append(repo)
 
-        # Get student & assignment
-        student: User = repo.owner
-        assignment: Assignment = repo.assignment
+    # Fix the broken repos a batch per assignment
+    for repos in broken_by_assignment.values():
+
+        # Get students & assignment
+        students: List[User] = [repo.owner for repo in repos]
+        assignment: Assignment = repos[0].assignment
 
         # Log fix event
-        logger.info(f'Attempting to fix broken repo netid={student.netid} assignment={assignment.unique_code}')
+        logger.info(f'Attempting to fix {len(repos)} broken repos assignment={assignment.unique_code}')
 
-        # The create assignment repo function will attempt
-        # to fix missing steps.
-        create_assignment_repo(student, assignment)
+        # The create assignment repos function will attempt
+        # to fix missing steps. This is a job, so it can wait
+        # out the github rate limits.
+        create_assignment_repos(students, assignment, max_wait=None)
 
 
-def fix_github_missing_submissions(org_name: str):
-    from anubis.lms.submissions import init_submission
-    from anubis.lms.webhook import check_repo, guess_github_username
-    from anubis.utils.rpc import enqueue_autograde_pipeline
+def parse_github_datetime(value: Optional[str]) -> Optional[datetime]:
+    """
+    Parse a datetime from the github api (ie: 2021-10-15T16:42:08Z).
+    Github times are UTC, so these should only be compared with
+    other github times.
+
+    :param value:
+    :return:
+    """
+    if value is None:
+        return None
+    return datetime.strptime(value, '%Y-%m-%dT%H:%M:%SZ')
+
+
+def iter_github_org_repos(org_name: str, since: Optional[datetime] = None) -> Iterator[List[Dict[str, Any]]]:
+    """
+    Page through the repos of a github org with graphql cursors, most
+    recently pushed first. Each page is yielded as a list of repo nodes.
+    When since is given, paging stops at the first repo that has not
+    been pushed to since then.
+
+    :param org_name:
+    :param since: only get repos pushed after this (github) time
+    :return:
+    """
 
-    # Do graphql nonsense
     # Refer to here for graphql over https: https://graphql.org/learn/serving-over-http/
     query = '''
-    query githubCommits($orgName: String!) {
+    query githubCommits($orgName: String!, $pageSize: Int!, $historySize: Int!, $cursor: String) {
       organization(login: $orgName){
-        repositories(first:100,orderBy:{field:CREATED_AT,direction:DESC}){
+        repositories(first:$pageSize,after:$cursor,orderBy:{field:PUSHED_AT,direction:DESC}){
+          pageInfo { hasNextPage endCursor }
           nodes{
             ref(qualifiedName:"master") {
-          target {
-            ... on Commit {
-              history(first: 20) {
-                edges { node { oid } }
+              target {
+                ... on Commit {
+                  history(first: $historySize) {
+                    edges { node { oid } }
+                  }
+                }
               }
             }
-          }
-            }
-            name 
+            name
             url
+            pushedAt
           }
         }
       }
     }
     '''
 
-    # Make the github query
-    data = github_graphql(query, {'orgName': org_name})
+    cursor = None
+    while True:
+        # Make the github query for the next page
+        data = github_graphql(query, {
+            'orgName': org_name,
+            'pageSize': GITHUB_REPO_PAGE_SIZE,
+            'historySize': GITHUB_COMMIT_HISTORY_SIZE,
+            'cursor': cursor,
+        }, max_wait=None)
 
-    # Check that the data is there
-    if data is None:
-        return
+        # Check that the data is there
+        if data is None or data.get('organization') is None:
+            raise ValueError(f'Unable to list repos for github org {org_name}')
 
-    # Get organization and repositories from response
-    organization = data['organization']
-    repositories = organization['repositories']['nodes']
+        repositories = data['organization']['repositories']
+        nodes = repositories['nodes']
 
-    # Running map of unique_code -> assignment objects
-    assignments = dict()
+        # Cut the page off at the first repo that has
+        # not changed since the last pass.
+        if since is not None:
+            for index, node in enumerate(nodes):
+                pushed_at = parse_github_datetime(node['pushedAt'])
+                if pushed_at is not None and pushed_at < since:
+                    if index > 0:
+                        yield nodes[:index]
+                    return
 
-    # Parse out repo name and url from graphql response
-    repos = map(lambda node: (node['name'], node['url'], node['ref']), repositories)
-    for repo_name, repo_url, ref in repos:
-        assignment = None
+        if len(nodes) > 0:
+            yield nodes
 
-        # Try to get the assignment object from running map
-        for code in repo_name.split('-'):
-            assignment = assignments.get(code, None)
+        # Move on to the next page
+        if not repositories['pageInfo']['hasNextPage']:
+            return
+        cursor = repositories['pageInfo']['endCursor']
 
-        # If not in the map, then try to get from the database
-        if assignment is None:
-            assignment = Assignment.query.filter(
-                Assignment.unique_code.in_(repo_name.split('-'))
-            ).first()
 
-            if assignment is not None:
-                assignments[assignment.unique_code] = assignment
+def reconcile_github_repos(nodes: List[Dict[str, Any]]) -> Tuple[List[str], List[str]]:
+    """
+    Reconcile a page of github repos with the database. Missing repos
+    are created, repos and submissions with the wrong owner are fixed,
+    and submissions are created for any commits anubis never saw. The
+    commits for the whole page are checked with one query.
+
+    Nothing is committed here.
+
+    :param nodes: repo nodes from the github graphql api
+    :return: ids of the created submissions, ids of the submissions with a fixed owner
+    """
+    from anubis.lms.submissions import init_submission
+    from anubis.lms.webhook import check_repo, guess_github_username, get_repo_assignment
+
+    # Match each github repo to its assignment, user and repo row
+    matched = []
+    for node in nodes:
+        repo_name, repo_url = node['name'], node['url']
+
+        # Match the repo to its assignment
+        assignment = get_repo_assignment(repo_name)
 
-        # If not in database or map, then eject
+        # If no assignment matches, then eject
         if assignment is None:
-            print(f'Could not find assignment for {repo_name}')
+            logger.info(f'Could not find assignment for {repo_name}')
             continue
 
         # Guess github username, then create the repo if it doesn't yet exist
         user, github_username = guess_github_username(assignment, repo_name)
-        repo = check_repo(assignment, repo_url, github_username, user)
+        repo = check_repo(assignment, repo_url, github_username, user, commit=False)
 
         if user is None:
             continue
 
-        # Check for broken submissions
-        submissions = []
-        for submission in Submission.query.filter(Submission.assignment_repo_id == repo.id).all():
-            if submission is None:
+        # Get the recent commits on the repo (empty repos have no ref)
+        commits = []
+        if node['ref'] is not None:
+            commits = [edge['node']['oid'] for edge in node['ref']['target']['history']['edges']]
+
+        matched.append((node, assignment, user, repo, commits))
+
+    if len(matched) == 0:
+        return [], []
+
+    # Fix repos that have the wrong owner
+    user_by_url = {node['url']: user for node, _, user, _, _ in matched}
+    for r in AssignmentRepo.query.filter(AssignmentRepo.repo_url.in_(list(user_by_url.keys()))).all():
+        user = user_by_url[r.repo_url]
+        if r.owner_id != user.id:
+            logger.info(f'fixing broken repo owner {r.id}')
+            r.owner_id = user.id
+    db.session.flush()
+
+    # Fix submissions whose owner does not match the owner of their repo
+    repo_urls = list(user_by_url.keys())
+    repo_ids = [repo.id for _, _, _, repo, _ in matched]
+    broken_submissions: List[Submission] = Submission.query.join(
+        AssignmentRepo, AssignmentRepo.id == Submission.assignment_repo_id,
+    ).filter(
+        or_(AssignmentRepo.id.in_(repo_ids), AssignmentRepo.repo_url.in_(repo_urls)),
+        AssignmentRepo.owner_id != None,
+        or_(Submission.owner_id == None, Submission.owner_id != AssignmentRepo.owner_id),
+    ).all()
+    fixed_ids = []
+    for submission in broken_submissions:
+        logger.info(f'found broken submission {submission.id}')
+        submission.owner_id = submission.repo.owner_id
+        fixed_ids.append(submission.id)
+
+    # Check which of the commits we already have in one query
+    all_commits = list({commit for *_, commits in matched for commit in commits})
+    existing_commits = set()
+    if len(all_commits) > 0:
+        existing_commits = {
+            commit for commit, in db.session.query(Submission.commit).filter(
+                Submission.commit.in_(all_commits),
+            ).all()
+        }
+
+    # Create submissions for the missing commits
+    missing_submissions = []
+    for node, assignment, user, repo, commits in matched:
+        for commit in commits:
+            if commit in existing_commits:
                 continue
-            if submission.owner_id != user.id:
-                print(f'found broken submission {submission.id}')
-                submission.owner_id = repo.owner_id
-                submissions.append(submission.id)
+            existing_commits.add(commit)
+            logger.info(f'found missing submission {user.github_username} {commit}')
+            submission = Submission(
+                commit=commit,
+                owner=user,
+                assignment=assignment,
+                repo=repo,
+                state="Waiting for resources...",
+            )
+            db.session.add(submission)
+            missing_submissions.append(submission)
+    db.session.flush()
+
+    # Create the build and test result rows for the new submissions
+    for submission in missing_submissions:
+        init_submission(submission, commit=False, refresh_best=False)
+
+    return [submission.id for submission in missing_submissions], fixed_ids
+
+
+def fix_github_missing_submissions(org_name: str):
+    """
+    Reconcile the repos in a github org with anubis. Only the repos
+    that have been pushed to since the last pass are fetched (tracked
+    by a watermark per org). Each page of repos is committed, then
+    its submissions are enqueued together.
+
+    :param org_name:
+    :return:
+    """
+    from anubis.utils.rpc import enqueue_autograde_pipelines
+
+    # Get the pushedAt of the newest repo seen on the last pass
+    watermark_name = f'github:{org_name}'
+    watermark: RollupWatermark = RollupWatermark.query.filter(
+        RollupWatermark.name == watermark_name,
+    ).first()
+    since = None
+    if watermark is not None:
+        since = watermark.watermark - GITHUB_WATERMARK_OVERLAP
+
+    newest_push = None
+    repo_count = 0
+    for nodes in iter_github_org_repos(org_name, since):
+        # Hold onto the newest push we have seen
+        for node in nodes:
+            pushed_at = parse_github_datetime(node['pushedAt'])
+            if pushed_at is not None and (newest_push is None or pushed_at > newest_push):
+                newest_push = pushed_at
+
+        # Reconcile the page, then commit it
+        submission_ids, fixed_ids = reconcile_github_repos(nodes)
         db.session.commit()
-        for sid in submissions:
-            enqueue_autograde_pipeline(sid)
-
-        # Check for missing submissions
-        for commit in map(lambda x: x['node']['oid'], ref['target']['history']['edges']):
-            submission = Submission.query.filter(
-                Submission.commit == commit
-            ).first()
-            if submission is None:
-                print(f'found missing submission {github_username} {commit}')
-                submission = Submission(
-                    commit=commit,
-                    owner=user,
-                    assignment=assignment,
-                    repo=repo,
-                    state="Waiting for resources...",
-                )
-                db.session.add(submission)
-                db.session.commit()
-                init_submission(submission)
-                enqueue_autograde_pipeline(submission.id)
-
-        r = AssignmentRepo.query.filter(AssignmentRepo.repo_url == repo_url).first()
-        if r is not None:
-            if r.owner_id != user.id:
-                print(f'fixing broken repo owner {r.id}')
-                r.owner_id = user.id
-                submissions = []
-                for submission in Submission.query.filter(
-                        Submission.assignment_repo_id == r.id
-                ).all():
-                    submission.owner_id = user.id
-                    submissions.append(submission.id)
-
-                db.session.commit()
-                for sid in submissions:
-                    enqueue_autograde_pipeline(sid)
-
-        if repo:
-            print(f'checked repo: {repo_name} {github_username} {user} {repo.id}')
\ No newline at end of file
+        repo_count += len(nodes)
+
+        # Missed pushes are graded like fresh pushes. Fixed
+        # submissions go on the regrade queue.
+        enqueue_autograde_pipelines(submission_ids, queue='default')
+        enqueue_autograde_pipelines(fixed_ids)
+
+    # Move the watermark up once the whole org has been checked
+    if newest_push is not None:
+        if watermark is None:
+            watermark = RollupWatermark(name=watermark_name)
+            db.session.add(watermark)
+        if watermark.watermark is None or newest_push > watermark.watermark:
+            watermark.watermark = newest_push
+        db.session.commit()
+
+    logger.info(f'Reconciled {repo_count} repos for github org {org_name}')
@@ -1,13 +1,28 @@
+import time
 import traceback
-from typing import List
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
 from parse import parse
 
-from anubis.models import User, Assignment, AssignmentRepo, db, Submission, SubmissionBuild, SubmissionTestResult
-from anubis.utils.github.api import github_graphql, github_rest
+from sqlalchemy import or_
+
+from anubis.models import (
+    User,
+    Assignment,
+    AssignmentRepo,
+    db,
+    Submission,
+    SubmissionBuild,
+    SubmissionTestResult,
+    StudentAssignmentBest,
+    WebhookDelivery,
+)
+from anubis.utils.cache import invalidate_cache_tags_on_commit
+from anubis.utils.github.api import github_graphql, github_rest, GITHUB_REQUEST_MAX_WAIT
 from anubis.utils.logging import logger
 
 
-def get_github_template_ids(template_repo: str, github_org: str):
+def get_github_template_ids(template_repo: str, github_org: str, max_wait: Optional[float] = GITHUB_REQUEST_MAX_WAIT):
     id_query = """
     query githubTemplateInfo($orgName: String!, $templateName: String!, $templateOwner: String!) {  
       organization(login: $orgName) {
@@ -27,10 +42,13 @@ def get_github_template_ids(template_repo: str, github_org: str):
         'orgName': github_org,
         'templateName': github_template_name,
         'templateOwner': github_template_owner,
-    })
+    }, max_wait=max_wait)
 
 
-def create_repo_from_template(owner_id: str, template_repo_id: str, new_repo_name: str):
+def create_repo_from_template(
+        owner_id: str, template_repo_id: str, new_repo_name: str,
+        max_wait: Optional[float] = GITHUB_REQUEST_MAX_WAIT,
+):
     create_query = """
     mutation githubTemplateCreate($ownerId: ID!, $templateRepoId: ID!, $newName: String!) { 
       cloneTemplateRepository(input: {
@@ -51,13 +69,16 @@ def create_repo_from_template(owner_id: str, template_repo_id: str, new_repo_nam
         'ownerId': owner_id,
         'templateRepoId': template_repo_id,
         'newName': new_repo_name,
-    })
+    }, max_wait=max_wait)
 
 
-def add_collaborator(github_org: str, new_repo_name: str, github_username: str):
+def add_collaborator(
+        github_org: str, new_repo_name: str, github_username: str,
+        max_wait: Optional[float] = GITHUB_REQUEST_MAX_WAIT,
+):
     return github_rest(f'/repos/{github_org}/{new_repo_name}/collaborators/{github_username}', {
         'permission': 'push',
-    }, method='put')
+    }, method='put', max_wait=max_wait)
 
 
 def assignment_repo_name(user: User, assignment: Assignment) -> str:
@@ -112,6 +133,23 @@ def delete_assignment_repo(user: User, assignment: Assignment):
             SubmissionTestResult.submission_id.in_(submission_ids)
         ).delete()
 
+        # Drop the student's best submission for the assignment, along
+        # with any other best rows pointing at these submissions. They are
+        # recalculated the next time they are read.
+        StudentAssignmentBest.query.filter(
+            StudentAssignmentBest.assignment_id == assignment.id,
+            or_(
+                StudentAssignmentBest.owner_id == user.id,
+                StudentAssignmentBest.submission_id.in_(submission_ids),
+            ),
+        ).delete(synchronize_session=False)
+
+        # Keep the webhook deliveries for the submissions around, but
+        # unlink them from the submissions being deleted
+        WebhookDelivery.query.filter(
+            WebhookDelivery.submission_id.in_(submission_ids),
+        ).update({'submission_id': None}, synchronize_session=False)
+
         # Delete submissions themselves
         Submission.query.filter(
             Submission.id.in_(submission_ids),
@@ -120,6 +158,14 @@ def delete_assignment_repo(user: User, assignment: Assignment):
         # Parse out github org and repo_name from url before deletion
         github_org, repo_name = parse('https://github.com/{}/{}', repo.repo_url)
 
+        # The bulk deletes skip the orm events, so drop the cached
+        # submission and repo data for the student explicitly.
+        invalidate_cache_tags_on_commit(db.session, [
+            f'user_submissions:{repo.owner_id}',
+            f'user_repos:{repo.owner_id}',
+            *[f'submission:{submission_id}' for submission_id in submission_ids],
+        ])
+
         # Delete the repo
         AssignmentRepo.query.filter(AssignmentRepo.id == repo.id).delete()
 
@@ -136,65 +182,54 @@ def delete_assignment_repo(user: User, assignment: Assignment):
         logger.error(f'continuing')
 
 
-def create_assignment_repo(user: User, assignment: Assignment) -> AssignmentRepo:
-    # Get template information
-    template_repo_path = assignment.github_template
-    github_org = assignment.course.github_org
-
-    # Get a generated assignment repo name
-    new_repo_name = assignment_repo_name(user, assignment)
-    new_repo_url = assignment_repo_url(user, assignment)
-
-    # Try to get the assignment repo from the database
-    repo: AssignmentRepo = AssignmentRepo.query.filter(
-        AssignmentRepo.assignment_id == assignment.id,
-        AssignmentRepo.owner_id == user.id,
-    ).first()
-
-    # If repo does not exist yet, create one
-    if repo is None:
-        repo = AssignmentRepo(
-            assignment_id=assignment.id,
-            owner_id=user.id,
-            github_username=user.github_username,
-            repo_url=new_repo_url,
-        )
-        db.session.add(repo)
-        db.session.commit()
-
-    if repo.repo_url != new_repo_url:
-        repo.repo_url = new_repo_url
-        db.session.commit()
+def provision_assignment_repo(
+        github_org: str,
+        template_ids: Optional[Tuple[str, str]],
+        new_repo_name: str,
+        github_username: str,
+        repo_created: bool,
+        collaborator_configured: bool,
+        max_wait: Optional[float] = GITHUB_REQUEST_MAX_WAIT,
+) -> Tuple[bool, bool]:
+    """
+    Make the github api calls to create a student repo from the template,
+    and add the student as a collaborator. Steps that were already done
+    are skipped. This does not touch the database, so it is safe to run
+    in a worker thread.
+
+    :param github_org:
+    :param template_ids: github ids of the org and the template repo
+    :param new_repo_name:
+    :param github_username:
+    :param repo_created: if the repo has already been created
+    :param collaborator_configured: if the collaborator has already been added
+    :param max_wait: max seconds to wait on the github rate limits per call, or None for no limit
+    :return: repo_created, collaborator_configured
+    """
 
     try:
         # If repo has not been created yet
-        if not repo.repo_created:
-
-            # We need to use some of github's internal ID values
-            # for creating a repo from the template.
-            data = get_github_template_ids(template_repo_path, github_org)
+        if not repo_created:
 
-            # If the response was None, the api request failed. Also check that
-            # some expected values are present in the json data response.
-            if data is None and 'repository' in data and 'id' in data['repository']:
-                return repo
+            # If the template ids could not be fetched, there
+            # is nothing we can do.
+            if template_ids is None:
+                return repo_created, collaborator_configured
 
             # Get organization and template repo IDs
-            owner_id = data['organization']['id']
-            template_repo_id = data['repository']['id']
+            owner_id, template_repo_id = template_ids
 
             # Try to create the student's assignment repo from the template
             # using the github graphql api.
-            data = create_repo_from_template(owner_id, template_repo_id, new_repo_name)
+            data = create_repo_from_template(owner_id, template_repo_id, new_repo_name, max_wait=max_wait)
 
             # If the response was None, the api request failed
             if data is None:
                 logger.error('Create repo failed')
-                return repo
+                return repo_created, collaborator_configured
 
             # Mark the repo as created
-            repo.repo_created = True
-            db.session.commit()
+            repo_created = True
     except Exception as e:
         logger.error(traceback.format_exc())
         logger.error(f'Failed to create repo {e}')
@@ -202,30 +237,144 @@ def create_assignment_repo(user: User, assignment: Assignment) -> AssignmentRepo
 
     try:
         # If repo has not been configured
-        if not repo.collaborator_configured:
+        if not collaborator_configured:
 
             # Use github REST api to to add the student as a collaborator
             # to the repo.
-            data = add_collaborator(github_org, new_repo_name, user.github_username)
+            data = add_collaborator(github_org, new_repo_name, github_username, max_wait=max_wait)
 
             # Sometimes it takes a moment before we are able to add collaborators to
             # the repo. The message in the response will be Not Found in this situation.
             # We can have it try again to fix.
-            if data.get("message", None) == "Not Found":
+            if data is not None and data.get("message", None) == "Not Found":
                 logger.error('Failed to add collaborator (Not Found). Trying again.')
-                data = add_collaborator(github_org, new_repo_name, user.github_username)
+                time.sleep(1)
+                data = add_collaborator(github_org, new_repo_name, github_username, max_wait=max_wait)
 
             # If the response was None, the api request failed
             if data is None or data.get("message", None) == "Not Found":
                 logger.error('Failed to add collaborator')
-                return repo
+                return repo_created, collaborator_configured
 
             # Mark the repo as collaborator configured
-            repo.collaborator_configured = True
-            db.session.commit()
+            collaborator_configured = True
     except Exception as e:
         logger.error(traceback.format_exc())
         logger.error(f'Failed to configure collaborators {e}')
         logger.error(f'continuing')
 
-    return repo
+    return repo_created, collaborator_configured
+
+
+def create_assignment_repos(
+        users: List[User], assignment: Assignment, max_wait: Optional[float] = GITHUB_REQUEST_MAX_WAIT,
+) -> List[AssignmentRepo]:
+    """
+    Create the assignment repos for a batch of students. The template
+    ids are only looked up once, then the github api calls for each repo
+    are made concurrently (throttled by the github api rate limiter).
+    Database work stays on the calling thread.
+
+    Any steps that already succeeded for a repo are skipped, so this
+    can be called again to fix repos that are broken.
+
+    By default the github calls give up rather than wait long on the rate
+    limits, leaving the repo for fix_github_broken_repos. Jobs can pass
+    max_wait=None to wait out the rate limit reset.
+
+    :param users:
+    :param assignment:
+    :param max_wait: max seconds to wait on the github rate limits per call, or None for no limit
+    :return: repos in the same order as users
+    """
+    from anubis.utils.config import get_config_int
+
+    # Get template information
+    template_repo_path = assignment.github_template
+    github_org = assignment.course.github_org
+
+    # Get the existing repos for the batch in one query
+    existing_repos: List[AssignmentRepo] = AssignmentRepo.query.filter(
+        AssignmentRepo.assignment_id == assignment.id,
+        AssignmentRepo.owner_id.in_([user.id for user in users]),
+    ).all()
+    repo_by_owner = {repo.owner_id: repo for repo in existing_repos}
+
+    repos: List[AssignmentRepo] = []
+    for user in users:
+        new_repo_url = assignment_repo_url(user, assignment)
+
+        # If repo does not exist yet, create one
+        repo = repo_by_owner.get(user.id, None)
+        if repo is None:
+            repo = AssignmentRepo(
+                assignment_id=assignment.id,
+                owner_id=user.id,
+                github_username=user.github_username,
+                repo_url=new_repo_url,
+            )
+            db.session.add(repo)
+            repo_by_owner[user.id] = repo
+
+        if repo.repo_url != new_repo_url:
+            repo.repo_url = new_repo_url
+
+        repos.append(repo)
+    db.session.commit()
+
+    # Repos that still need work on github
+    pending = [
+        (user, repo) for user, repo in zip(users, repos)
+        if not repo.repo_created or not repo.collaborator_configured
+    ]
+    if len(pending) == 0:
+        return repos
+
+    # We need to use some of github's internal ID values
+    # for creating a repo from the template.
+    template_ids = None
+    if any(not repo.repo_created for _, repo in pending):
+        try:
+            data = get_github_template_ids(template_repo_path, github_org, max_wait=max_wait)
+
+            # If the response was None, the api request failed. Also check that
+            # some expected values are present in the json data response.
+            if data is not None and data.get('repository') is not None and 'id' in data['repository']:
+                template_ids = data['organization']['id'], data['repository']['id']
+        except Exception as e:
+            logger.error(traceback.format_exc())
+            logger.error(f'Failed to get template ids {e}')
+
+    # Pull out everything the worker threads need up front. The
+    # threads must not touch the orm objects.
+    jobs = [
+        (
+            github_org,
+            template_ids,
+            assignment_repo_name(user, assignment),
+            user.github_username,
+            repo.repo_created,
+            repo.collaborator_configured,
+            max_wait,
+        )
+        for user, repo in pending
+    ]
+
+    # Make the github api calls for the batch concurrently
+    max_workers = get_config_int('GITHUB_MAX_WORKERS', default=8)
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(jobs)))) as executor:
+        results = list(executor.map(lambda job: provision_assignment_repo(*job), jobs))
+
+    # Record what was done
+    for (_, repo), (repo_created, collaborator_configured) in zip(pending, results):
+        repo.repo_created = repo_created
+        repo.collaborator_configured = collaborator_configured
+    db.session.commit()
+
+    logger.info(f'Provisioned {len(pending)} repos for assignment {assignment.unique_code}')
+
+    return repos
+
+
+def create_assignment_repo(user: User, assignment: Assignment) -> AssignmentRepo:
+    return create_assignment_repos([user], assignment)[0]
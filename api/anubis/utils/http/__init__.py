@@ -1,5 +1,5 @@
 from datetime import datetime, timedelta
-from typing import Union, Tuple
+from typing import IO, Optional, Union, Tuple
 
 from flask import request
 from werkzeug.utils import secure_filename
@@ -104,15 +104,30 @@ def get_number_arg(arg_name: str = "number", default_value: int = 10, reject_neg
         return default_value
 
 
-def get_request_file_stream(with_filename=False, fail_ok=False) -> Union[
-    bytes, None, Tuple[bytes, str], Tuple[None, None]]:
+def get_request_file(with_filename=False, fail_ok=False, max_size: Optional[int] = None) -> Union[
+    IO[bytes], None, Tuple[IO[bytes], str], Tuple[None, None]]:
     """
-    Get first file uploaded in the request. Will return None if
-    there is no file uploaded.
+    Get a readable stream for the first file uploaded in the request,
+    without reading the file into memory. werkzeug spools large uploads
+    to a temp file, so the stream can be copied out in chunks.
 
+    If a max_size is given, requests with a Content-Length over it
+    are rejected before the body is parsed at all.
+
+    :param with_filename: also hand back the (secured) filename
+    :param fail_ok: return None instead of aborting if there is no file
+    :param max_size: max size of the request body in bytes
     :return:
     """
 
+    # Reject oversized bodies up front
+    if max_size is not None and request.content_length is not None:
+        req_assert(
+            request.content_length <= max_size,
+            message='file is too large (max {} bytes)'.format(max_size),
+            status_code=413,
+        )
+
     # Check to see if we have a file
     if len(request.files) == 0:
         # If failing is not allowed, call assert false to abort request
@@ -120,17 +135,16 @@ def get_request_file_stream(with_filename=False, fail_ok=False) -> Union[
             req_assert(False, message='No file uploaded')
 
         # If failing is ok, then we can pass back None
-        return None, None if with_filename else None
+        return (None, None) if with_filename else None
 
     # Get file from request
     file = list(request.files.values())[0]
 
     # If they want the filename too
     if with_filename:
-        return file.stream.read(), secure_filename(file.filename)
+        return file.stream, secure_filename(file.filename)
 
-    # Read its stream
-    return file.stream.read()
+    return file.stream
 
 
 def get_request_days_offset():
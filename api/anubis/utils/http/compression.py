@@ -0,0 +1,47 @@
+import io
+import zlib
+
+from werkzeug.wrappers import Response
+
+
+class GzipRequestMiddleware(object):
+    """
+    WSGI middleware that decompresses request bodies sent with
+    Content-Encoding: gzip, so that the views can read them like any
+    other request. The pipeline gzips its reports, as build and test
+    logs can get quite large.
+    """
+
+    def __init__(self, app, max_size: int = 64 * 1024 * 1024):
+        """
+        :param app: wsgi app to wrap
+        :param max_size: max size of a decompressed body
+        """
+        self.app = app
+        self.max_size = max_size
+
+    def __call__(self, environ, start_response):
+        # Pass through anything that was not gzipped
+        if environ.get('HTTP_CONTENT_ENCODING', '').strip().lower() != 'gzip':
+            return self.app(environ, start_response)
+
+        # Read the compressed body
+        content_length = int(environ.get('CONTENT_LENGTH') or 0)
+        body = environ['wsgi.input'].read(content_length)
+
+        # Decompress, without ever holding more than max_size. This
+        # keeps a small body from expanding into something huge.
+        try:
+            decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            data = decompressor.decompress(body, self.max_size + 1)
+        except zlib.error:
+            return Response('invalid gzip body', status=400)(environ, start_response)
+        if len(data) > self.max_size:
+            return Response('body too large', status=413)(environ, start_response)
+
+        # Hand the decompressed body to the app
+        environ['wsgi.input'] = io.BytesIO(data)
+        environ['CONTENT_LENGTH'] = str(len(data))
+        del environ['HTTP_CONTENT_ENCODING']
+
+        return self.app(environ, start_response)
@@ -1,10 +1,26 @@
-from flask import Response, make_response
+import hashlib
+import io
+from typing import IO, Any, Dict, Optional
+
+from flask import Response, request, send_file
+from sqlalchemy.orm import undefer
+from sqlalchemy.sql import or_
 
 from anubis.models import db, StaticFile
-from anubis.utils.data import rand, req_assert
-from anubis.utils.http import get_request_file_stream
+from anubis.utils.cache import tagged_memoize, cache_tag
+from anubis.utils.config import get_config_int
+from anubis.utils.data import rand, req_assert, is_debug
+from anubis.utils.http import get_request_file
+from anubis.utils.static_store import static_blob_path, static_blob_exists, set_static_blob, set_static_blob_stream
 from anubis.lms.courses import course_context
 
+# Cache-Control max-age for versioned static file urls (one year)
+STATIC_IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+# Default max size of a static file upload (1GB). Can be
+# changed with the STATIC_MAX_UPLOAD_SIZE config value.
+STATIC_MAX_UPLOAD_SIZE = 1024 * 1024 * 1024
+
 
 def get_mime_type(blob: bytes) -> str:
     """
@@ -35,45 +51,143 @@ def get_mime_type(blob: bytes) -> str:
     return m.from_buffer(blob)
 
 
-def make_blob_response(file: StaticFile) -> Response:
+@tagged_memoize(timeout=60 * 60, unless=is_debug, local_timeout=60)
+def get_static_file(path: str, filename: str = None) -> Optional[Dict[str, Any]]:
     """
-    Take a static file object, and form a flask response,
-    having the correct bytes content and content-type header.
+    Get the info needed to serve a static file by its path (and
+    optionally filename). The blob itself is never loaded here, so
+    only a small dict is cached.
 
-    :param file:
+    * cached until the static file changes *
+
+    :param path:
+    :param filename:
     :return:
     """
-    # Make a flask response from file data blob
-    response = make_response(file.blob)
+    query = StaticFile.query.filter(or_(StaticFile.path == path, StaticFile.path == "/" + path))
+
+    # If filename was specified, then include it in the query
+    if filename is not None:
+        query = query.filter(StaticFile.filename == filename)
+
+    # Execute the query
+    file: StaticFile = query.first()
+    if file is None:
+        return None
+
+    # Drop the entry when the file is updated
+    cache_tag('static_file:' + file.id)
+
+    return {
+        'id': file.id,
+        'filename': file.filename,
+        'content_type': file.content_type,
+        'blob_key': file.blob_key,
+        'last_updated': file.last_updated,
+    }
+
+
+def make_blob_response(file: Dict[str, Any]) -> Response:
+    """
+    Take a static file (from get_static_file), and form a streaming
+    flask response with the correct content-type header.
+
+    The response has a strong ETag (the sha256 of the file), so
+    If-None-Match gets a 304, and Range requests get a 206. Requests
+    with the ETag as the v query arg get the file as immutable, as
+    the url will change when the file does.
 
-    # Set its content type header to the proper value
-    response.headers["Content-Type"] = file.content_type
+    :param file:
+    :return:
+    """
 
     # If the image is an svg, then we need to make sure that it has
     # the +xml or it will not be rendered correctly in browser.
-    if file.content_type == 'image/svg':
-        response.headers["Content-Type"] = 'imag/svg+xml'
+    content_type = file['content_type']
+    if content_type == 'image/svg':
+        content_type = 'image/svg+xml'
+
+    # Files from before the static store are still in the database
+    if file['blob_key'] is None:
+        blob = StaticFile.query.filter(StaticFile.id == file['id']).options(undefer(StaticFile.blob)).first().blob
+        return send_file(
+            io.BytesIO(blob or b''),
+            mimetype=content_type,
+            download_name=file['filename'],
+            etag=hashlib.sha256(blob or b'').hexdigest(),
+            last_modified=file['last_updated'],
+            max_age=get_config_int('STATIC_MAX_AGE', default=300),
+        )
+
+    # Make sure the blob made it into the store
+    if not static_blob_exists(file['blob_key']):
+        return "404 Not Found :(", 404
+
+    # Versioned urls can be cached forever
+    versioned = request.args.get('v', default=None) == file['blob_key']
+
+    # The file is streamed off disk by the server (not read into
+    # memory), and werkzeug handles the conditional and range headers.
+    response = send_file(
+        static_blob_path(file['blob_key']),
+        mimetype=content_type,
+        download_name=file['filename'],
+        etag=file['blob_key'],
+        last_modified=file['last_updated'],
+        max_age=STATIC_IMMUTABLE_MAX_AGE if versioned else get_config_int('STATIC_MAX_AGE', default=300),
+    )
+    if versioned:
+        response.cache_control.immutable = True
 
     # Hand the flask response back
     return response
 
 
+def get_static_max_upload_size() -> int:
+    """
+    Get the max size (in bytes) of a static file upload.
+
+    :return:
+    """
+    return get_config_int('STATIC_MAX_UPLOAD_SIZE', default=STATIC_MAX_UPLOAD_SIZE)
+
+
+def save_static_file_upload(static_file: StaticFile, stream: IO[bytes], filename: str):
+    """
+    Stream an uploaded file into the static store for a static file. The
+    content type is sniffed from just the first few KB of the file, so the
+    upload is never held in memory as a whole.
+
+    :param static_file:
+    :param stream:
+    :param filename:
+    :return:
+    """
+
+    # Copy the file into the store, stopping if it is too large
+    head = set_static_blob_stream(static_file, stream, get_static_max_upload_size())
+
+    # Figure out content type
+    mime_type = get_mime_type(head)
+
+    if mime_type == 'image/svg':
+        mime_type = 'image/svg+xml'
+
+    # Update the fields
+    static_file.filename = filename
+    static_file.content_type = mime_type
+
+
 def process_file_upload() -> StaticFile:
     # Create a path hash
     path = "/" + rand(16)
 
     # Pull file from request
-    stream, filename = get_request_file_stream(with_filename=True)
+    stream, filename = get_request_file(with_filename=True, max_size=get_static_max_upload_size())
 
     # Make sure we got a file
     req_assert(stream is not None, message='No file uploaded')
 
-    # Figure out content type
-    mime_type = get_mime_type(stream)
-
-    if mime_type == 'image/svg':
-        mime_type = 'image/svg+xml'
-
     # Check to see if blob path already exists
     blob = StaticFile.query.filter(StaticFile.path == path).first()
 
@@ -81,13 +195,36 @@ def process_file_upload() -> StaticFile:
     if blob is None:
         blob = StaticFile(path=path, course_id=course_context.id)
 
-    # Update the fields
-    blob.filename = filename
-    blob.blob = stream
-    blob.content_type = mime_type
+    # Stream the file into the store
+    save_static_file_upload(blob, stream, filename)
 
     # Add to db
     db.session.add(blob)
     db.session.commit()
 
     return blob
+
+
+def offload_static_files(limit: int = 50) -> int:
+    """
+    Move static files that are still stored in the database (from
+    before the static store) into the static store. At most limit files
+    are moved, so this can be called repeatedly to work through a backlog.
+
+    :param limit:
+    :return: number of files moved
+    """
+
+    # Find files still in the database
+    files = StaticFile.query.filter(
+        StaticFile.blob_key == None,
+        StaticFile.blob != None,
+    ).options(undefer(StaticFile.blob)).limit(limit).all()
+
+    # Move them into the store
+    for file in files:
+        set_static_blob(file, file.blob)
+
+    db.session.commit()
+
+    return len(files)
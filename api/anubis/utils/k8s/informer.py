@@ -0,0 +1,285 @@
+import threading
+import time
+import traceback
+from typing import Callable, Dict, List, Optional, Any
+
+from kubernetes import client, watch
+
+from anubis.utils.k8s.pipeline import PIPELINE_JOB_LABEL_SELECTOR
+from anubis.utils.logging import logger
+
+# Event types passed to informer handlers. These match the
+# event types that come out of a kubernetes watch stream.
+INFORMER_ADDED = 'ADDED'
+INFORMER_MODIFIED = 'MODIFIED'
+INFORMER_DELETED = 'DELETED'
+
+# Type of the informer change handlers
+InformerHandler = Callable[[str, Any], None]
+
+
+class Informer(object):
+    """
+    An informer keeps a kubernetes watch stream open in a background
+    thread, and holds an in memory cache of the objects it is watching.
+    The cache is indexed by a key that is pulled off of each object
+    (ie: the theia session id label on theia pods). Handlers can be
+    registered to be called on each change.
+
+    The informer does a full list when it starts, and again only if the
+    watch stream can no longer be resumed (or every resync_seconds). Every
+    other update comes from the watch stream.
+    """
+
+    def __init__(
+            self,
+            name: str,
+            list_func: Callable,
+            label_selector: str,
+            index_func: Callable[[Any], Optional[str]],
+            namespace: str = 'anubis',
+            resync_seconds: int = 300,
+    ):
+        """
+        :param name: name of the informer for logging
+        :param list_func: kubernetes client list function (ie: CoreV1Api().list_namespaced_pod)
+        :param label_selector: label selector for objects to watch
+        :param index_func: function to get the cache key for an object
+        :param namespace: namespace to watch
+        :param resync_seconds: seconds between full relists
+        """
+        self.name = name
+        self.list_func = list_func
+        self.label_selector = label_selector
+        self.index_func = index_func
+        self.namespace = namespace
+        self.resync_seconds = resync_seconds
+
+        self._cache: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+        self._handlers: List[InformerHandler] = []
+        self._synced = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def add_handler(self, handler: InformerHandler):
+        """
+        Register a function to be called as handler(event_type, obj)
+        on every change. Handlers are called from the informer thread.
+
+        :param handler:
+        :return:
+        """
+        self._handlers.append(handler)
+
+    def start(self) -> 'Informer':
+        """
+        Start the watch in a background daemon thread.
+
+        :return:
+        """
+        if self._thread is None:
+            self._thread = threading.Thread(target=self.run, name='informer-' + self.name, daemon=True)
+            self._thread.start()
+        return self
+
+    def wait_for_sync(self, timeout: Optional[float] = None) -> bool:
+        """
+        Block until the initial list has been loaded into the cache.
+
+        :param timeout:
+        :return: True if the cache has synced
+        """
+        return self._synced.wait(timeout)
+
+    @property
+    def synced(self) -> bool:
+        return self._synced.is_set()
+
+    def get(self, key: str) -> Optional[Any]:
+        """
+        Get an object from the cache by its index key.
+
+        :param key:
+        :return:
+        """
+        with self._lock:
+            return self._cache.get(key, None)
+
+    def list(self) -> List[Any]:
+        """
+        Get all the objects in the cache.
+
+        :return:
+        """
+        with self._lock:
+            return list(self._cache.values())
+
+    def keys(self) -> List[str]:
+        """
+        Get all the index keys in the cache.
+
+        :return:
+        """
+        with self._lock:
+            return list(self._cache.keys())
+
+    def __len__(self):
+        with self._lock:
+            return len(self._cache)
+
+    def _emit(self, event_type: str, obj: Any):
+        # Call each of the handlers. A failing handler should
+        # never be able to kill the watch thread.
+        for handler in self._handlers:
+            try:
+                handler(event_type, obj)
+            except Exception as e:
+                logger.error('informer {} handler error {}'.format(self.name, e))
+                logger.error(traceback.format_exc())
+
+    def _relist(self) -> str:
+        """
+        Do a full list, replacing the cache. Handlers are called for
+        every listed object, and for any object that is no longer there.
+
+        :return: resource version to start the watch from
+        """
+        objects = self.list_func(namespace=self.namespace, label_selector=self.label_selector)
+
+        # Build the new cache
+        cache = {}
+        for obj in objects.items:
+            key = self.index_func(obj)
+            if key is not None:
+                cache[key] = obj
+
+        # Swap the cache
+        with self._lock:
+            old_cache, self._cache = self._cache, cache
+
+        # Let the handlers know about the changes
+        for key, obj in cache.items():
+            self._emit(INFORMER_MODIFIED if key in old_cache else INFORMER_ADDED, obj)
+        for key, obj in old_cache.items():
+            if key not in cache:
+                self._emit(INFORMER_DELETED, obj)
+
+        self._synced.set()
+        return objects.metadata.resource_version
+
+    def _apply(self, event_type: str, obj: Any):
+        """
+        Apply a single watch event to the cache, then call the handlers.
+
+        :param event_type:
+        :param obj:
+        :return:
+        """
+        key = self.index_func(obj)
+        if key is None:
+            return
+
+        with self._lock:
+            if event_type == INFORMER_DELETED:
+                self._cache.pop(key, None)
+            else:
+                self._cache[key] = obj
+
+        self._emit(event_type, obj)
+
+    def run(self):
+        """
+        Run the informer loop forever. This is the target of the
+        informer thread, but can be called directly to block.
+
+        :return:
+        """
+        while True:
+            try:
+                resource_version = self._relist()
+                resync_at = time.time() + self.resync_seconds
+
+                # Keep resuming the watch from the last resource version
+                # we have seen until it is time to resync.
+                while time.time() < resync_at:
+                    for event in watch.Watch().stream(
+                            self.list_func,
+                            namespace=self.namespace,
+                            label_selector=self.label_selector,
+                            resource_version=resource_version,
+                            timeout_seconds=max(int(resync_at - time.time()), 1),
+                    ):
+                        obj = event['object']
+                        resource_version = obj.metadata.resource_version
+                        self._apply(event['type'], obj)
+
+            except client.exceptions.ApiException as e:
+                # A 410 means the resource version we were watching from
+                # is too old. Go straight back to a full relist.
+                if e.status != 410:
+                    logger.error('informer {} api error {}'.format(self.name, e))
+                    time.sleep(1)
+            except Exception as e:
+                logger.error('informer {} error {}'.format(self.name, e))
+                logger.error(traceback.format_exc())
+                time.sleep(1)
+
+
+# Process wide informers. These are created on first use.
+_theia_pod_informer: Optional[Informer] = None
+_pipeline_job_informer: Optional[Informer] = None
+
+
+def get_theia_pod_informer() -> Informer:
+    """
+    Get the informer for theia session pods. Pods are indexed
+    by their theia session id. The informer still needs to be
+    started by the caller.
+
+    :return:
+    """
+    global _theia_pod_informer
+
+    if _theia_pod_informer is None:
+        _theia_pod_informer = Informer(
+            'theia-pods',
+            client.CoreV1Api().list_namespaced_pod,
+            label_selector='app.kubernetes.io/name=theia,role=theia-session',
+            index_func=lambda pod: (pod.metadata.labels or {}).get('session', None),
+        )
+
+    return _theia_pod_informer
+
+
+def get_pipeline_job_informer() -> Informer:
+    """
+    Get the informer for submission pipeline jobs. Jobs are indexed
+    by their name, as a submission can have more than one job (ie: a
+    failed job that was left behind, and its regrade). The informer
+    still needs to be started by the caller.
+
+    :return:
+    """
+    global _pipeline_job_informer
+
+    if _pipeline_job_informer is None:
+        _pipeline_job_informer = Informer(
+            'pipeline-jobs',
+            client.BatchV1Api().list_namespaced_job,
+            label_selector=PIPELINE_JOB_LABEL_SELECTOR,
+            index_func=lambda job: job.metadata.name,
+        )
+
+    return _pipeline_job_informer
+
+
+def get_synced_theia_pod_informer() -> Optional[Informer]:
+    """
+    Get the theia pod informer only if it has been started
+    and synced in this process.
+
+    :return:
+    """
+    if _theia_pod_informer is not None and _theia_pod_informer.synced:
+        return _theia_pod_informer
+    return None
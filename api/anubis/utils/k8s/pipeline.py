@@ -1,6 +1,7 @@
 import logging
 import os
 import time
+from typing import Optional, Set, List
 
 import kubernetes
 from kubernetes import client
@@ -8,6 +9,14 @@ from kubernetes import client
 from anubis.models import Submission
 from anubis.utils.data import is_debug
 
+# Label selector that matches all submission pipeline jobs
+PIPELINE_JOB_LABEL_SELECTOR = "app.kubernetes.io/name=submission-pipeline,role=submission-pipeline-worker"
+
+# Annotation on pipeline jobs with the submission id. Submission ids
+# can be longer than label values are allowed to be, so this needs
+# to be an annotation.
+PIPELINE_JOB_SUBMISSION_ANNOTATION = "anubis/submission-id"
+
 
 def create_pipeline_job_obj(submission: Submission) -> client.V1Job:
     """
@@ -83,7 +92,14 @@ def create_pipeline_job_obj(submission: Submission) -> client.V1Job:
         api_version="batch/v1",
         kind="Job",
         metadata=client.V1ObjectMeta(
-            name="submission-pipeline-{}-{}".format(submission.id, int(time.time()))
+            name="submission-pipeline-{}-{}".format(submission.id, int(time.time())),
+            labels={
+                "app.kubernetes.io/name": "submission-pipeline",
+                "role": "submission-pipeline-worker",
+            },
+            annotations={
+                PIPELINE_JOB_SUBMISSION_ANNOTATION: str(submission.id),
+            },
         ),
         spec=spec,
     )
@@ -91,50 +107,90 @@ def create_pipeline_job_obj(submission: Submission) -> client.V1Job:
     return job
 
 
-def reap_pipeline_jobs() -> int:
+def get_pipeline_job_submission_id(job: client.V1Job) -> Optional[str]:
     """
-    Runs through all jobs in the namespace. If the job is finished, it will
-    send a request to the kube api to delete it. Number of active jobs is
-    returned.
+    Get the submission id for a pipeline job from its annotations.
+
+    :param job:
+    :return:
+    """
+    annotations = job.metadata.annotations or {}
+    return annotations.get(PIPELINE_JOB_SUBMISSION_ANNOTATION, None)
+
+
+def is_pipeline_job_finished(job: client.V1Job) -> bool:
+    """
+    Check if a pipeline job has either completed, or
+    failed past its backoff limit.
+
+    :param job:
+    :return:
+    """
+    for condition in job.status.conditions or []:
+        if condition.type in ("Complete", "Failed") and condition.status == "True":
+            return True
+    return False
+
 
-    :return: number of active jobs
+def delete_pipeline_job(job: client.V1Job):
     """
+    Send a request to the kube api to delete a pipeline job.
 
-    # Get the batch v1 object so we can query for active k8s jobs
+    :param job:
+    :return:
+    """
+
+    # Get the batch v1 object so we can delete the job
     batch_v1 = client.BatchV1Api()
 
+    # Log that we are cleaning up the job
+    logging.info("deleting namespaced job {}".format(job.metadata.name))
+
+    # Attempt to delete the k8s job
+    try:
+        batch_v1.delete_namespaced_job(
+            job.metadata.name,
+            job.metadata.namespace,
+            propagation_policy="Background",
+        )
+    except kubernetes.client.exceptions.ApiException:
+        pass
+
+
+def reap_pipeline_jobs(jobs: Optional[List[client.V1Job]] = None) -> Set[str]:
+    """
+    Runs through all jobs in the namespace. If the job is finished, it will
+    send a request to the kube api to delete it. The submission ids of the
+    active jobs are returned.
+
+    :param jobs: optional list of pipeline jobs (ie: from an informer cache)
+    :return: set of submission ids with active jobs
+    """
+
     # Get all pipeline jobs in the anubis namespace
-    jobs = batch_v1.list_namespaced_job(
-        namespace="anubis",
-        label_selector="app.kubernetes.io/name=submission-pipeline,role=submission-pipeline-worker"
-    )
+    if jobs is None:
+        # Get the batch v1 object so we can query for active k8s jobs
+        batch_v1 = client.BatchV1Api()
 
-    # Count the number of active jobs
-    active_count = 0
+        jobs = batch_v1.list_namespaced_job(
+            namespace="anubis",
+            label_selector=PIPELINE_JOB_LABEL_SELECTOR,
+        ).items
+
+    # Running set of submissions with active jobs
+    active_submission_ids = set()
 
     # Iterate through all pipeline jobs
-    for job in jobs.items:
-
-        # If the job has finished, and was marked as successful, then
-        # we can clean it up
-        if job.status.succeeded is not None and job.status.succeeded >= 1:
-
-            # Log that we are cleaning up the job
-            logging.info("deleting namespaced job {}".format(job.metadata.name))
-
-            # Attempt to delete the k8s job
-            try:
-                batch_v1.delete_namespaced_job(
-                    job.metadata.name,
-                    job.metadata.namespace,
-                    propagation_policy="Background",
-                )
-            except kubernetes.client.exceptions.ApiException:
-                pass
-
-        # If the job has not finished, then we increment the active_count
-        # and continue
+    for job in jobs:
+
+        # If the job has finished, then it no longer holds a slot. If
+        # it was marked as successful, then we can clean it up.
+        if is_pipeline_job_finished(job):
+            if job.status.succeeded is not None and job.status.succeeded >= 1:
+                delete_pipeline_job(job)
+
+        # If the job has not finished, then it is still active
         else:
-            active_count += 1
+            active_submission_ids.add(get_pipeline_job_submission_id(job))
 
-    return active_count
+    return active_submission_ids
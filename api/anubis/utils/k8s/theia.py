@@ -1,18 +1,24 @@
 import base64
 import traceback
 from datetime import datetime, timedelta
-from typing import Tuple, Optional, List
+from typing import Tuple, Optional, List, Dict, Set
 
 from kubernetes import config, client
 
-from anubis.models import db, TheiaSession, Course
+from anubis.models import db, TheiaSession, TAForCourse, ProfessorForCourse
 from anubis.utils.auth.token import create_token
-from anubis.lms.theia import get_theia_pod_name, mark_session_ended
-from anubis.lms.courses import get_course_admin_ids
+from anubis.lms.theia import (
+    get_theia_pod_name,
+    mark_session_ended,
+    mark_sessions_ended,
+    publish_theia_session,
+    publish_theia_sessions,
+)
 from anubis.utils.logging import logger
 from anubis.utils.github.parse import parse_github_repo_name
 from anubis.utils.config import get_config_int, get_config_str
 from anubis.utils.data import is_debug
+from anubis.utils.k8s.informer import get_synced_theia_pod_informer
 
 
 def create_theia_k8s_pod_pvc(theia_session: TheiaSession) -> Tuple[client.V1Pod, Optional[client.V1PersistentVolumeClaim]]:
@@ -491,19 +497,36 @@ def reap_theia_session_k8s_resources(theia_session_id: str):
     :param theia_session_id:
     :return:
     """
+    reap_theia_sessions_k8s_resources([theia_session_id])
+
+
+def reap_theia_sessions_k8s_resources(theia_session_ids: List[str], chunk_size: int = 50):
+    """
+    Mark the kubernetes resources for many theia sessions for deletion.
+    Instead of a delete call per session, the pods are deleted with
+    a set based label selector (session in (...)). The ids are chunked
+    to keep the label selector a reasonable size.
+
+    :param theia_session_ids:
+    :param chunk_size:
+    :return:
+    """
     v1 = client.CoreV1Api()
 
-    # Log the reap
-    logger.info("Reaping TheiaSession {}".format(theia_session_id))
+    for index in range(0, len(theia_session_ids), chunk_size):
+        chunk = theia_session_ids[index:index + chunk_size]
 
-    # Mark the pod for deletion by a label selector
-    v1.delete_collection_namespaced_pod(
-        namespace="anubis",
-        label_selector="app.kubernetes.io/name=theia,role=theia-session,session={}".format(
-            theia_session_id,
-        ),
-        propagation_policy="Background",
-    )
+        # Log the reap
+        logger.info("Reaping TheiaSessions {}".format(chunk))
+
+        # Mark the pods for deletion by a label selector
+        v1.delete_collection_namespaced_pod(
+            namespace="anubis",
+            label_selector="app.kubernetes.io/name=theia,role=theia-session,session in ({})".format(
+                ",".join(chunk),
+            ),
+            propagation_policy="Background",
+        )
 
 
 def list_theia_pods() -> client.V1PodList:
@@ -514,6 +537,13 @@ def list_theia_pods() -> client.V1PodList:
 
     :return:
     """
+
+    # If there is a synced theia pod informer running in this
+    # process, then we can skip going to the kube api.
+    informer = get_synced_theia_pod_informer()
+    if informer is not None:
+        return client.V1PodList(items=informer.list())
+
     v1 = client.CoreV1Api()
 
     # List pods by label selector
@@ -535,32 +565,52 @@ def active_theia_pod_count() -> int:
     return len(list_theia_pods().items)
 
 
-def update_theia_pod_cluster_addresses(theia_pods: client.V1PodList):
+def get_theia_pod_session_ids(theia_pods: client.V1PodList) -> List[str]:
     """
-    Iterate through all theia pods, updating the pod cluster
-    addresses in the database as we go.
+    Get the theia session ids for a list of theia pods.
 
     :param theia_pods:
     :return:
     """
+    return [pod.metadata.labels["session"] for pod in theia_pods.items]
 
-    # Iterate through all active
-    for n, pod in enumerate(theia_pods.items):
-        # Get the session id from the pod labels
-        session_id = pod.metadata.labels["session"]
 
-        # Get the database entry for the theia session
-        theia_session: TheiaSession = TheiaSession.query.filter(
-            TheiaSession.id == session_id
-        ).first()
+def update_theia_pod_cluster_addresses(theia_pods: client.V1PodList):
+    """
+    Update the pod cluster addresses in the database for all theia
+    pods. The current addresses for all the sessions are pulled in
+    one query, and only the ones that changed are updated.
 
-        # Make sure we have a session to work on
-        if theia_session is None:
-            continue
+    :param theia_pods:
+    :return:
+    """
 
-        # Update the theia session record in the database with
-        # the pod cluster address.
-        theia_session.cluster_address = pod.status.pod_ip
+    # Map of session id to pod cluster address
+    pod_addresses: Dict[str, Optional[str]] = {
+        pod.metadata.labels["session"]: pod.status.pod_ip
+        for pod in theia_pods.items
+    }
+
+    # Nothing to update
+    if len(pod_addresses) == 0:
+        return
+
+    # Get the current cluster address for all the sessions with pods
+    session_addresses = db.session.query(
+        TheiaSession.id, TheiaSession.cluster_address,
+    ).filter(
+        TheiaSession.id.in_(list(pod_addresses.keys())),
+    ).all()
+
+    # Update the theia session records in the database
+    # that do not match the pod cluster address.
+    updates = [
+        {'id': session_id, 'cluster_address': pod_addresses[session_id]}
+        for session_id, cluster_address in session_addresses
+        if cluster_address != pod_addresses[session_id]
+    ]
+    if len(updates) > 0:
+        db.session.bulk_update_mappings(TheiaSession, updates)
 
     # Commit any and all changes
     db.session.commit()
@@ -579,32 +629,24 @@ def reap_old_theia_sessions(theia_pods: client.V1PodList):
     theia_stale_timeout_hours = get_config_int('THEIA_STALE_TIMEOUT_HOURS', default=6)
     theia_stale_timeout = timedelta(hours=theia_stale_timeout_hours)
 
-    # Iterate through all active
-    for n, pod in enumerate(theia_pods.items):
-
-        # Get the theia session id from the pod labels
-        session_id = pod.metadata.labels["session"]
-
-        # Get the database entry for the theia session
-        theia_session: TheiaSession = TheiaSession.query.filter(
-            TheiaSession.id == session_id
-        ).first()
+    # Get the session ids for all the pods
+    pod_session_ids = get_theia_pod_session_ids(theia_pods)
 
-        # Make sure we have a session to work on
-        if theia_session is None:
-            continue
+    # Nothing to reap
+    if len(pod_session_ids) == 0:
+        return
 
-        # If the session is younger than 6 hours old, continue
-        if datetime.now() <= theia_session.created + theia_stale_timeout:
-            logger.info(f'NOT reaping session {theia_session.id}')
-            continue
+    # Find the sessions with pods that are older than the timeout
+    old_session_ids = [
+        session_id
+        for session_id, in db.session.query(TheiaSession.id).filter(
+            TheiaSession.id.in_(pod_session_ids),
+            TheiaSession.created < datetime.now() - theia_stale_timeout,
+        ).all()
+    ]
 
-        # Reap the session
-        reap_theia_session(theia_session, commit=False)
-
-        # Batch commits in size of 5
-        if n % 5 == 0:
-            db.session.commit()
+    # Reap the sessions
+    reap_theia_sessions(old_session_ids)
 
 
 def fix_stale_theia_resources(theia_pods: client.V1PodList):
@@ -631,60 +673,21 @@ def fix_stale_theia_resources(theia_pods: client.V1PodList):
     standard_theia_timeout = get_config_int('THEIA_STALE_PROXY_MINUTES', default=10)
     admin_theia_timeout = get_config_int('THEIA_ADMIN_STALE_PROXY_MINUTES', default=60)
 
-    # Get list of all courses
-    courses: List[Course] = Course.query.all()
-
-    active_db_sessions: List[TheiaSession] = []
-
-    # Iterate over all courses
-    for course in courses:
-        print("filtering stale ides for course {} - {}".format(course.name, course.course_code))
-
-        # Get a list of (heavily cached) admin id strings
-        course_admin_ids = get_course_admin_ids(course.id)
-        print('course_admin_ids', course.name, course_admin_ids, sep=' :: ')
-
-        # Build query for theia active sessions within the course
-        query = TheiaSession.query.filter(
-            # Get sessions marked as active
-            TheiaSession.active == True,
-
-            # Only consider sessions that have had some
-            # time to have their k8s resources requested.
-            TheiaSession.k8s_requested == True,
-
-            # Only consider sessions that are a part of
-            # this course.
-            TheiaSession.course_id == course.id,
-        )
-
-        # Get a list of the standard (student) theia sessions that are active
-        standard_active_db_theia_sessions: List[TheiaSession] = query.filter(
-            # Filter out admin users (only students in the course)
-            ~TheiaSession.owner_id.in_(course_admin_ids),
-
-            # Filter for sessions that have had a proxy in the last 10 minutes
-            TheiaSession.last_proxy >= datetime.now() - timedelta(minutes=standard_theia_timeout),
+    # Get the (owner_id, course_id) pairs for all course admins
+    # (professors and tas) in one query.
+    course_admins: Set[Tuple[str, str]] = set(
+        db.session.query(TAForCourse.owner_id, TAForCourse.course_id).union(
+            db.session.query(ProfessorForCourse.owner_id, ProfessorForCourse.course_id)
         ).all()
+    )
 
-        # Get a list of the admin (professor/ta) theia sessions that are active
-        admin_active_db_theia_sessions: List[TheiaSession] = query.filter(
-            # Filter for admin users (only professors+tas)
-            TheiaSession.owner_id.in_(course_admin_ids),
-
-            # Filter for sessions that have had a proxy in the last 60 minutes
-            TheiaSession.last_proxy >= datetime.now() - timedelta(minutes=admin_theia_timeout),
-        ).all()
-
-        # Build list of all the active theia ides (in the database)
-        # from the standard and admin sessions.
-        active_db_sessions.extend(standard_active_db_theia_sessions)
-        active_db_sessions.extend(admin_active_db_theia_sessions)
-
-    # Make sure to cover theia sessions that do not have a set
-    # course as well. Hold these course-less ides to the
-    # standard timeout.
-    no_course_db_active_sessions: List[TheiaSession] = TheiaSession.query.filter(
+    # Get all the theia sessions that could still be active. Sessions are
+    # held to the longer admin timeout here, and the standard timeout is
+    # checked in memory.
+    now = datetime.now()
+    candidate_sessions = db.session.query(
+        TheiaSession.id, TheiaSession.owner_id, TheiaSession.course_id, TheiaSession.last_proxy,
+    ).filter(
         # Get sessions marked as active
         TheiaSession.active == True,
 
@@ -692,30 +695,22 @@ def fix_stale_theia_resources(theia_pods: client.V1PodList):
         # time to have their k8s resources requested.
         TheiaSession.k8s_requested == True,
 
-        # Course-less theia session
-        TheiaSession.course_id == None,
-
-        # Filter for sessions that have had a proxy in the last 10 minutes
-        TheiaSession.last_proxy >= datetime.now() - timedelta(minutes=standard_theia_timeout),
+        # Filter for sessions that have had a proxy within the timeout
+        TheiaSession.last_proxy >= now - timedelta(minutes=max(standard_theia_timeout, admin_theia_timeout)),
     ).all()
 
-    # Print the course-less ides to the screen
-    print('no-course ides', no_course_db_active_sessions, sep=' :: ')
-
-    # Add the no-course theia sessions to the active db sessions list
-    active_db_sessions.extend(no_course_db_active_sessions)
-
-    print('active_db_sessions', active_db_sessions)
+    # Build set of active db session ids. Admins (professors and tas) of the
+    # session course get the admin timeout. Students and course-less
+    # sessions get the standard timeout.
+    active_db_ids = set()
+    for session_id, owner_id, course_id, last_proxy in candidate_sessions:
+        is_admin = course_id is not None and (owner_id, course_id) in course_admins
+        timeout = admin_theia_timeout if is_admin else standard_theia_timeout
+        if last_proxy >= now - timedelta(minutes=timeout):
+            active_db_ids.add(session_id)
 
     # Build set of active pod session ids
-    active_pod_ids = set()
-    for pod in theia_pods.items:
-        active_pod_ids.add(pod.metadata.labels["session"])
-
-    # Build set of active db session ids
-    active_db_ids = set()
-    for active_db_session in active_db_sessions:
-        active_db_ids.add(active_db_session.id)
+    active_pod_ids = set(get_theia_pod_session_ids(theia_pods))
 
     # Figure out which ones don't match
     # and need to be updated.
@@ -735,18 +730,53 @@ def fix_stale_theia_resources(theia_pods: client.V1PodList):
         )
 
     # Reap theia sessions
-    from anubis.rpc.theia import reap_theia_session_by_id
-    for stale_pod_id in stale_pods_ids:
-        reap_theia_session_by_id(stale_pod_id)
+    ended_ids = reap_theia_sessions(list(stale_pods_ids), commit=False)
 
     # Update database entries
-    TheiaSession.query.filter(
-        TheiaSession.id.in_(list(stale_db_ids)),
-    ).update({TheiaSession.active: False}, False)
+    if len(stale_db_ids) > 0:
+        TheiaSession.query.filter(
+            TheiaSession.id.in_(list(stale_db_ids)),
+        ).update({TheiaSession.active: False}, False)
 
     # Commit any and all changes to the database
     db.session.commit()
 
+    # Let anyone waiting on the reaped sessions know they ended
+    publish_theia_sessions(ended_ids)
+
+
+def reap_theia_sessions(theia_session_ids: List[str], commit: bool = True) -> List[str]:
+    """
+    Reap many theia sessions at once. The kubernetes resources for all
+    the sessions are marked for deletion with set based label selectors,
+    then the database entries are marked as ended in a single update.
+
+    When commit is False, the ids of the sessions that were ended are
+    returned and it is up to the caller to publish them after it commits.
+
+    :param theia_session_ids:
+    :param commit:
+    :return: ids of the sessions that were ended
+    """
+
+    # Nothing to reap
+    if len(theia_session_ids) == 0:
+        return []
+
+    # Mark the session resources in kubernetes for deletion
+    reap_theia_sessions_k8s_resources(theia_session_ids)
+
+    # Mark the database entries as ended and inactive
+    ended_ids = mark_sessions_ended(theia_session_ids)
+
+    # Commit the changes to the database entries, then let
+    # anyone waiting on the sessions know they ended
+    if commit:
+        db.session.commit()
+        publish_theia_sessions(ended_ids)
+
+    return ended_ids
+
 
 def reap_theia_session(theia_session: TheiaSession, commit: bool = True):
     """
@@ -775,6 +805,22 @@ def reap_theia_session(theia_session: TheiaSession, commit: bool = True):
 
 
 def update_theia_session(session: TheiaSession):
+    """
+    Update the state of a theia session from its pod. If there is a
+    synced theia pod informer running in this process, then the pod
+    is read from the informer cache. Otherwise the pod is read from
+    the kube api.
+
+    :param session:
+    :return:
+    """
+
+    # Try the informer cache first
+    informer = get_synced_theia_pod_informer()
+    if informer is not None:
+        update_theia_session_from_pod(session, informer.get(session.id))
+        return
+
     # Load the kubernetes incluster config
     v1 = client.CoreV1Api()
 
@@ -794,14 +840,44 @@ def update_theia_session(session: TheiaSession):
 
         # If the status code is 404, then it has not been created yet
         if e.status == 404:
-            if session.state != 'Waiting for IDE to be scheduled...':
-                session.state = 'Waiting for IDE to be scheduled...'
-                db.session.commit()
+            update_theia_session_from_pod(session, None)
             return
 
         # Error
         logger.error(traceback.format_exc())
         logger.error('continuing')
+        return
+
+    update_theia_session_from_pod(session, pod)
+
+
+def update_theia_session_from_pod(session: TheiaSession, pod: Optional[client.V1Pod]):
+    """
+    Update the state and cluster address of a theia session
+    from the status of its pod. If the pod is None, then it has
+    not been created yet.
+
+    Anyone listening for updates on the session will be notified
+    if the state changed.
+
+    :param session:
+    :param pod:
+    :return:
+    """
+
+    # Remember the state so we only publish actual changes
+    previous_state = session.state
+
+    # If the pod is not there, then it has not been created yet
+    if pod is None:
+        if session.state != 'Waiting for IDE to be scheduled...':
+            session.state = 'Waiting for IDE to be scheduled...'
+            db.session.commit()
+            publish_theia_session(session)
+        return
+
+    # Get the name of the pod
+    pod_name = pod.metadata.name
 
     # Update the session state from the pod status
     if pod.status.phase == 'Pending':
@@ -843,3 +919,7 @@ def update_theia_session(session: TheiaSession):
         logger.info("Theia session started {}".format(pod_name))
 
         db.session.commit()
+
+    # Let any listeners know about the new state
+    if session.state != previous_state:
+        publish_theia_session(session)
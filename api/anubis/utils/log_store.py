@@ -0,0 +1,164 @@
+import gzip
+import hashlib
+import os
+from typing import Iterator, Optional, Tuple
+
+from anubis.config import config
+
+# Max number of (uncompressed) bytes of a log that are put inline in
+# submission data. Anything longer is streamed from the log endpoints.
+LOG_PREVIEW_SIZE = 64 * 1024
+
+# Size of the decompressed chunks logs are streamed in
+LOG_CHUNK_SIZE = 64 * 1024
+
+# Max length of a test result message. Messages are short status lines
+# from the test helpers (ie: "Expected output found"), and are shown
+# for every test of a submission, so they stay inline in the row instead
+# of in the store. Longer messages are clipped so that a message can
+# never grow into a second log.
+TEST_MESSAGE_MAX_LENGTH = 1024
+
+
+def _log_path(key: str) -> str:
+    """
+    Get the path of a log blob in the store. Blobs are fanned
+    out into directories by the first bytes of their key so that
+    no one directory gets too large.
+
+    :param key:
+    :return:
+    """
+    return os.path.join(config.LOG_STORE_PATH, key[:2], key[2:4], key + '.gz')
+
+
+def put_log(text: Optional[str]) -> Tuple[Optional[str], int]:
+    """
+    Write a log into the store. Logs are gzipped, and keyed by the sha256
+    of their contents. Writing a log that is already in the store is a
+    no-op, so identical logs (which are common for test output) are only
+    stored once.
+
+    Empty logs are not stored, and get a None key.
+
+    :param text:
+    :return: key of the log, size of the uncompressed log in bytes
+    """
+
+    # Don't bother storing empty logs
+    if not text:
+        return None, 0
+
+    data = text.encode('utf-8', errors='replace')
+    key = hashlib.sha256(data).hexdigest()
+    path = _log_path(key)
+
+    # Only write the blob if it is not already there. The blob is
+    # written to a temp file, then moved into place so a reader
+    # never sees a partial blob.
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = '{}.{}.tmp'.format(path, os.urandom(4).hex())
+        with gzip.open(tmp_path, 'wb', compresslevel=6) as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    return key, len(data)
+
+
+def iter_log(key: str, start: int = 0, end: Optional[int] = None) -> Iterator[bytes]:
+    """
+    Stream the bytes [start, end) of a log in decompressed chunks. At
+    most one chunk of the log is ever held in memory.
+
+    :param key:
+    :param start: first byte to read
+    :param end: byte to stop before, or None to read to the end
+    :return:
+    """
+    with gzip.open(_log_path(key), 'rb') as f:
+        # gzip can only seek by decompressing up to the start,
+        # but it does so without holding onto the skipped data.
+        if start > 0:
+            f.seek(start)
+
+        remaining = None if end is None else end - start
+        while remaining is None or remaining > 0:
+            chunk = f.read(LOG_CHUNK_SIZE if remaining is None else min(LOG_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            if remaining is not None:
+                remaining -= len(chunk)
+            yield chunk
+
+
+def read_log(key: Optional[str], start: int = 0, end: Optional[int] = None) -> str:
+    """
+    Read the bytes [start, end) of a log from the store as text. Missing
+    logs (or a None key) read as empty.
+
+    :param key:
+    :param start:
+    :param end:
+    :return:
+    """
+    if key is None:
+        return ''
+
+    try:
+        return b''.join(iter_log(key, start, end)).decode('utf-8', errors='replace')
+    except FileNotFoundError:
+        return ''
+
+
+def log_exists(key: str) -> bool:
+    """
+    Check if a log is in the store.
+
+    :param key:
+    :return:
+    """
+    return os.path.exists(_log_path(key))
+
+
+def set_stdout(obj, stdout: Optional[str]):
+    """
+    Store the stdout for a submission build or test result. The log
+    goes into the store, and only its key and size are kept in the row.
+
+    :param obj: SubmissionBuild or SubmissionTestResult
+    :param stdout:
+    :return:
+    """
+    obj.stdout_key, obj.stdout_size = put_log(stdout)
+    obj.stdout = None
+
+
+def set_message(obj, message: Optional[str]):
+    """
+    Set the message for a submission test result. Messages are
+    kept inline, clipped to TEST_MESSAGE_MAX_LENGTH.
+
+    :param obj: SubmissionTestResult
+    :param message:
+    :return:
+    """
+    obj.message = message[:TEST_MESSAGE_MAX_LENGTH] if message is not None else None
+
+
+def get_stdout_preview(obj) -> Tuple[str, bool]:
+    """
+    Get the start of the stdout for a submission build or test result,
+    along with whether it was cut off. Rows from before the log store
+    still have their stdout inline, and are handed back as is.
+
+    :param obj: SubmissionBuild or SubmissionTestResult
+    :return: stdout preview, whether the preview was truncated
+    """
+
+    # Logs that were never moved into the store
+    if obj.stdout_key is None:
+        return obj.stdout or '', False
+
+    truncated = (obj.stdout_size or 0) > LOG_PREVIEW_SIZE
+    return read_log(obj.stdout_key, 0, LOG_PREVIEW_SIZE), truncated
@@ -0,0 +1,108 @@
+import base64
+import json
+from datetime import datetime
+from typing import Any, List, Optional, Tuple
+
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import Query
+
+from anubis.utils.exceptions import AssertError
+
+
+def encode_cursor(*values: Any) -> str:
+    """
+    Encode the sort key values of the last row in a page into an
+    opaque cursor string that can be handed to the frontend.
+
+    :param values:
+    :return:
+    """
+    return base64.urlsafe_b64encode(json.dumps([
+        value.isoformat() if isinstance(value, datetime) else value
+        for value in values
+    ]).encode()).decode()
+
+
+def decode_cursor(cursor: str, columns: List) -> List[Any]:
+    """
+    Decode a cursor made by encode_cursor back into the sort key values
+    for the given columns. Values for DateTime columns are converted back
+    into datetimes. An AssertError (400) is raised if the cursor is bad.
+
+    :param cursor:
+    :param columns:
+    :return:
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+        if not isinstance(values, list) or len(values) != len(columns):
+            raise ValueError('cursor does not match sort columns')
+
+        return [
+            datetime.fromisoformat(value)
+            if value is not None and column.type.python_type is datetime
+            else value
+            for column, value in zip(columns, values)
+        ]
+    except (ValueError, TypeError, UnicodeDecodeError):
+        raise AssertError('invalid cursor', 400)
+
+
+def keyset_filter(columns: List, values: List[Any]):
+    """
+    Build the filter for the rows that come after the cursor values when
+    ordering by the columns descending. For columns (a, b) this is:
+
+        a < :a OR (a = :a AND b < :b)
+
+    This is written out instead of as a row comparison so that it can use
+    a composite index on the columns in every database we run on.
+
+    :param columns:
+    :param values:
+    :return:
+    """
+    clauses = []
+    for index, (column, value) in enumerate(zip(columns, values)):
+        clauses.append(and_(
+            *[c == v for c, v in zip(columns[:index], values[:index])],
+            column < value,
+        ))
+    return or_(*clauses)
+
+
+def keyset_paginate(query: Query, columns: List, cursor: Optional[str], limit: int) -> Tuple[List[Any], Optional[str]]:
+    """
+    Get a page of a query, ordered by the columns descending, starting after
+    the cursor. The last column should be unique (ie: the id) so that the
+    order is stable. Unlike limit/offset, the cost of a page does not grow
+    with how deep the page is.
+
+    The sort columns can not be null (null never compares as less than the
+    cursor, so every row after it would be skipped). Wrap nullable columns
+    in a coalesce, ie: func.coalesce(User.name, '').
+
+    :param query: query to paginate (without an order_by). Must select a single entity.
+    :param columns: sort columns, ie: [Submission.created, Submission.id]
+    :param cursor: cursor from the previous page, or None / empty for the first page
+    :param limit: page size
+    :return: rows in the page, cursor for the next page (None if this is the last page)
+    """
+
+    # Skip to the rows after the cursor
+    if cursor:
+        query = query.filter(keyset_filter(columns, decode_cursor(cursor, columns)))
+
+    # Get one extra row to tell if there is a next page. The sort values
+    # are selected along with each row, so the cursor holds exactly what
+    # the next page is compared against (even for sort expressions).
+    rows = query.add_columns(*columns).order_by(
+        *[column.desc() for column in columns]
+    ).limit(limit + 1).all()
+
+    # No next page
+    if len(rows) <= limit:
+        return [row[0] for row in rows], None
+
+    rows = rows[:limit]
+    return [row[0] for row in rows], encode_cursor(*rows[-1][1:])
@@ -0,0 +1,222 @@
+import time
+from typing import List, Set
+
+from anubis.utils.cache import get_redis_connection
+
+# Redis keys for the pipeline scheduler
+#
+# pending: sorted set of submission ids waiting for a pipeline slot. The
+#          score is the priority of the submission followed by the time
+#          it was pushed, so the lowest score is always the next to launch.
+#          A submission can be pending while it still holds a slot (ie: it
+#          was regraded while its pipeline was running).
+# active:  sorted set of submission ids that have been given a pipeline
+#          slot. The score is the time the slot was claimed.
+# jobs:    hash of submission id to the name of the pipeline job holding
+#          its slot. A submission can have more than one job around (ie: a
+#          failed job left behind, and its regrade), so only events for
+#          the job holding the slot are allowed to release it.
+PIPELINE_PENDING_KEY = 'anubis:pipeline:pending'
+PIPELINE_ACTIVE_KEY = 'anubis:pipeline:active'
+PIPELINE_JOBS_KEY = 'anubis:pipeline:jobs'
+
+# Priorities for pending submissions (lower goes first). Fresh pushes from
+# students should always be scheduled before bulk regrades.
+PIPELINE_PRIORITY_PUSH = 0
+PIPELINE_PRIORITY_REGRADE = 1
+
+# Priority is spaced out far enough that a timestamp will
+# never push a submission into the next priority.
+_PRIORITY_SPACING = 10 ** 12
+
+# Move pending submissions into the active set until either the active
+# set is full, or there is nothing left pending. A submission that is
+# pending while its last pipeline still holds a slot is left pending until
+# that slot is given back. There can be at most ZCARD(active) of those, so
+# that many extra candidates is always enough. This is done in a lua script
+# so that the check and the claim are atomic across all the rpc workers.
+_CLAIM_SLOTS_SCRIPT = """
+local claimed = {}
+local active = redis.call('ZCARD', KEYS[2])
+local available = tonumber(ARGV[1]) - active
+if available <= 0 then
+    return claimed
+end
+local candidates = redis.call('ZRANGE', KEYS[1], 0, available + active - 1)
+for _, submission_id in ipairs(candidates) do
+    if available == 0 then
+        break
+    end
+    if not redis.call('ZSCORE', KEYS[2], submission_id) then
+        redis.call('ZREM', KEYS[1], submission_id)
+        redis.call('ZADD', KEYS[2], ARGV[2], submission_id)
+        redis.call('HDEL', KEYS[3], submission_id)
+        table.insert(claimed, submission_id)
+        available = available - 1
+    end
+end
+return claimed
+"""
+
+# Push submissions into the pending set. A submission that is already
+# pending only ever has its score lowered (the same as ZADD LT, which
+# needs redis 6.2). This way a regrade can never bump a pending push
+# further back in the queue.
+_PUSH_PENDING_SCRIPT = """
+for i = 1, #ARGV, 2 do
+    local submission_id = ARGV[i]
+    local score = tonumber(ARGV[i + 1])
+    local current = redis.call('ZSCORE', KEYS[1], submission_id)
+    if not current or score < tonumber(current) then
+        redis.call('ZADD', KEYS[1], score, submission_id)
+    end
+end
+"""
+
+# Release the slot held by a submission, but only if the given
+# job is the one holding it.
+_RELEASE_JOB_SLOT_SCRIPT = """
+if redis.call('HGET', KEYS[2], ARGV[1]) == ARGV[2] then
+    redis.call('ZREM', KEYS[1], ARGV[1])
+    redis.call('HDEL', KEYS[2], ARGV[1])
+    return 1
+end
+return 0
+"""
+
+
+def _decode(value) -> str:
+    return value.decode() if isinstance(value, bytes) else value
+
+
+def push_pending_pipelines(submission_ids: List[str], priority: int = PIPELINE_PRIORITY_REGRADE):
+    """
+    Add submissions to the pending pipeline queue. Submissions that
+    are already pending keep their place unless this push would move
+    them up in the queue. Submissions that still hold a pipeline slot
+    are queued too, and are launched again once that slot is given back.
+
+    :param submission_ids:
+    :param priority:
+    :return:
+    """
+
+    # Nothing to push
+    if len(submission_ids) == 0:
+        return
+
+    score = priority * _PRIORITY_SPACING + time.time()
+    args = []
+    for submission_id in submission_ids:
+        args.extend((submission_id, score))
+
+    get_redis_connection().eval(
+        _PUSH_PENDING_SCRIPT, 1,
+        PIPELINE_PENDING_KEY,
+        *args,
+    )
+
+
+def claim_pipeline_slots(max_jobs: int) -> List[str]:
+    """
+    Claim as many free pipeline slots as possible for pending
+    submissions. The submission ids that were given a slot are
+    returned. Each of them needs to either have a pipeline job
+    created, or have the slot released.
+
+    :param max_jobs: maximum number of in flight pipeline jobs
+    :return: list of submission ids that were given a slot
+    """
+    r = get_redis_connection()
+    claimed = r.eval(
+        _CLAIM_SLOTS_SCRIPT, 3,
+        PIPELINE_PENDING_KEY, PIPELINE_ACTIVE_KEY, PIPELINE_JOBS_KEY,
+        max_jobs, time.time(),
+    )
+    return [_decode(submission_id) for submission_id in claimed]
+
+
+def set_pipeline_slot_job(submission_id: str, job_name: str):
+    """
+    Record the pipeline job that holds the slot for a submission. This
+    should be set before the job is created, so that no event for the
+    job can come in before it.
+
+    :param submission_id:
+    :param job_name:
+    :return:
+    """
+    get_redis_connection().hset(PIPELINE_JOBS_KEY, submission_id, job_name)
+
+
+def release_pipeline_slot(submission_id: str, job_name: str = None) -> bool:
+    """
+    Give back the pipeline slot held by a submission. Releasing
+    a slot that is not held is a no-op.
+
+    If a job name is given, then the slot is only released if that
+    job is the one holding it. Events for an older job of the same
+    submission will then never release the slot of a newer one.
+
+    :param submission_id:
+    :param job_name: name of the pipeline job giving back the slot
+    :return: True if the slot was released
+    """
+    r = get_redis_connection()
+
+    if job_name is not None:
+        return bool(r.eval(
+            _RELEASE_JOB_SLOT_SCRIPT, 2,
+            PIPELINE_ACTIVE_KEY, PIPELINE_JOBS_KEY,
+            submission_id, job_name,
+        ))
+
+    pipe = r.pipeline()
+    pipe.zrem(PIPELINE_ACTIVE_KEY, submission_id)
+    pipe.hdel(PIPELINE_JOBS_KEY, submission_id)
+    removed, _ = pipe.execute()
+    return removed > 0
+
+
+def reconcile_pipeline_slots(running_submission_ids: Set[str], grace: int = 60) -> List[str]:
+    """
+    Release any slots that are not backed by a running pipeline job. This
+    will fix the slot count if a watch event was ever missed. Slots that
+    were claimed in the last `grace` seconds are left alone, as their
+    jobs may not have been created yet.
+
+    :param running_submission_ids: submission ids of running pipeline jobs
+    :param grace: seconds to wait before releasing a claimed slot
+    :return: list of submission ids whose slot was released
+    """
+    r = get_redis_connection()
+    cutoff = time.time() - grace
+
+    # Find the slots that were claimed before the cutoff, and
+    # do not have a job.
+    stale = [
+        _decode(submission_id)
+        for submission_id in r.zrangebyscore(PIPELINE_ACTIVE_KEY, '-inf', cutoff)
+        if _decode(submission_id) not in running_submission_ids
+    ]
+
+    if len(stale) > 0:
+        pipe = r.pipeline()
+        pipe.zrem(PIPELINE_ACTIVE_KEY, *stale)
+        pipe.hdel(PIPELINE_JOBS_KEY, *stale)
+        pipe.execute()
+
+    return stale
+
+
+def get_pipeline_scheduler_stats() -> dict:
+    """
+    Get the current number of active and pending pipelines.
+
+    :return:
+    """
+    r = get_redis_connection()
+    return {
+        'active': r.zcard(PIPELINE_ACTIVE_KEY),
+        'pending': r.zcard(PIPELINE_PENDING_KEY),
+    }
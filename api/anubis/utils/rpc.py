@@ -1,10 +1,11 @@
 import traceback
+from typing import Dict, List, Optional, Sequence
 
-from redis import Redis
 from rq import Queue
 
 from anubis.config import config
-from anubis.rpc.pipeline import create_submission_pipeline
+from anubis.utils.cache import get_redis_connection
+from anubis.rpc.pipeline import create_submission_pipeline, schedule_submission_pipelines
 from anubis.rpc.seed import seed
 from anubis.rpc.theia import (
     initialize_theia_session,
@@ -12,6 +13,33 @@ from anubis.rpc.theia import (
     reap_stale_theia_sessions,
 )
 from anubis.rpc.visualizations import create_visuals as create_visuals_
+from anubis.rpc.webhook import process_webhook_deliveries
+from anubis.utils.pipeline.scheduler import (
+    push_pending_pipelines,
+    PIPELINE_PRIORITY_PUSH,
+    PIPELINE_PRIORITY_REGRADE,
+)
+
+
+# Process wide rq queue objects. These are created lazily
+# so that importing this module does not require a redis
+# connection (ie: MINDEBUG).
+_rpc_queues: Dict[str, Queue] = {}
+
+
+def get_rpc_queue(queue: str) -> Queue:
+    """
+    Get the (cached) rq queue object for a queue name.
+
+    :param queue: name of the queue
+    :return:
+    """
+
+    # Create the queue on first use
+    if queue not in _rpc_queues:
+        _rpc_queues[queue] = Queue(name=queue, connection=get_redis_connection())
+
+    return _rpc_queues[queue]
 
 
 def rpc_enqueue(func, queue=None, args=None):
@@ -38,15 +66,80 @@ def rpc_enqueue(func, queue=None, args=None):
             print(traceback.format_exc())
             return
 
-    with Redis(host=config.CACHE_REDIS_HOST, password=config.CACHE_REDIS_PASSWORD) as conn:
-        q = Queue(name=queue, connection=conn)
-        q.enqueue(func, *args)
-        conn.close()
+    get_rpc_queue(queue).enqueue(func, *args)
 
 
-def enqueue_autograde_pipeline(*args, queue: str = 'regrade'):
+def rpc_enqueue_many(func, queue: Optional[str] = None, arg_list: Sequence[Sequence] = None):
+    """
+    Enqueue a job for each set of arguments in the arg_list. All
+    the jobs are pushed to redis in a single pipeline, so this is one
+    round trip no matter how many jobs there are.
+
+    :func callable: any callable object
+    :queue str: name of the queue
+    :arg_list list: list of ordered arguments for each job
+    """
+
+    # Set defaults
+    if queue is None:
+        queue = 'default'
+    if arg_list is None:
+        arg_list = []
+
+    # Nothing to enqueue
+    if len(arg_list) == 0:
+        return
+
+    # If we are running in mindebug, there is
+    # no rq cluster to send things off to.
+    if config.MINDEBUG:
+        for args in arg_list:
+            rpc_enqueue(func, queue=queue, args=args)
+        return
+
+    q = get_rpc_queue(queue)
+    q.enqueue_many([
+        Queue.prepare_data(func, args=tuple(args))
+        for args in arg_list
+    ])
+
+
+def enqueue_autograde_pipeline(submission_id: str, queue: str = 'regrade'):
     """Enqueues a test job"""
-    rpc_enqueue(create_submission_pipeline, queue=queue, args=args)
+    enqueue_autograde_pipelines([submission_id], queue=queue)
+
+
+def enqueue_autograde_pipelines(submission_ids: List[str], queue: str = 'regrade'):
+    """
+    Push submissions to the pipeline scheduler, then enqueue a job
+    to launch pipelines for any free slots. Submissions on the regrade
+    queue are scheduled after everything else.
+    """
+
+    # Nothing to enqueue
+    if len(submission_ids) == 0:
+        return
+
+    # If we are running in mindebug, there is no scheduler
+    # so just try to create the pipelines directly.
+    if config.MINDEBUG:
+        rpc_enqueue_many(create_submission_pipeline, queue=queue, arg_list=[
+            (submission_id,) for submission_id in submission_ids
+        ])
+        return
+
+    # Add the submissions to the pending queue
+    priority = PIPELINE_PRIORITY_REGRADE if queue == 'regrade' else PIPELINE_PRIORITY_PUSH
+    push_pending_pipelines(submission_ids, priority=priority)
+
+    # Launch what we can right away. Anything left pending will be
+    # launched by the scheduler when slots free up.
+    rpc_enqueue(schedule_submission_pipelines, queue=queue)
+
+
+def enqueue_webhook_deliveries():
+    """Enqueue a job to process pending webhook deliveries"""
+    rpc_enqueue(process_webhook_deliveries, queue='default')
 
 
 def enqueue_ide_initialize(*args):
@@ -0,0 +1,138 @@
+import hashlib
+import io
+import os
+from typing import BinaryIO, Optional, Tuple
+
+from anubis.config import config
+from anubis.utils.exceptions import AssertError
+
+# Size of the chunks files are streamed into the store in
+STATIC_CHUNK_SIZE = 1024 * 1024
+
+# Number of bytes from the start of a file that are kept
+# for sniffing its content type
+STATIC_HEAD_SIZE = 8 * 1024
+
+
+def static_blob_path(key: str) -> str:
+    """
+    Get the path of a static file blob in the store. Blobs are fanned
+    out into directories by the first bytes of their key so that no one
+    directory gets too large.
+
+    :param key:
+    :return:
+    """
+    return os.path.join(config.STATIC_STORE_PATH, key[:2], key[2:4], key)
+
+
+def static_blob_exists(key: str) -> bool:
+    """
+    Check if a static file blob is in the store.
+
+    :param key:
+    :return:
+    """
+    return os.path.exists(static_blob_path(key))
+
+
+def put_static_stream(stream: BinaryIO, max_size: Optional[int] = None) -> Tuple[str, int, bytes]:
+    """
+    Stream a static file into the store in chunks. The sha256 is built
+    up as the chunks are written, so at most one chunk of the file is
+    ever held in memory. Blobs are stored as is (so that byte ranges can
+    be read straight off disk), and keyed by their sha256. The key doubles
+    as a strong ETag. Writing a blob that is already in the store is a no-op.
+
+    An AssertError (413) is raised as soon as the file goes over max_size.
+
+    :param stream: file like object to read the file from
+    :param max_size: max size of the file in bytes, or None for no limit
+    :return: key of the blob, size of the blob in bytes, first bytes of the blob
+    """
+
+    # The file is written to a temp file in the store (so that it is on the
+    # same filesystem), then moved into place once we know its key. This way
+    # a reader never sees a partial blob.
+    tmp_dir = os.path.join(config.STATIC_STORE_PATH, 'tmp')
+    os.makedirs(tmp_dir, exist_ok=True)
+    tmp_path = os.path.join(tmp_dir, os.urandom(8).hex())
+
+    sha = hashlib.sha256()
+    size = 0
+    head = b''
+
+    try:
+        with open(tmp_path, 'wb') as f:
+            while True:
+                chunk = stream.read(STATIC_CHUNK_SIZE)
+                if not chunk:
+                    break
+
+                # Stop as soon as the file is too big
+                size += len(chunk)
+                if max_size is not None and size > max_size:
+                    raise AssertError('file is too large (max {} bytes)'.format(max_size), 413)
+
+                # Hold onto the start of the file for content type sniffing
+                if len(head) < STATIC_HEAD_SIZE:
+                    head += chunk[:STATIC_HEAD_SIZE - len(head)]
+
+                sha.update(chunk)
+                f.write(chunk)
+
+        # Move the blob into place
+        key = sha.hexdigest()
+        path = static_blob_path(key)
+        if os.path.exists(path):
+            os.remove(tmp_path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(tmp_path, path)
+
+    except BaseException:
+        # Clean up the partial file
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    return key, size, head
+
+
+def put_static_blob(data: bytes) -> Tuple[str, int]:
+    """
+    Write a static file blob that is already in memory into the store.
+
+    :param data:
+    :return: key of the blob, size of the blob in bytes
+    """
+    key, size, _ = put_static_stream(io.BytesIO(data))
+    return key, size
+
+
+def set_static_blob(static_file, data: bytes):
+    """
+    Store the contents of a static file. The blob goes into the store,
+    and only its key and size are kept in the row.
+
+    :param static_file: StaticFile
+    :param data:
+    :return:
+    """
+    static_file.blob_key, static_file.size = put_static_blob(data)
+    static_file.blob = None
+
+
+def set_static_blob_stream(static_file, stream: BinaryIO, max_size: Optional[int] = None) -> bytes:
+    """
+    Stream the contents of a static file into the store. Only the key
+    and size are kept in the row.
+
+    :param static_file: StaticFile
+    :param stream:
+    :param max_size: max size of the file in bytes, or None for no limit
+    :return: first bytes of the file (for content type sniffing)
+    """
+    static_file.blob_key, static_file.size, head = put_static_stream(stream, max_size)
+    static_file.blob = None
+    return head
@@ -18,7 +18,11 @@ from anubis.models import (
     ProfessorForCourse,
     StaticFile,
     LateException,
+    StudentAssignmentBest,
     LectureNotes,
+    UsageRollup,
+    RollupWatermark,
+    WebhookDelivery,
 )
 from anubis.utils.data import with_context
 from anubis.lms.questions import assign_questions
@@ -29,11 +33,16 @@ from anubis.utils.testing.seed import (
     init_submissions,
 )
 from anubis.utils.logging import logger
-from anubis.lms.autograde import bulk_autograde
+from anubis.lms.autograde import bulk_autograde, bulk_best_submission_ids, autograde_submission_result_wrapper
+from anubis.lms.students import get_students_in_class
 
 
 def do_seed() -> str:
     # Yeet
+    UsageRollup.query.delete()
+    RollupWatermark.query.delete()
+    WebhookDelivery.query.delete()
+    StudentAssignmentBest.query.delete()
     LateException.query.delete()
     TheiaSession.query.delete()
     AssignedQuestionResponse.query.delete()
@@ -72,29 +81,100 @@ def do_seed() -> str:
     return os_assignment0.id
 
 
-@with_context
-def main():
-    print('Seeding submission data')
-    seed_start = time.time()
-    assignment_id = do_seed()
-    seed_end = time.time()
-    print('Seed done in {}s'.format(seed_end - seed_start))
+def per_student_autograde(assignment_id: str):
+    """
+    Autograde each student with their own call. The best submission for
+    each student is calculated from their submissions, so this never reads
+    the materialized student_assignment_best table. It is the reference
+    the bulk autograde results are checked against.
+
+    :param assignment_id:
+    :return:
+    """
+    assignment = Assignment.query.filter(Assignment.id == assignment_id).first()
+    students = get_students_in_class(assignment.course_id, offset=0, limit=100)
+    return [
+        autograde_submission_result_wrapper(
+            assignment,
+            student["id"],
+            student["netid"],
+            student["name"],
+            bulk_best_submission_ids(assignment.id, [student["id"]]).get(student["id"], None),
+        )
+        for student in students
+    ]
 
-    n = 10
+
+def clear_student_assignment_bests():
+    """
+    Empty the materialized best submissions so that the
+    next bulk autograde has to calculate all of them.
+
+    :return:
+    """
+    StudentAssignmentBest.query.delete()
+    db.session.commit()
+
+
+def time_autograde(name: str, func, assignment_id: str, n: int = 10, setup=None):
     timings = []
-    print(f'Running bulk autograde on assignment {n} times [ 5K submissions, across 50 students ]')
+    results = None
+    print(f'Running {name} autograde on assignment {n} times [ 5K submissions, across 100 students ]')
     for i in range(n):
-        print(f'autograde pass {i+1}/{n} ', end='', flush=True)
+        print(f'{name} autograde pass {i+1}/{n} ', end='', flush=True)
+
+        # Setup is not part of the timing
+        if setup is not None:
+            setup()
+
         db.session.expunge_all()
         start = time.time()
-        bulk_autograde(assignment_id, limit=100)
+        results = func(assignment_id)
         end = time.time()
         timings.append(end - start)
 
         print('{:.2f}s'.format(end-start))
 
-    print('Average time :: {:.2f}s'.format(sum(timings) / len(timings)))
+    average = sum(timings) / len(timings)
+    print('{} average time :: {:.2f}s'.format(name, average))
+    return average, results
+
+
+@with_context
+def main():
+    print('Seeding submission data')
+    seed_start = time.time()
+    assignment_id = do_seed()
+    seed_end = time.time()
+    print('Seed done in {}s'.format(seed_end - seed_start))
+
+    # Time the per student autograde
+    per_student_average, per_student_results = time_autograde(
+        'per student', per_student_autograde, assignment_id,
+    )
+
+    # Time the bulk autograde with an empty student_assignment_best
+    # table (every best is calculated and written), then with the
+    # table filled in (every best is a read).
+    bulk_cold_average, bulk_cold_results = time_autograde(
+        'bulk (cold)', lambda _id: bulk_autograde(_id, limit=100), assignment_id,
+        setup=clear_student_assignment_bests,
+    )
+    bulk_warm_average, bulk_warm_results = time_autograde(
+        'bulk (warm)', lambda _id: bulk_autograde(_id, limit=100), assignment_id,
+    )
+
+    # Make sure the bulk autograde picked the same best submissions
+    # as the ones calculated from the submissions for each student
+    def bests(results):
+        return {r['user_id']: r['submission']['id'] if r['submission'] else None for r in results}
+
+    per_student_bests = bests(per_student_results)
+    assert bests(bulk_cold_results) == per_student_bests, 'cold bulk autograde results do not match per student'
+    assert bests(bulk_warm_results) == per_student_bests, 'warm bulk autograde results do not match per student'
 
+    print('Speedup (cold) :: {:.2f}x'.format(per_student_average / bulk_cold_average))
+    print('Speedup (warm) :: {:.2f}x'.format(per_student_average / bulk_warm_average))
 
 if __name__ == '__main__':
     main()
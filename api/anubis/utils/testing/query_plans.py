@@ -0,0 +1,260 @@
+import sys
+from datetime import datetime, timedelta
+from typing import Callable, List, Dict, Optional
+
+from sqlalchemy.orm import Query
+
+from anubis.models import (
+    db,
+    Submission,
+    SubmissionTestResult,
+    AssignmentRepo,
+    TheiaSession,
+    LateException,
+    InCourse,
+    User,
+)
+from anubis.utils.data import with_context
+
+# Index name used in checks to mean the primary key of the table
+PRIMARY_KEY = 'PRIMARY'
+
+
+class QueryPlanCheck(object):
+    """
+    A hot query, and the index its table should be read through.
+    """
+
+    def __init__(self, name: str, table: str, index: str, build: Callable[[], Query]):
+        """
+        :param name: name of the check for the report
+        :param table: table that should not be scanned
+        :param index: index that should be used to read the table
+        :param build: function that builds the query to explain
+        """
+        self.name = name
+        self.table = table
+        self.index = index
+        self.build = build
+
+
+def _sample(column, default: str = 'query-plan'):
+    """
+    Get a value for a column from the seeded database. Real values are
+    used so that the planner does not optimize the lookup away entirely.
+
+    :param column:
+    :param default:
+    :return:
+    """
+    value = db.session.query(column).filter(column.isnot(None)).limit(1).scalar()
+    return value if value is not None else default
+
+
+def explain(query: Query) -> List[Dict[str, Optional[str]]]:
+    """
+    Run EXPLAIN for a query, and normalize the plan into a list
+    of {table, index, detail} rows. The index is None for any
+    table that is read with a full scan.
+
+    Both sqlite (MINDEBUG) and mariadb plans are supported.
+
+    :param query:
+    :return:
+    """
+    dialect = db.engine.dialect
+    compiled = query.statement.compile(dialect=dialect, compile_kwargs={'render_postcompile': True})
+
+    # Match the parameters to the style of the driver
+    params = compiled.params
+    if compiled.positional:
+        params = tuple(params[name] for name in compiled.positiontup)
+
+    connection = db.session.connection()
+
+    # sqlite plans come back as a tree of text details. ie:
+    #   SEARCH submission USING INDEX ix_submission_owner_id_created (owner_id=?)
+    #   SCAN theia_session
+    if dialect.name == 'sqlite':
+        plan = []
+        for row in connection.exec_driver_sql('EXPLAIN QUERY PLAN ' + str(compiled), params):
+            detail = row[-1]
+            words = detail.split()
+            if len(words) < 2 or words[0] not in ('SCAN', 'SEARCH'):
+                continue
+
+            index = None
+            if ' USING INTEGER PRIMARY KEY' in detail or ' USING PRIMARY KEY' in detail:
+                index = PRIMARY_KEY
+            elif ' INDEX ' in detail:
+                index = detail.split(' INDEX ')[1].split()[0]
+                if index.startswith('sqlite_autoindex_'):
+                    index = PRIMARY_KEY
+
+            plan.append({'table': words[1], 'index': index, 'detail': detail})
+        return plan
+
+    # mariadb / mysql plans are one row per table
+    plan = []
+    for row in connection.exec_driver_sql('EXPLAIN ' + str(compiled), params).mappings():
+        plan.append({
+            'table': row['table'],
+            'index': row['key'],
+            'detail': 'type={} possible_keys={} rows={}'.format(row['type'], row['possible_keys'], row['rows']),
+        })
+    return plan
+
+
+def get_query_plan_checks() -> List[QueryPlanCheck]:
+    """
+    Get the hot queries that should always be served by an index. The
+    queries mirror the filters used in the code they are named after.
+
+    :return:
+    """
+    now = datetime.now()
+
+    return [
+        # lms.autograde.get_student_assignment_bests
+        QueryPlanCheck(
+            'autograde accepted submissions',
+            'submission',
+            'ix_submission_assignment_id_owner_id_processed_accepted',
+            lambda: Submission.query.filter(
+                Submission.assignment_id == _sample(Submission.assignment_id),
+                Submission.owner_id.in_([_sample(Submission.owner_id)]),
+                Submission.processed == True,
+                Submission.accepted == True,
+            ),
+        ),
+
+        # utils.k8s.theia.fix_stale_theia_resources
+        QueryPlanCheck(
+            'stale theia session candidates',
+            'theia_session',
+            'ix_theia_session_active_k8s_requested_last_proxy',
+            lambda: db.session.query(
+                TheiaSession.id, TheiaSession.owner_id, TheiaSession.course_id, TheiaSession.last_proxy,
+            ).filter(
+                TheiaSession.active == True,
+                TheiaSession.k8s_requested == True,
+                TheiaSession.last_proxy >= now - timedelta(minutes=30),
+            ),
+        ),
+
+        # lms.webhook repo lookup
+        QueryPlanCheck(
+            'webhook repo by url',
+            'assignment_repo',
+            'ix_assignment_repo_repo_url',
+            lambda: AssignmentRepo.query.filter(
+                AssignmentRepo.repo_url == _sample(AssignmentRepo.repo_url),
+            ),
+        ),
+
+        # lms.submissions.init_submission / pipeline test reports
+        QueryPlanCheck(
+            'test results by submission',
+            'submission_test_result',
+            'ix_submission_test_result_submission_id',
+            lambda: SubmissionTestResult.query.filter(
+                SubmissionTestResult.submission_id == _sample(SubmissionTestResult.submission_id),
+            ),
+        ),
+
+        # lms.assignments.get_assignment_due_date
+        QueryPlanCheck(
+            'late exception for student',
+            'late_exception',
+            PRIMARY_KEY,
+            lambda: LateException.query.filter(
+                LateException.user_id == _sample(User.id),
+                LateException.assignment_id == _sample(Submission.assignment_id),
+            ),
+        ),
+
+        # lms.submissions.get_submissions
+        QueryPlanCheck(
+            'submissions for user',
+            'submission',
+            'ix_submission_owner_id_created',
+            lambda: Submission.query.filter(
+                Submission.owner_id == _sample(Submission.owner_id),
+            ).order_by(Submission.created.desc(), Submission.id.desc()).limit(10),
+        ),
+
+        # lms.theia.get_recent_sessions
+        QueryPlanCheck(
+            'recent theia sessions for user',
+            'theia_session',
+            'ix_theia_session_owner_id_created',
+            lambda: TheiaSession.query.filter(
+                TheiaSession.owner_id == _sample(TheiaSession.owner_id),
+            ).order_by(TheiaSession.created.desc(), TheiaSession.id.desc()).limit(10),
+        ),
+
+        # utils.visuals.rollups.update_usage_rollups
+        QueryPlanCheck(
+            'submissions since rollup watermark',
+            'submission',
+            'ix_submission_created',
+            lambda: db.session.query(Submission.assignment_id, Submission.owner_id).filter(
+                Submission.created >= now - timedelta(hours=1),
+                Submission.created < now,
+            ),
+        ),
+
+        # lms.students.get_students_in_class
+        QueryPlanCheck(
+            'students in course',
+            'in_course',
+            'ix_in_course_course_id_owner_id',
+            lambda: InCourse.query.filter(
+                InCourse.course_id == _sample(InCourse.course_id),
+            ),
+        ),
+    ]
+
+
+def check_query_plan(check: QueryPlanCheck) -> Optional[str]:
+    """
+    Explain a hot query, and verify that its table is read through
+    the expected index.
+
+    :param check:
+    :return: None if the check passed, otherwise the reason it failed
+    """
+    plan = explain(check.build())
+    rows = [row for row in plan if row['table'] == check.table]
+
+    # Make sure the table is in the plan at all
+    if len(rows) == 0:
+        return '{} is not in the plan {}'.format(check.table, plan)
+
+    for row in rows:
+        if row['index'] != check.index:
+            return 'expected {} to use {}, got {} ({})'.format(
+                check.table, check.index, row['index'] or 'a full scan', row['detail'],
+            )
+
+    return None
+
+
+@with_context
+def main():
+    failed = 0
+    for check in get_query_plan_checks():
+        error = check_query_plan(check)
+        if error is None:
+            print('PASS {} :: {}'.format(check.name, check.index))
+        else:
+            failed += 1
+            print('FAIL {} :: {}'.format(check.name, error))
+
+    print('{} query plan checks failed'.format(failed))
+    if failed > 0:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
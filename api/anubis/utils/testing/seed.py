@@ -12,6 +12,7 @@ from anubis.models import (
     InCourse, TheiaSession
 )
 from anubis.utils.data import rand
+from anubis.utils.log_store import set_stdout
 from anubis.lms.theia import mark_session_ended
 from anubis.utils.github.repos import assignment_repo_name
 
@@ -204,7 +205,7 @@ def init_submissions(submissions):
 
     # Init models
     for submission in submissions:
-        init_submission(submission, commit=False)
+        init_submission(submission, commit=False, refresh_best=False)
     db.session.commit()
 
     for submission in submissions:
@@ -212,7 +213,7 @@ def init_submissions(submissions):
 
         build_pass = random.randint(0, 2) != 0
         submission.build.passed = build_pass
-        submission.build.stdout = 'blah blah blah build'
+        set_stdout(submission.build, 'blah blah blah build')
 
         if build_pass:
             for test_result in submission.test_results:
@@ -220,4 +221,4 @@ def init_submissions(submissions):
                 test_result.passed = test_passed
 
                 test_result.message = 'Test passed' if test_passed else 'Test failed'
-                test_result.stdout = 'blah blah blah test output'
+                set_stdout(test_result, 'blah blah blah test output')
@@ -1,25 +1,26 @@
+from collections import defaultdict
 from typing import List, Any, Dict
 
 import numpy as np
 import pandas as pd
+from sqlalchemy import and_, case, func
+from sqlalchemy.orm import selectinload
 
 from anubis.models import (
     db,
     AssignmentTest,
     Assignment,
+    InCourse,
     User,
     TheiaSession,
-    Submission
+    Submission,
+    SubmissionBuild,
+    SubmissionTestResult,
 )
 from anubis.utils.data import is_debug, is_job
-from anubis.lms.autograde import bulk_autograde
+from anubis.lms.autograde import get_student_assignment_bests
+from anubis.lms.students import get_students_in_class
 from anubis.utils.cache import cache
-from anubis.utils.visuals.queries import (
-    time_to_pass_test_sql,
-    assignment_test_fail_nosub_sql,
-    assignment_test_fail_count_sql,
-    assignment_test_pass_count_sql,
-)
 
 
 @cache.memoize(timeout=60, unless=is_debug)
@@ -28,49 +29,107 @@ def get_admin_assignment_visual_data(assignment_id: str) -> List[Dict[str, Any]]
     Get the admin visual data for an assignment. Visual data is generated
     for each assignment test that is part of the assignment.
 
+    The results for every test are read in one grouped pass over the
+    test results of the assignment, then fanned out to each test.
+
     :param assignment_id:
     :return:
     """
 
+    # Get the assignment
+    assignment = Assignment.query.filter(
+        Assignment.id == assignment_id
+    ).first()
+
     # Get all the assignment tests for the specified assignment
     assignment_tests = AssignmentTest.query.filter(
         AssignmentTest.assignment_id == assignment_id
     ).all()
 
+    # Only count the students in the course
+    in_course = and_(
+        InCourse.owner_id == Submission.owner_id,
+        InCourse.course_id == assignment.course_id,
+    )
+
+    # Count the students in the course
+    student_count = InCourse.query.filter(
+        InCourse.course_id == assignment.course_id,
+    ).count()
+
+    # Get the time of the first submission for each student
+    first_submissions = dict(db.session.query(
+        Submission.owner_id,
+        func.min(Submission.created),
+    ).join(InCourse, in_course).filter(
+        Submission.assignment_id == assignment.id,
+    ).group_by(
+        Submission.owner_id,
+    ).all())
+
+    # Get the time of the first passing submission for each test and
+    # student. Students that never passed a test get None.
+    test_results = db.session.query(
+        SubmissionTestResult.assignment_test_id,
+        Submission.owner_id,
+        func.min(case((SubmissionTestResult.passed == True, Submission.created))),
+    ).join(
+        Submission, Submission.id == SubmissionTestResult.submission_id,
+    ).join(InCourse, in_course).filter(
+        Submission.assignment_id == assignment.id,
+    ).group_by(
+        SubmissionTestResult.assignment_test_id, Submission.owner_id,
+    ).all()
+
+    # Fan the results out to each test
+    pass_counts = defaultdict(int)
+    fail_counts = defaultdict(int)
+    pass_hours = defaultdict(list)
+    for assignment_test_id, owner_id, first_pass in test_results:
+
+        # If the student never passed the test
+        if first_pass is None:
+            fail_counts[assignment_test_id] += 1
+            continue
+
+        # Measure the hours from their first submission to their first pass
+        pass_counts[assignment_test_id] += 1
+        pass_hours[assignment_test_id].append(
+            (first_pass - first_submissions[owner_id]).total_seconds() // 3600
+        )
+
+    # Students with no submission at all
+    nosub_count = max(student_count - len(first_submissions), 0)
+
     # Build a list of visual data for each assignment test
     response = []
     for assignment_test in assignment_tests:
         response.append({
             'title': assignment_test.name,
-            'pass_time_scatter': get_assignment_tests_pass_times(assignment_test),
-            'pass_count_radial': get_assignment_tests_pass_counts(assignment_test),
+            'pass_time_scatter': get_assignment_tests_pass_times(pass_hours[assignment_test.id]),
+            'pass_count_radial': get_assignment_tests_pass_counts(
+                nosub_count,
+                fail_counts[assignment_test.id],
+                pass_counts[assignment_test.id],
+            ),
         })
 
     return response
 
 
-def get_assignment_tests_pass_times(assignment_test: AssignmentTest):
+def get_assignment_tests_pass_times(pass_hours: List[float]):
     """
-    Calculate the amount of time it took each student in the class
-    to get their test to pass. This is measured as the time between
+    Build the scatter data for the amount of time it took each student in
+    the class to get a test to pass. This is measured as the time between
     their first submission for the assignment and the first submission
     that passed the specific test.
 
-    :param assignment_test:
+    :param pass_hours: hours to pass the test for each student that passed
     :return:
     """
 
-    # Run the very long query to generate the list of netids and timedetlas
-    result = db.session.execute(time_to_pass_test_sql, {
-        'assignment_id': assignment_test.assignment_id,
-        'assignment_test_id': assignment_test.id,
-    })
-
-    # Build a dataframe of the durations, converted to hours
-    df = pd.DataFrame(
-        data=[x[2].total_seconds() // 3600 for x in result.fetchall()],
-        columns=['duration'],
-    )
+    # Build a dataframe of the durations in hours
+    df = pd.DataFrame(data=pass_hours, columns=['duration'])
 
     # Drop outlier values (> 3 sigma)
     df = df[np.abs(df.duration - df.duration.mean()) <= (3 * df.duration.std())] \
@@ -83,45 +142,21 @@ def get_assignment_tests_pass_times(assignment_test: AssignmentTest):
     ]
 
 
-def get_assignment_tests_pass_counts(assignment_test: AssignmentTest):
+def get_assignment_tests_pass_counts(nosub_count: int, fail_count: int, pass_count: int):
     """
-    Get the number of students that had:
+    Build the pass counts radial donut on the autograde page from
+    the number of students that had:
     - no submission
     - passed the test
     - failed the test
-    for the specified test.
-
-    The data from this function is turned into the pass counts
-    radial donut on the autograde page.
+    for a test.
 
-    :param assignment_test:
+    :param nosub_count:
+    :param fail_count:
+    :param pass_count:
     :return:
     """
 
-    # Run a query to find the number of students with no submission
-    result = db.session.execute(assignment_test_fail_nosub_sql, {
-        'assignment_id': assignment_test.assignment_id,
-        'assignment_test_id': assignment_test.id,
-    })
-    n = result.fetchone()[0]
-    nosub_count = int(n if n is not None else 0)
-
-    # Run a query to find the number of students that failed the test
-    result = db.session.execute(assignment_test_fail_count_sql, {
-        'assignment_id': assignment_test.assignment_id,
-        'assignment_test_id': assignment_test.id,
-    })
-    n = result.fetchone()[0]
-    fail_count = int(n if n is not None else 0)
-
-    # Run a query to find the number of students that passed the test
-    result = db.session.execute(assignment_test_pass_count_sql, {
-        'assignment_id': assignment_test.assignment_id,
-        'assignment_test_id': assignment_test.id,
-    })
-    n = result.fetchone()[0]
-    pass_count = int(n if n is not None else 0)
-
     # Format the response to fit what the frontend is expecting
     return [
         {'label': 'no submission', 'theta': nosub_count, 'color': 'grey'},
@@ -149,9 +184,13 @@ def get_assignment_history(assignment_id, netid):
         TheiaSession.assignment_id == assignment.id
     ).all()
 
+    # Load the builds and test results with the submissions
     db_submissions = Submission.query.filter(
         Submission.assignment_id == assignment.id,
         Submission.owner_id == other.id,
+    ).options(
+        selectinload(Submission.build),
+        selectinload(Submission.test_results),
     ).order_by(Submission.created.desc()).all()
 
     test_count = len(assignment.full_data['tests'])
@@ -161,7 +200,7 @@ def get_assignment_history(assignment_id, netid):
     for db_submission in db_submissions:
         created = db_submission.created.replace(microsecond=0, second=0)
         build_passed = 1 if db_submission.build.passed else 0
-        tests_passed = sum(map(lambda test: (1 if test['result']['passed'] else 0), db_submission.all_tests))
+        tests_passed = sum(map(lambda result: (1 if result.passed else 0), db_submission.test_results))
 
         test_results.append({
             'x': str(created),
@@ -242,9 +281,42 @@ def get_assignment_sundial(assignment_id):
         ]
     }
 
-    # Get the autograde results for the entire assignment. This
-    # function call is cached.
-    autograde_results = bulk_autograde(assignment_id, offset=0, limit=300)
+    # Get the best submission for every student in the course. These
+    # are read from the student_assignment_best table.
+    student_ids = [student['id'] for student in get_students_in_class(assignment.course_id)]
+    best_ids = get_student_assignment_bests(assignment.id, student_ids)
+    best_submission_ids = [submission_id for submission_id in best_ids.values() if submission_id is not None]
+
+    # Pull the build results, and the names of the passed tests for
+    # all the best submissions at once.
+    builds_passed = {}
+    tests_passed_names = defaultdict(list)
+    if len(best_submission_ids) > 0:
+        builds_passed = {
+            submission_id: passed
+            for submission_id, passed in db.session.query(
+                SubmissionBuild.submission_id, SubmissionBuild.passed,
+            ).filter(
+                SubmissionBuild.submission_id.in_(best_submission_ids),
+            ).all()
+        }
+        for submission_id, test_name in db.session.query(
+                SubmissionTestResult.submission_id, AssignmentTest.name,
+        ).join(AssignmentTest).filter(
+            SubmissionTestResult.submission_id.in_(best_submission_ids),
+            SubmissionTestResult.passed == True,
+        ).all():
+            tests_passed_names[submission_id].append(test_name)
+
+    # Build the subset of the autograde results that the sundial needs
+    autograde_results = [
+        {
+            'submission': best_ids.get(student_id, None),
+            'build_passed': builds_passed.get(best_ids.get(student_id, None), None) or False,
+            'tests_passed_names': tests_passed_names[best_ids.get(student_id, None)],
+        }
+        for student_id in student_ids
+    ]
 
     # Count the number of build and no submissions to
     # insert into the name label.
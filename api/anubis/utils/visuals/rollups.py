@@ -0,0 +1,228 @@
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy import func, text, case
+
+from anubis.models import db, Assignment, Submission, TheiaSession, UsageRollup, RollupWatermark
+from anubis.utils.logging import logger
+
+# Name of the watermark for the usage rollups
+USAGE_ROLLUP_WATERMARK = 'usage'
+
+# Rows are only rolled up once they are this old, so that rows
+# from transactions that were still open are not skipped over.
+ROLLUP_LAG = timedelta(minutes=1)
+
+# Rollup periods, and how to truncate a datetime to the start
+# of its bucket in python
+ROLLUP_PERIODS = {
+    'hour': lambda dt: dt.replace(minute=0, second=0, microsecond=0),
+    'day': lambda dt: dt.replace(hour=0, minute=0, second=0, microsecond=0),
+}
+
+# Format of the start of a bucket. The same format string works
+# for both sqlite strftime and mariadb date_format.
+_BUCKET_FORMATS = {
+    'hour': '%Y-%m-%d %H:00:00',
+    'day': '%Y-%m-%d 00:00:00',
+}
+
+
+def bucket_column(column, period: str):
+    """
+    Build a sql expression that truncates a datetime column to the
+    start of its hour or day. The bucket comes back as a
+    'YYYY-MM-DD HH:00:00' string.
+
+    Both sqlite (MINDEBUG) and mariadb are supported.
+
+    :param column:
+    :param period: hour or day
+    :return:
+    """
+    if db.engine.dialect.name == 'sqlite':
+        return func.strftime(_BUCKET_FORMATS[period], column)
+    return func.date_format(column, _BUCKET_FORMATS[period])
+
+
+def duration_minutes(start, end):
+    """
+    Build a sql expression for the number of minutes between two
+    datetime columns. The expression is NULL if either side is NULL.
+
+    :param start:
+    :param end:
+    :return:
+    """
+    if db.engine.dialect.name == 'sqlite':
+        return (func.julianday(end) - func.julianday(start)) * 24 * 60
+    return func.timestampdiff(text('SECOND'), start, end) / 60.0
+
+
+def _rollup_period(period: str, start: Optional[datetime], since: Optional[datetime], until: datetime) -> int:
+    """
+    Recompute the rollups for one period, for every bucket from start
+    (the bucket the last watermark fell in) on. As start is always on a
+    bucket boundary, the recomputed buckets hold every row they should,
+    which keeps the distinct submitter counts exact.
+
+    IDE minutes are counted in the bucket the session started in, once
+    the session has ended. Sessions that started before start, but ended
+    since the last watermark have their minutes added to their (already
+    rolled up) bucket.
+
+    :param period: hour or day
+    :param start: start of the first bucket to recompute, or None to recompute everything
+    :param since: last watermark, or None
+    :param until: new watermark
+    :return: number of rollup rows written
+    """
+
+    rows: Dict[Tuple[str, str], Dict] = {}
+
+    def get_row(course_id: str, assignment_id: str, bucket: str) -> Dict:
+        key = (assignment_id, bucket)
+        if key not in rows:
+            rows[key] = {
+                'period': period,
+                'bucket': datetime.fromisoformat(bucket),
+                'assignment_id': assignment_id,
+                'course_id': course_id,
+                'submissions': 0,
+                'submitters': 0,
+                'ide_starts': 0,
+                'ide_minutes': 0.0,
+            }
+        return rows[key]
+
+    # Count submissions, and distinct submitters per bucket
+    bucket = bucket_column(Submission.created, period).label('bucket')
+    query = db.session.query(
+        Assignment.course_id,
+        Submission.assignment_id,
+        bucket,
+        func.count(Submission.id),
+        func.count(func.distinct(Submission.owner_id)),
+    ).join(Assignment, Assignment.id == Submission.assignment_id).filter(
+        Submission.created < until,
+    )
+    if start is not None:
+        query = query.filter(Submission.created >= start)
+    for course_id, assignment_id, bucket_start, submissions, submitters in query.group_by(
+            Assignment.course_id, Submission.assignment_id, bucket,
+    ).all():
+        row = get_row(course_id, assignment_id, bucket_start)
+        row['submissions'] = submissions
+        row['submitters'] = submitters
+
+    # Count IDE starts, and the minutes of the sessions that have ended
+    bucket = bucket_column(TheiaSession.created, period).label('bucket')
+    duration = duration_minutes(TheiaSession.created, TheiaSession.ended)
+    query = db.session.query(
+        Assignment.course_id,
+        TheiaSession.assignment_id,
+        bucket,
+        func.count(TheiaSession.id),
+        func.sum(case((TheiaSession.ended < until, duration), else_=0.0)),
+    ).join(Assignment, Assignment.id == TheiaSession.assignment_id).filter(
+        TheiaSession.created < until,
+    )
+    if start is not None:
+        query = query.filter(TheiaSession.created >= start)
+    for course_id, assignment_id, bucket_start, ide_starts, ide_minutes in query.group_by(
+            Assignment.course_id, TheiaSession.assignment_id, bucket,
+    ).all():
+        row = get_row(course_id, assignment_id, bucket_start)
+        row['ide_starts'] = ide_starts
+        row['ide_minutes'] = float(ide_minutes or 0.0)
+
+    # Replace the recomputed buckets
+    delete_query = UsageRollup.query.filter(UsageRollup.period == period)
+    if start is not None:
+        delete_query = delete_query.filter(UsageRollup.bucket >= start)
+    delete_query.delete(synchronize_session=False)
+    db.session.bulk_insert_mappings(UsageRollup, list(rows.values()))
+
+    # Nothing was rolled up before the first run
+    if start is None:
+        return len(rows)
+
+    # Add the minutes of older sessions that have ended since the last run
+    late_sessions = db.session.query(
+        Assignment.course_id,
+        TheiaSession.assignment_id,
+        bucket,
+        func.sum(duration),
+    ).join(Assignment, Assignment.id == TheiaSession.assignment_id).filter(
+        TheiaSession.created < start,
+        TheiaSession.ended >= since,
+        TheiaSession.ended < until,
+    ).group_by(
+        Assignment.course_id, TheiaSession.assignment_id, bucket,
+    ).all()
+    for course_id, assignment_id, bucket_start, ide_minutes in late_sessions:
+        rollup = UsageRollup.query.filter(
+            UsageRollup.period == period,
+            UsageRollup.bucket == datetime.fromisoformat(bucket_start),
+            UsageRollup.assignment_id == assignment_id,
+        ).first()
+
+        # The start of the session should have been rolled up already,
+        # but make the bucket if it was not.
+        if rollup is None:
+            rollup = UsageRollup(
+                period=period, bucket=datetime.fromisoformat(bucket_start),
+                assignment_id=assignment_id, course_id=course_id,
+                submissions=0, submitters=0, ide_starts=0, ide_minutes=0.0,
+            )
+            db.session.add(rollup)
+
+        rollup.ide_minutes = (rollup.ide_minutes or 0.0) + float(ide_minutes or 0.0)
+
+    return len(rows) + len(late_sessions)
+
+
+def update_usage_rollups(until: Optional[datetime] = None) -> int:
+    """
+    Bring the hourly and daily usage rollups up to date. Only the rows
+    created since the stored watermark (and the buckets they fall in)
+    are read, so this is cheap to run often. The first run rolls up
+    everything.
+
+    :param until: roll up rows created before this time (defaults to now, less a short lag)
+    :return: number of rollup rows written
+    """
+
+    if until is None:
+        until = datetime.now() - ROLLUP_LAG
+
+    # Get the watermark. The row is locked so that two jobs
+    # can not roll up the same window at once.
+    watermark: RollupWatermark = RollupWatermark.query.filter(
+        RollupWatermark.name == USAGE_ROLLUP_WATERMARK,
+    ).with_for_update().first()
+    since = watermark.watermark if watermark is not None else None
+
+    # Nothing new to roll up
+    if since is not None and since >= until:
+        db.session.commit()
+        return 0
+
+    # Recompute each period from the start of the bucket the
+    # watermark is in.
+    written = 0
+    for period, truncate in ROLLUP_PERIODS.items():
+        start = truncate(since) if since is not None else None
+        written += _rollup_period(period, start, since, until)
+
+    # Move the watermark up
+    if watermark is None:
+        watermark = RollupWatermark(name=USAGE_ROLLUP_WATERMARK)
+        db.session.add(watermark)
+    watermark.watermark = until
+
+    db.session.commit()
+
+    logger.info(f'Rolled up usage from {since} to {until} ({written} rows)')
+
+    return written
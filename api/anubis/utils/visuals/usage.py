@@ -2,10 +2,9 @@ from datetime import datetime
 from io import BytesIO
 from typing import List, Dict, Any, Optional
 
-import numpy as np
 import pandas as pd
 
-from anubis.models import Assignment, Submission, TheiaSession, Course
+from anubis.models import db, Assignment, Course, UsageRollup
 from anubis.utils.data import is_job
 from anubis.utils.cache import cache
 from anubis.utils.logging import logger
@@ -14,105 +13,113 @@ from anubis.utils.data import is_debug
 
 def get_submissions(course_id: str) -> pd.DataFrame:
     """
-    Get all submissions from visible assignments, and put them in a dataframe
+    Get the number of submissions to visible assignments for each
+    assignment and hour. The counts are read from the hourly usage
+    rollups, so the submissions themselves are never scanned.
+
+    The dataframe has the columns assignment_id, created (the start
+    of the hour) and count.
 
     :return:
     """
-    # Get the submission sqlalchemy objects
-    raw_submissions = Submission.query.join(Assignment).filter(
-        Assignment.hidden == False,
-        Assignment.course_id == course_id,
-    ).all()
-
-    # Specify which columns we want
-    columns = ['id', 'owner_id', 'assignment_id', 'processed', 'created']
 
-    # Build a dataframe of from the columns we pull out of each submission object
-    submissions = pd.DataFrame(
-        data=list(map(lambda x: ({
-            column: getattr(x, column)
-            for column in columns
-        }), raw_submissions)),
-        columns=columns
+    # Read the hourly submission counts for the course
+    query = db.session.query(
+        UsageRollup.assignment_id,
+        UsageRollup.bucket.label('created'),
+        UsageRollup.submissions.label('count'),
+    ).join(Assignment, Assignment.id == UsageRollup.assignment_id).filter(
+        UsageRollup.course_id == course_id,
+        UsageRollup.period == 'hour',
+        UsageRollup.submissions > 0,
+        Assignment.hidden == False,
+    ).order_by(
+        UsageRollup.assignment_id, UsageRollup.bucket,
     )
 
-    # Round the submission timestamps to the nearest hour
-    submissions['created'] = submissions['created'].apply(lambda date: pd.to_datetime(date).round('H'))
+    # Read the rollups straight into a dataframe
+    submissions = pd.read_sql(query.statement, db.session.connection())
+    submissions['created'] = pd.to_datetime(submissions['created'])
 
     return submissions
 
 
 def get_theia_sessions(course_id: str) -> pd.DataFrame:
     """
-    Get all theia session objects, and throw them into a dataframe
+    Get the number of theia sessions started for each assignment and
+    hour, along with the total minutes of the ones that have ended. The
+    counts are read from the hourly usage rollups.
+
+    The dataframe has the columns assignment_id, created (the start
+    of the hour), count and duration.
 
     :return:
     """
 
-    # Get all the theia session sqlalchemy objects
-    raw_theia_sessions = TheiaSession.query.join(Assignment).filter(Assignment.course_id == course_id).all()
-
-    # Specify which columns we want
-    columns = ['id', 'owner_id', 'assignment_id', 'created', 'ended']
-
-    # Build a dataframe of from the columns we pull out of each theia session object
-    theia_sessions = pd.DataFrame(
-        data=list(map(lambda x: ({
-            column: getattr(x, column)
-            for column in columns
-        }), raw_theia_sessions)),
-        columns=columns
+    # Read the hourly session counts for the course
+    query = db.session.query(
+        UsageRollup.assignment_id,
+        UsageRollup.bucket.label('created'),
+        UsageRollup.ide_starts.label('count'),
+        UsageRollup.ide_minutes.label('duration'),
+    ).filter(
+        UsageRollup.course_id == course_id,
+        UsageRollup.period == 'hour',
+        UsageRollup.ide_starts > 0,
+    ).order_by(
+        UsageRollup.assignment_id, UsageRollup.bucket,
     )
 
-    # Round the timestamps to the nearest hour
-    theia_sessions['created'] = theia_sessions['created'].apply(lambda date: pd.to_datetime(date).round('H'))
-    theia_sessions['ended'] = theia_sessions['ended'].apply(lambda date: pd.to_datetime(date).round('H'))
+    # Read the rollups straight into a dataframe
+    theia_sessions = pd.read_sql(query.statement, db.session.connection())
+    theia_sessions['created'] = pd.to_datetime(theia_sessions['created'])
 
-    # Add a duration column
-    if len(theia_sessions) > 0:
-        # Get the duration from subtracting the end from the start time, and converting to minutes
-        theia_sessions['duration'] = theia_sessions[['ended', 'created']].apply(
-            lambda row: (row[0] - row[1]).seconds / 60, axis=1)
-
-    # The apply breaks if there are no rows, so make it empty in that case
-    else:
-        theia_sessions['duration'] = []
+    return theia_sessions
 
-    # Drop outliers based on duration
-    theia_sessions = theia_sessions[
-        np.abs(theia_sessions.duration - theia_sessions.duration.mean()) <= (3 * theia_sessions.duration.std())
-        ]
 
-    return theia_sessions
+@cache.memoize(timeout=360, unless=is_debug)
+def get_raw_submissions(course_id: str) -> List[Dict[str, Any]]:
+    """
+    Get the hourly submission counts for each visible assignment in
+    a course, as series for the frontend charts.
 
+    * cached per course for 6 minutes *
 
-@cache.memoize(timeout=360)
-def get_raw_submissions() -> List[Dict[str, Any]]:
-    submissions_df = get_submissions()
-    data = submissions_df.groupby(['assignment_id', 'created'])['id'].count() \
-        .reset_index().rename(columns={'id': 'count'}).to_dict()
-    data['created'] = {k: str(v) for k, v in data['created'].items()}
+    :param course_id:
+    :return:
+    """
 
-    assignment_ids = list(set(data['assignment_id'].values()))
-    response = {}
+    # Get the hourly submission counts for the course
+    submissions = get_submissions(course_id)
 
-    for assignment_id in assignment_ids:
-        assignment = Assignment.query.filter(Assignment.id == assignment_id).first()
-        response[assignment_id] = {
-            'data': [],
+    # Get all the assignments in the series at once
+    assignment_ids = submissions['assignment_id'].unique().tolist()
+    assignments: Dict[str, Assignment] = {
+        assignment.id: assignment
+        for assignment in Assignment.query.filter(
+            Assignment.id.in_(assignment_ids),
+        ).all()
+    } if len(assignment_ids) > 0 else {}
+
+    # Build a series for each assignment
+    response = []
+    for assignment_id, series in submissions.groupby('assignment_id', sort=False):
+        assignment = assignments[assignment_id]
+        response.append({
+            'data': [
+                {
+                    'x': str(created),
+                    'y': int(count),
+                    'label': f'{created} {count}',
+                }
+                for created, count in zip(series['created'], series['count'])
+            ],
             'name': assignment.name,
             'release_date': str(assignment.release_date),
             'due_date': str(assignment.due_date),
-        }
-
-    for index, assignment_id in data['assignment_id'].items():
-        response[assignment_id]['data'].append({
-            'x': data['created'][index],
-            'y': data['count'][index],
-            'label': f"{data['created'][index]} {data['count'][index]}",
         })
 
-    return list(response.values())
+    return response
 
 
 @cache.memoize(timeout=-1, forced_update=is_job, unless=is_debug)
@@ -143,14 +150,12 @@ def get_usage_plot(course_id: Optional[str]) -> Optional[bytes]:
     legend_handles1 = []
 
     # submissions over hour line
-    submissions.groupby(['assignment_id', 'created'])['id'] \
-        .count().reset_index().rename(columns={'id': 'count'}).groupby('assignment_id') \
-        .plot(x='created', label=None, ax=axs[0])
+    for _, series in submissions.groupby('assignment_id'):
+        axs[0].plot(series['created'], series['count'])
 
     # ides over hour line
-    theia_sessions.groupby(['assignment_id', 'created'])['id'] \
-        .count().reset_index().rename(columns={'id': 'count'}).groupby('assignment_id') \
-        .plot(x='created', label=None, ax=axs[1])
+    for _, series in theia_sessions.groupby('assignment_id'):
+        axs[1].plot(series['created'], series['count'])
 
     # assignment release line
     for color, assignment in zip(mcolors.TABLEAU_COLORS, assignments):
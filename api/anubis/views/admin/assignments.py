@@ -12,14 +12,13 @@ from anubis.models import (
     AssignmentRepo,
     User,
     AssignmentTest,
-    SubmissionTestResult,
 )
 from anubis.utils.auth.http import require_admin
 from anubis.utils.data import rand
 from anubis.utils.data import row2dict, req_assert
 from anubis.utils.http.decorators import load_from_id, json_response, json_endpoint
 from anubis.utils.http import error_response, success_response
-from anubis.lms.assignments import assignment_sync
+from anubis.lms.assignments import assignment_sync, delete_assignment_test
 from anubis.lms.courses import course_context, assert_course_context
 from anubis.lms.questions import get_assigned_questions
 from anubis.utils.logging import logger
@@ -199,16 +198,9 @@ def admin_assignment_tests_delete_assignment_test_id(assignment_test_id: str):
     # Save the test name so we can use it in the response
     test_name = assignment_test.name
 
-    # Delete all the submission test results that are pointing to
-    # this test
-    SubmissionTestResult.query.filter(
-        SubmissionTestResult.assignment_test_id == assignment_test.id,
-    ).delete()
-
-    # Delete the test itself
-    AssignmentTest.query.filter(
-        AssignmentTest.id == assignment_test_id,
-    ).delete()
+    # Delete the test, and all the submission test results that
+    # are pointing to it
+    delete_assignment_test(assignment_test)
 
     # Commit the changes
     db.session.commit()
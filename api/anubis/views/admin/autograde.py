@@ -1,12 +1,17 @@
 from flask import Blueprint, request
 from sqlalchemy.sql import or_
 
-from anubis.models import Submission, Assignment, User, InCourse
+from anubis.models import db, Submission, Assignment, User, InCourse
 from anubis.utils.auth.http import require_admin
 from anubis.utils.data import req_assert
 from anubis.utils.http.decorators import json_response
 from anubis.utils.http import success_response, get_number_arg
-from anubis.lms.autograde import bulk_autograde, autograde, autograde_submission_result_wrapper
+from anubis.lms.autograde import (
+    bulk_autograde,
+    autograde,
+    autograde_submission_result_wrapper,
+    refresh_student_assignment_best,
+)
 from anubis.lms.courses import assert_course_context
 from anubis.lms.questions import get_assigned_questions
 from anubis.utils.cache import cache
@@ -42,7 +47,6 @@ def admin_autograde_cache_reset(assignment_id: str):
     assert_course_context(assignment)
 
     cache.delete_memoized(bulk_autograde)
-    cache.delete_memoized(autograde)
     cache.delete_memoized(get_assignment_history)
     cache.delete_memoized(get_admin_assignment_visual_data)
     cache.delete_memoized(get_assignment_sundial)
@@ -90,6 +94,9 @@ def admin_autograde_assignment_assignment_id(assignment_id):
 
     # Get the (possibly cached) autograde calculations
     bests = bulk_autograde(assignment_id, limit=limit, offset=offset)
+
+    # Keep any best submissions that were backfilled
+    db.session.commit()
     total = User.query.join(InCourse).filter(
         InCourse.course_id == assignment.course_id,
     ).count()
@@ -132,12 +139,14 @@ def admin_autograde_for_assignment_id_user_id(assignment_id, user_id):
     # Assert that the student does not exist
     req_assert(student is not None, message='student does not exist')
 
-    # If force load, then skip any caching
+    # If force load, then recalculate the best submission
     if force:
-        cache.delete_memoized(autograde, student.id, assignment.id)
+        refresh_student_assignment_best(student.id, assignment.id)
+        db.session.commit()
 
     # Calculate the best submission for this student and assignment
     submission_id = autograde(student.id, assignment.id)
+    db.session.commit()
 
     # Pass back the
     return success_response({
@@ -180,6 +189,7 @@ def private_submission_stats_id(assignment_id: str, netid: str):
 
     # Calculate the best submission
     submission_id = autograde(student.id, assignment.id)
+    db.session.commit()
 
     # Set the default for the full_data of the submission
     submission_full_data = None
@@ -2,6 +2,7 @@ from flask import Blueprint
 
 from anubis.models import db, Config
 from anubis.utils.auth.http import require_admin, require_superuser
+from anubis.utils.cache import get_cache_stats
 from anubis.utils.http.decorators import json_response, json_endpoint
 from anubis.utils.http import success_response
 
@@ -81,3 +82,19 @@ def config_add(config, **_):
         'config': [item.data for item in items],
         'status': 'Config saved',
     })
+
+
+@config_.route('/cache-stats')
+@require_superuser()
+@json_response
+def config_cache_stats():
+    """
+    Get the hit and miss counters for the tagged caches
+    in the api process that handled this request.
+
+    :return:
+    """
+
+    return success_response({
+        'stats': get_cache_stats(),
+    })
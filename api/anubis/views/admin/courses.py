@@ -248,11 +248,14 @@ def admin_course_remove_student_id(user_id: str):
     # Make sure the other user exists
     req_assert(other is not None, message='user does not exist')
 
-    # Delete the professor
-    InCourse.query.filter(
+    # Delete the student. This goes through the session (not a bulk
+    # delete) so that the cached course lists for the user are dropped.
+    in_course = InCourse.query.filter(
         InCourse.owner_id == user_id,
         InCourse.course_id == course_context.id,
-    ).delete()
+    ).first()
+    if in_course is not None:
+        db.session.delete(in_course)
 
     # Commit the delete
     db.session.commit()
@@ -339,11 +342,14 @@ def admin_course_remove_ta_id(user_id: str):
     if not current_user.is_superuser:
         req_assert(other.id != current_user.id, message='cannot remove yourself')
 
-    # Delete the TA
-    TAForCourse.query.filter(
+    # Delete the TA. This goes through the session (not a bulk delete)
+    # so that the cached course admin permissions are dropped.
+    ta = TAForCourse.query.filter(
         TAForCourse.owner_id == user_id,
         TAForCourse.course_id == course_context.id,
-    ).delete()
+    ).first()
+    if ta is not None:
+        db.session.delete(ta)
 
     # Commit the delete
     db.session.commit()
@@ -424,11 +430,14 @@ def admin_course_remove_professor_id(user_id: str):
     # Make sure the other user exists
     req_assert(other is not None, message='user does not exist')
 
-    # Delete the professor
-    ProfessorForCourse.query.filter(
+    # Delete the professor. This goes through the session (not a bulk
+    # delete) so that the cached course admin permissions are dropped.
+    prof = ProfessorForCourse.query.filter(
         ProfessorForCourse.owner_id == user_id,
         ProfessorForCourse.course_id == course_context.id,
-    ).delete()
+    ).first()
+    if prof is not None:
+        db.session.delete(prof)
 
     # Commit the delete
     db.session.commit()
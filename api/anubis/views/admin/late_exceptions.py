@@ -136,11 +136,14 @@ def admin_late_exception_remove(assignment_id: str = None, user_id: str = None):
 
     assert_course_context(assignment, student)
 
-    # Delete the exception if it exists
-    LateException.query.filter(
+    # Delete the exception if it exists. This goes through the session
+    # (not a bulk delete) so that the cached due dates are dropped.
+    late_exception = LateException.query.filter(
         LateException.assignment_id == assignment.id,
         LateException.user_id == student.id,
-    ).delete()
+    ).first()
+    if late_exception is not None:
+        db.session.delete(late_exception)
 
     # Recalculate the late submissions
     recalculate_late_submissions(student, assignment)
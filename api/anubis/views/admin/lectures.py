@@ -7,8 +7,8 @@ from anubis.models import db, LectureNotes
 from anubis.utils.auth.http import require_admin
 from anubis.utils.data import req_assert
 from anubis.utils.http.decorators import json_response
-from anubis.utils.http.files import process_file_upload, get_mime_type
-from anubis.utils.http import success_response, get_request_file_stream
+from anubis.utils.http.files import process_file_upload, save_static_file_upload, get_static_max_upload_size
+from anubis.utils.http import success_response, get_request_file
 from anubis.lms.courses import course_context, assert_course_context
 
 lectures_ = Blueprint('admin-lectures', __name__, url_prefix='/admin/lectures')
@@ -120,7 +120,7 @@ def admin_lecture_save(lecture_notes_id: str):
     assert_course_context(lecture_notes)
 
     # Pull file from request (if there is one)
-    stream, filename = get_request_file_stream(with_filename=True, fail_ok=True)
+    stream, filename = get_request_file(with_filename=True, fail_ok=True, max_size=get_static_max_upload_size())
 
     # Update fields
     lecture_notes.post_time = post_time
@@ -128,9 +128,7 @@ def admin_lecture_save(lecture_notes_id: str):
     lecture_notes.description = description
 
     if stream is not None:
-        lecture_notes.static_file.blob = stream
-        lecture_notes.static_file.filename = filename
-        lecture_notes.static_file.content_type = get_mime_type(stream)
+        save_static_file_upload(lecture_notes.static_file, stream, filename)
 
     db.session.commit()
 
@@ -11,11 +11,11 @@ from anubis.utils.data import split_chunks, req_assert
 from anubis.utils.http.decorators import json_response
 from anubis.utils.http.decorators import load_from_id
 from anubis.utils.http import success_response, get_number_arg
-from anubis.lms.autograde import bulk_autograde, autograde
+from anubis.lms.autograde import bulk_autograde
 from anubis.lms.courses import assert_course_context
 from anubis.lms.submissions import init_submission
 from anubis.utils.cache import cache
-from anubis.utils.rpc import enqueue_autograde_pipeline, rpc_enqueue
+from anubis.utils.rpc import enqueue_autograde_pipeline, rpc_enqueue_many
 
 regrade = Blueprint("admin-regrade", __name__, url_prefix="/admin/regrade")
 
@@ -136,12 +136,10 @@ def private_regrade_student_assignment_netid(assignment_id: str, netid: str):
     submission_chunks = split_chunks(submission_ids, 100)
 
     # Enqueue each chunk as a job for the rpc workers
-    for chunk in submission_chunks:
-        rpc_enqueue(rpc_bulk_regrade, 'regrade', args=[chunk])
+    rpc_enqueue_many(rpc_bulk_regrade, 'regrade', [(chunk,) for chunk in submission_chunks])
 
     # Clear cache of autograde results
     cache.delete_memoized(bulk_autograde, assignment.id)
-    cache.delete_memoized(autograde, student.id, assignment.id)
 
     return success_response({
         "status": f"{submission_count} submissions enqueued. This may take a while.",
@@ -224,8 +222,7 @@ def private_regrade_assignment(assignment_id):
     submission_chunks = split_chunks(submission_ids, 100)
 
     # Enqueue each chunk as a job for the rpc workers
-    for chunk in submission_chunks:
-        rpc_enqueue(rpc_bulk_regrade, 'regrade', args=[chunk])
+    rpc_enqueue_many(rpc_bulk_regrade, 'regrade', [(chunk,) for chunk in submission_chunks])
 
     # Pass back the enqueued status
     return success_response({
@@ -1,6 +1,6 @@
 from typing import List
 
-from flask import Blueprint
+from flask import Blueprint, request
 
 from anubis.models import db, User, Course, InCourse, Submission, Assignment
 from anubis.utils.auth.http import require_admin, require_superuser
@@ -10,7 +10,7 @@ from anubis.utils.http.decorators import json_response, json_endpoint
 from anubis.utils.http import success_response, get_number_arg
 from anubis.lms.courses import assert_course_superuser, course_context, assert_course_context
 from anubis.lms.repos import get_repos
-from anubis.lms.students import get_students
+from anubis.lms.students import get_students, get_students_in_class_page
 from anubis.lms.theia import get_recent_sessions
 
 students_ = Blueprint("admin-students", __name__, url_prefix="/admin/students")
@@ -44,11 +44,28 @@ def admin_student_list_basic():
 @json_response
 def admin_students_list():
     """
-    List all users within the current course context
+    List all users within the current course context.
+
+    The students can be paged through by passing a limit, and
+    the next_cursor from the previous page as the cursor.
+
+    /api/admin/students/list?limit=50&cursor=<next_cursor>
 
     :return:
     """
 
+    # Page through the students if a limit was given
+    if request.args.get("limit", default=None) is not None:
+        students, next_cursor = get_students_in_class_page(
+            course_context.id,
+            limit=get_number_arg('limit', default_value=50),
+            cursor=request.args.get("cursor", default=None) or None,
+        )
+        return success_response({
+            "students": students,
+            "next_cursor": next_cursor,
+        })
+
     # Get all students within the current course context
     students = get_students(course_id=course_context.id)
 
@@ -94,7 +111,7 @@ def admin_students_info_id(id: str):
     ).all()
 
     repos = get_repos(student.id)
-    recent_theia = get_recent_sessions(student.id)
+    recent_theia, theia_next_cursor = get_recent_sessions(student.id)
 
     # Pass back the student and course information
     return success_response({
@@ -102,6 +119,7 @@ def admin_students_info_id(id: str):
         "courses": [course.data for course in courses],
         "repos": repos,
         "theia": recent_theia,
+        "theia_next_cursor": theia_next_cursor,
     })
 
 
@@ -1,6 +1,6 @@
 from flask import Blueprint
 
-from anubis.models import Assignment, User
+from anubis.models import db, Assignment, User
 from anubis.utils.auth.http import require_admin
 from anubis.utils.data import req_assert
 from anubis.utils.http.decorators import json_response
@@ -110,4 +110,9 @@ def visual_sundial_assignment(assignment_id: str):
     assert_course_context(assignment)
 
     # Pull the (maybe cached) sundial data
-    return success_response({'sundial': get_assignment_sundial(assignment.id)})
+    sundial = get_assignment_sundial(assignment.id)
+
+    # Keep any best submissions that were backfilled
+    db.session.commit()
+
+    return success_response({'sundial': sundial})
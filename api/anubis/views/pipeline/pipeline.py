@@ -1,19 +1,60 @@
 import json
-from typing import Union
+from typing import Union, List, Dict, Any, Optional
 
 from flask import request, Blueprint
 from parse import parse
 
 from anubis.models import Submission, SubmissionTestResult, AssignmentTest
 from anubis.models import db
+from anubis.lms.autograde import refresh_student_assignment_best
 from anubis.utils.http.decorators import json_response, json_endpoint
+from anubis.utils.data import req_assert
 from anubis.utils.http import success_response
+from anubis.utils.log_store import set_stdout, set_message
 from anubis.utils.logging import logger
 from anubis.utils.pipeline.decorators import check_submission_token
 
 pipeline = Blueprint("pipeline", __name__, url_prefix="/pipeline")
 
 
+def is_hidden_test_state(submission: Submission, state: str) -> bool:
+    """
+    Figure out if a state report is for a hidden test.
+    We do this by checking the state that was given,
+    to read the name of the test. If the assignment
+    test that was found is marked as hidden, then
+    we should not update the state of the submission
+    model.
+
+    If we were to update the state of the submission
+    when a hidden test is reported, then it would be
+    visible to the students in the frontend.
+
+    :param submission:
+    :param state:
+    :return:
+    """
+
+    # Do a basic match on the expected test
+    match = parse('Running test: {}', state)
+
+    # If we did not get a match, then this is not a test state
+    if not match:
+        return False
+
+    # Get the parsed assignment test name
+    test_name = match[0]
+
+    # Try to get the assignment test
+    assignment_test = AssignmentTest.query.filter(
+        AssignmentTest.assignment_id == submission.assignment_id,
+        AssignmentTest.name == test_name
+    ).first()
+
+    # Hidden if the test exists, and if it is marked as hidden
+    return assignment_test is not None and assignment_test.hidden
+
+
 @pipeline.route("/report/panic/<string:submission_id>", methods=["POST"])
 @check_submission_token
 @json_response
@@ -94,7 +135,7 @@ def pipeline_report_build(submission: Submission, stdout: str, passed: bool, **_
     )
 
     # Update submission build
-    submission.build.stdout = stdout
+    set_stdout(submission.build, stdout)
     submission.build.passed = passed
 
     # If the build did not passed, then the
@@ -179,11 +220,16 @@ def pipeline_report_test(
 
     # Update the fields
     submission_test_result.passed = passed
-    submission_test_result.message = message
-    submission_test_result.stdout = stdout
+    set_message(submission_test_result, message)
+    set_stdout(submission_test_result, stdout)
 
-    # Add and commit
+    # Add the test result
     db.session.add(submission_test_result)
+
+    # Update the best submission for the student with the new result
+    refresh_student_assignment_best(submission.owner_id, submission.assignment_id)
+
+    # Commit the changes
     db.session.commit()
 
     return success_response("Test data successfully added.")
@@ -229,45 +275,188 @@ def pipeline_report_state(submission: Submission, state: str, **kwargs):
     # Set the processed field if it was specified
     submission.processed = processed != "0"
 
-    # Figure out if the test is hidden
-    # We do this by checking the state that was given,
-    # to read the name of the test. If the assignment
-    # test that was found is marked as hidden, then
-    # we should not update the state of the submission
-    # model.
-    #
-    # If we were to update the state of the submission
-    # when a hidden test is reported, then it would be
-    # visible to the students in the frontend.
-    hidden_test = False
+    # Update state field if the state report is not for a hidden test
+    if not is_hidden_test_state(submission, state):
+        submission.state = state
 
-    # Do a basic match on the expected test
-    match = parse('Running test: {}', state)
+    # If processed was specified and is of type bool, then update that too
+    if "processed" in request.json and isinstance(request.json["processed"], bool):
+        submission.processed = request.json["processed"]
+
+    # Add the submission
+    db.session.add(submission)
+
+    # Once the submission is processed, it is a candidate for the
+    # best submission for the student.
+    if submission.processed:
+        refresh_student_assignment_best(submission.owner_id, submission.assignment_id)
+
+    # Commit the changes
+    db.session.commit()
+
+    return success_response("State successfully updated.")
+
+
+@pipeline.route("/report/batch/<string:submission_id>", methods=["POST"])
+@check_submission_token
+@json_endpoint(required_fields=[("tests", list)])
+def pipeline_report_batch(
+        submission: Submission,
+        tests: List[Dict[str, Any]],
+        build: Optional[Dict[str, Any]] = None,
+        state: Optional[str] = None,
+        processed: Optional[bool] = None,
+        **_
+):
+    """
+    Submission pipelines can buffer their reports, and send them
+    all at once to this endpoint. The build, test results and state
+    are all written in a single transaction.
+
+    The state is applied first, then the build, then the test
+    results. If there is a ?processed=1 in the http query, then
+    the submission will also be marked as processed.
 
-    # If we got a match
-    if match:
-        # Get the parsed assignment test name
-        test_name = match[0]
+    POSTed json should be of the shape:
 
-        # Try to get the assignment test
-        assignment_test = AssignmentTest.query.filter(
-            AssignmentTest.assignment_id == submission.assignment_id,
-            AssignmentTest.name == test_name
-        ).first()
+    {
+      "build": {                         # optional
+        "stdout": "build logs...",
+        "passed": True
+      },
+      "tests": [
+        {
+          "test_name": "name of the test",
+          "passed": True,
+          "message": "This test worked",
+          "stdout": "Command logs..."
+        },
+        ...
+      ],
+      "state": "Finished!",              # optional
+      "processed": True                  # optional
+    }
 
-        # Set hidden_test to True if the test exists, and if it is marked as hidden
-        hidden_test = assignment_test is not None and assignment_test.hidden
+    :param submission:
+    :param tests:
+    :param build:
+    :param state:
+    :param processed:
+    :return:
+    """
+
+    # Verify the shape of the optional fields
+    req_assert(
+        build is None or isinstance(build, dict),
+        state is None or isinstance(state, str),
+        message='Malformed requests. Invalid field type.',
+        status_code=406,
+    )
+
+    # Verify the build and every test result before anything is applied
+    if build is not None:
+        req_assert(
+            isinstance(build.get("passed", None), (bool, type(None))),
+            isinstance(build.get("stdout", ""), str),
+            message='Malformed requests. Invalid field type.',
+            status_code=406,
+        )
+    for test in tests:
+        req_assert(isinstance(test, dict), message='Malformed requests. Invalid field type.', status_code=406)
+        req_assert(
+            isinstance(test.get("test_name", None), str),
+            isinstance(test.get("passed", None), bool),
+            isinstance(test.get("message", ""), str),
+            isinstance(test.get("stdout", ""), str),
+            message='Malformed requests. Invalid field type.',
+            status_code=406,
+        )
+
+    # Log the batch
+    logger.info(
+        "submission batch reported",
+        extra={
+            "type": "batch_report",
+            "submission_id": submission.id,
+            "assignment_id": submission.assignment_id,
+            "owner_id": submission.owner_id,
+            "state": state,
+            "build_passed": build.get("passed", None) if build is not None else None,
+            "test_count": len(tests),
+        },
+    )
+
+    # Mark the submission as processed if specified in the query
+    if request.args.get("processed", default="0") != "0":
+        submission.processed = True
+
+    # If processed was specified and is of type bool, then update that too
+    if isinstance(processed, bool):
+        submission.processed = processed
 
     # Update state field if the state report is not for a hidden test
-    if not hidden_test:
+    if state is not None and not is_hidden_test_state(submission, state):
         submission.state = state
 
-    # If processed was specified and is of type bool, then update that too
-    if "processed" in request.json and isinstance(request.json["processed"], bool):
-        submission.processed = request.json["processed"]
+    # Update submission build
+    if build is not None:
+        set_stdout(submission.build, build.get("stdout", ""))
+        submission.build.passed = build.get("passed", None)
+
+        # If the build did not passed, then the
+        # submission pipeline is done
+        if submission.build.passed is False:
+            submission.processed = True
+            submission.state = "Build did not succeed"
+
+        db.session.add(submission.build)
+
+    # Map test names to their results so each reported test can be
+    # matched without scanning the list. The test names are loaded in
+    # the same query.
+    test_results: Dict[str, SubmissionTestResult] = {
+        test_name: result
+        for result, test_name in db.session.query(SubmissionTestResult, AssignmentTest.name).join(
+            AssignmentTest, AssignmentTest.id == SubmissionTestResult.assignment_test_id,
+        ).filter(
+            SubmissionTestResult.submission_id == submission.id,
+        ).all()
+    }
 
-    # Add and commit
+    # Update each of the reported tests
+    invalid_test_names = []
+    for test in tests:
+        submission_test_result = test_results.get(test["test_name"], None)
+
+        # Verify we got a match
+        if submission_test_result is None:
+            invalid_test_names.append(test["test_name"])
+            continue
+
+        # Update the fields
+        submission_test_result.passed = test["passed"]
+        set_message(submission_test_result, test.get("message", ""))
+        set_stdout(submission_test_result, test.get("stdout", ""))
+        db.session.add(submission_test_result)
+
+    # Log any test names that did not match
+    if len(invalid_test_names) > 0:
+        logger.error(
+            "Invalid submission test result reported",
+            extra={"submission_id": submission.id, "test_names": invalid_test_names},
+        )
+
+    # Add the submission
     db.session.add(submission)
+
+    # Update the best submission for the student
+    if submission.processed or len(tests) > 0:
+        refresh_student_assignment_best(submission.owner_id, submission.assignment_id)
+
+    # Commit everything in one transaction
     db.session.commit()
 
-    return success_response("State successfully updated.")
+    return success_response({
+        "status": "Batch successfully reported.",
+        "invalid_test_names": invalid_test_names,
+    })
@@ -29,7 +29,7 @@ def public_assignments():
     course_id = request.args.get("courseId", default=None)
 
     # Get (possibly cached) assignment data
-    assignment_data = get_assignments(current_user.netid, course_id)
+    assignment_data = get_assignments(current_user.id, course_id)
 
     # Iterate over assignments, getting their data
     return success_response({"assignments": assignment_data})
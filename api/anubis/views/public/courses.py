@@ -8,9 +8,7 @@ from anubis.utils.auth.user import current_user
 from anubis.utils.data import req_assert
 from anubis.utils.http.decorators import json_response
 from anubis.utils.http import error_response, success_response
-from anubis.lms.assignments import get_assignments
 from anubis.lms.courses import valid_join_code, get_courses, get_courses_with_visuals
-from anubis.utils.cache import cache
 
 courses_ = Blueprint("public-courses", __name__, url_prefix="/public/courses")
 
@@ -29,7 +27,7 @@ def public_courses_list():
 
     # Get the (possibly cached) courses
     # that the current user is in.
-    courses = get_courses(current_user.netid)
+    courses = get_courses(current_user.id)
 
     # Give back the courses that the
     # student is in. This information
@@ -84,11 +82,6 @@ def public_courses_join(join_code):
     db.session.add(in_course)
     db.session.commit()
 
-    # Clear the cached entries for getting course data
-    cache.delete_memoized(get_courses, current_user.netid)
-    cache.delete_memoized(get_assignments, current_user.netid)
-    cache.delete_memoized(get_assignments, current_user.netid, course.id)
-
     return success_response({
         "status": f"Joined {course.course_code}"
     })
@@ -1,14 +1,18 @@
 import copy
+import json
 from datetime import datetime, timedelta
 from typing import Dict
 
-from flask import Blueprint, request
+from flask import Blueprint, Response, request
 
 from anubis.lms.courses import is_course_admin
 from anubis.lms.theia import (
     theia_redirect_url,
     get_n_available_sessions,
     theia_poll_ide,
+    theia_session_status,
+    subscribe_theia_session,
+    listen_theia_session,
 )
 from anubis.models import TheiaSession, db, Assignment, AssignmentRepo
 from anubis.utils.auth.http import require_user
@@ -254,25 +258,85 @@ def public_ide_poll(theia_session_id: str) -> Dict[str, str]:
     # Assert that the session exists
     req_assert(session_data is not None, message='session does not exist')
 
-    # Check to see if it is still initializing
-    session_state = session_data["state"]
-    loading = session_state not in {"Running", "Ended", "Failed"}
+    # Pass back the status and data
+    return success_response(theia_session_status(session_data))
 
-    # Map of session state code to the status message that should
-    # be displayed on the frontend.
-    status, variant = {
-        "Running": ("Session is now ready.", "success"),
-        # "Ended": ("Session ended.", "warning"),
-        "Failed": ("Session failed to start. Please try again.", "error"),
-    }.get(session_state, (None, None))
 
-    # Pass back the status and data
-    return success_response({
-        "loading": loading,
-        "session": session_data,
-        "status": status,
-        "variant": variant,
-    })
+@ide.route("/events/<string:theia_session_id>")
+@require_user()
+def public_ide_events(theia_session_id: str):
+    """
+    Server-Sent-Events stream for session data. The current status
+    of the session is sent right away, then a new status is sent
+    each time the session state changes. The stream ends when the
+    session is done starting (or after 25 seconds, at which point
+    the browser EventSource will reconnect). Keeping the stream
+    shorter than the gunicorn timeout means a stream can never
+    get a worker killed.
+
+    Each event has the same shape as the poll endpoint response.
+
+    :param theia_session_id:
+    :return:
+    """
+
+    # Subscribe before reading the session so that
+    # no updates can be missed in between.
+    pubsub = subscribe_theia_session(theia_session_id)
+
+    # Read the session directly (not through the poll cache)
+    theia_session: TheiaSession = TheiaSession.query.filter(
+        TheiaSession.id == theia_session_id,
+        TheiaSession.owner_id == current_user.id,
+    ).first()
+
+    # Assert that the session exists
+    if theia_session is None:
+        if pubsub is not None:
+            pubsub.close()
+        return error_response('session does not exist'), 404
+
+    status = theia_session_status(theia_session.data)
+
+    def stream():
+        try:
+            # Without a subscription, the browser will reconnect
+            # after a second. This is the same as polling.
+            yield 'retry: 1000\ndata: {}\n\n'.format(json.dumps(status))
+
+            # If the session is already done starting, then we are done
+            if pubsub is None or not status['loading']:
+                return
+
+            for n, update in enumerate(listen_theia_session(pubsub)):
+                # Nothing new, send a keepalive comment every 15 seconds
+                if update is None:
+                    if n % 15 == 14:
+                        yield ': keepalive\n\n'
+                    continue
+
+                update_status = theia_session_status(update)
+                yield 'data: {}\n\n'.format(json.dumps(update_status))
+
+                # Stop once the session is done starting
+                if not update_status['loading']:
+                    break
+
+        finally:
+            # Close the subscription, even if the client went away
+            if pubsub is not None:
+                pubsub.close()
+
+    # The stream does not touch the request context or the database,
+    # so the database connection is given back as soon as we return.
+    return Response(
+        stream(),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no',
+        },
+    )
 
 
 @ide.route("/redirect-url/<string:theia_session_id>")
@@ -12,7 +12,6 @@ from anubis.lms.repos import get_repos
 from anubis.utils.github.repos import delete_assignment_repo
 from anubis.lms.courses import is_course_admin
 from anubis.utils.github.repos import create_assignment_repo
-from anubis.utils.cache import cache
 
 repos_ = Blueprint("public-repos", __name__, url_prefix="/public/repos")
 
@@ -127,8 +126,6 @@ def public_repos_delete(assignment_id: str):
 
     delete_assignment_repo(current_user, assignment)
 
-    cache.delete_memoized(get_repos, current_user.id)
-
     # Pass them back
     return success_response({'status': 'Github Repo & Submissions deleted'})
 
@@ -1,13 +1,20 @@
-from flask import Blueprint, request
+from flask import Blueprint, Response, request
+from werkzeug.datastructures import ContentRange
 
-from anubis.models import User, Submission
+from anubis.models import User, Submission, SubmissionBuild, SubmissionTestResult
 from anubis.utils.auth.http import require_user
 from anubis.utils.auth.user import current_user
 from anubis.utils.data import req_assert
 from anubis.utils.http.decorators import json_response
 from anubis.utils.http import success_response, get_number_arg
+from anubis.utils.log_store import iter_log, log_exists
 from anubis.lms.courses import is_course_admin, assert_course_context
-from anubis.lms.submissions import regrade_submission, get_submissions
+from anubis.lms.submissions import (
+    regrade_submission,
+    get_submissions,
+    get_submissions_count,
+    submission_data_options,
+)
 
 submissions_ = Blueprint(
     "public-submissions", __name__, url_prefix="/public/submissions"
@@ -28,6 +35,13 @@ def public_submissions():
     /api/public/submissions?assignment=Assignment 1: uniq
     /api/public/submissions?class=Intro to OS&assignment=Assignment 1: uniq
 
+    Pages can be requested with limit and offset, or with limit and the
+    next_cursor from the previous page (an empty cursor gets the first
+    page). The total is always given for
+    offset pages, and for cursor pages only when asked for with total=1.
+
+    /api/public/submissions?limit=10&cursor=<next_cursor>&total=1
+
     :return:
     """
 
@@ -39,6 +53,8 @@ def public_submissions():
     # Get the limit and offset for submissions query
     limit: int = get_number_arg('limit', default_value=10)
     offset: int = get_number_arg('offset', default_value=0)
+    cursor = request.args.get("cursor", default=None)
+    include_total = cursor is None or request.args.get("total", default="0") in ("1", "true")
 
     # Load current user
     perspective_of = current_user
@@ -55,21 +71,25 @@ def public_submissions():
     )
 
     # Get a possibly cached list of submission data
-    submissions, total = get_submissions(
-        user_id=perspective_of_id or current_user.id,
+    user_id = perspective_of_id or current_user.id
+    page = get_submissions(
+        user_id=user_id,
         course_id=course_id,
         assignment_id=assignment_id,
         limit=limit,
-        offset=offset,
+        offset=offset if cursor is None else None,
+        cursor=cursor,
     )
 
     # If the submissions query returned None, something went wrong
-    req_assert(submissions is not None, message='Bad Request', status_code=400)
+    req_assert(page is not None, message='Bad Request', status_code=400)
+    submissions, next_cursor = page
 
     # Get submissions through cached function
     return success_response({
         "submissions": submissions,
-        "total": total,
+        "next_cursor": next_cursor,
+        "total": get_submissions_count(user_id, course_id, assignment_id) if include_total else None,
         "user": perspective_of.data
     })
 
@@ -89,6 +109,7 @@ def public_submission(commit: str):
     query = (
         Submission.query
             .filter(Submission.commit == commit)
+            .options(*submission_data_options())
     )
 
     # If the current user is not a superuser, then add a filter
@@ -120,6 +141,7 @@ def public_regrade_commit(commit: str):
     query = (
         Submission.query
             .filter(Submission.commit == commit)
+            .options(*submission_data_options())
     )
 
     # If the current user is not a superuser, then add a filter
@@ -146,3 +168,64 @@ def public_regrade_commit(commit: str):
 
     # Regrade
     return regrade_submission(submission)
+
+
+@submissions_.route("/log/<string:kind>/<string:id>")
+@require_user()
+def public_submission_log(kind: str, id: str):
+    """
+    Stream the full stdout of a submission build or test result. The
+    submission data only has the start of long logs (stdout_truncated
+    will be set). Byte ranges can be requested with a Range header.
+
+    /api/public/submissions/log/build/<build id>
+    /api/public/submissions/log/test/<test result id>
+
+    :param kind: build or test
+    :param id: id of the build or test result
+    :return:
+    """
+
+    # Load the build or test result
+    req_assert(kind in ('build', 'test'), message='invalid log kind')
+    model = SubmissionBuild if kind == 'build' else SubmissionTestResult
+    obj = model.query.filter(model.id == id).first()
+
+    # Make sure we caught one
+    req_assert(obj is not None and obj.submission is not None, message='log does not exist', status_code=404)
+    submission: Submission = obj.submission
+
+    # Only the owner and course admins can see the log. Logs
+    # for hidden tests are only shown to course admins.
+    hidden = kind == 'test' and obj.assignment_test is not None and obj.assignment_test.hidden
+    if submission.owner_id != current_user.id or hidden:
+        req_assert(
+            is_course_admin(submission.assignment.course_id),
+            message='log does not exist',
+            status_code=404,
+        )
+
+    # Logs from before the log store are still inline
+    if obj.stdout_key is None or not log_exists(obj.stdout_key):
+        data = (obj.stdout or '').encode('utf-8', errors='replace')
+        size = len(data)
+        body = lambda start, stop: [data[start:stop]]
+    else:
+        size = obj.stdout_size
+        body = lambda start, stop: iter_log(obj.stdout_key, start, stop)
+
+    # Work out the byte range to send
+    start, stop, status_code = 0, size, 200
+    if request.range is not None:
+        byte_range = request.range.range_for_length(size)
+        if byte_range is None:
+            return Response(status=416, headers={'Content-Range': 'bytes */{}'.format(size)})
+        (start, stop), status_code = byte_range, 206
+
+    # The log is decompressed in chunks as it is sent
+    response = Response(body(start, stop), status=status_code, mimetype='text/plain')
+    response.headers['Accept-Ranges'] = 'bytes'
+    response.headers['Content-Length'] = str(stop - start)
+    if status_code == 206:
+        response.content_range = ContentRange('bytes', start, stop, size)
+    return response
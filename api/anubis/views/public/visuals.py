@@ -5,6 +5,7 @@ from anubis.utils.data import is_debug
 from anubis.utils.http import success_response
 from anubis.utils.cache import cache
 from anubis.utils.http import req_assert
+from anubis.utils.http.decorators import json_response
 from anubis.utils.visuals.usage import get_usage_plot, get_raw_submissions
 
 visuals = Blueprint('public-visuals', __name__, url_prefix='/public/visuals')
@@ -42,3 +43,31 @@ def public_visuals_usage(course_id: str):
 
     # Pass back the image response
     return response
+
+
+@visuals.route('/raw-usage/<string:course_id>')
+@json_response
+def public_visuals_raw_usage(course_id: str):
+    """
+    Get the raw hourly submission series behind the usage graph,
+    for the frontend to chart.
+
+    * cached per course *
+
+    :param course_id:
+    :return:
+    """
+
+    # Get the course
+    course: Course = Course.query.filter(Course.id == course_id).first()
+
+    # Confirm that the course exists
+    req_assert(course is not None, message="Course does not exist")
+
+    # Confirm that the course has visuals enabled
+    req_assert(course.display_visuals, message="Course does not support usage visuals")
+
+    # Get the (maybe cached) submission series
+    return success_response({
+        'usage': get_raw_submissions(course.id),
+    })
@@ -1,27 +1,14 @@
-from datetime import datetime, timedelta
+import hashlib
 from typing import Union
 
 from flask import Blueprint, request
 
-from anubis.models import (
-    Assignment,
-    User,
-    AssignmentRepo,
-    db,
-    Course,
-    InCourse,
-    Submission,
-)
-from anubis.utils.data import is_debug, req_assert
+from anubis.utils.data import req_assert
 from anubis.utils.http.decorators import json_response
-from anubis.utils.http import error_response, success_response
-from anubis.lms.assignments import get_assignment_due_date
-from anubis.lms.submissions import get_submissions
-from anubis.lms.submissions import reject_late_submission, init_submission
-from anubis.lms.webhook import parse_webhook, guess_github_username, check_repo
-from anubis.utils.cache import cache
+from anubis.utils.http import success_response
+from anubis.lms.webhook import verify_webhook_signature, record_webhook_delivery
 from anubis.utils.logging import logger
-from anubis.utils.rpc import enqueue_autograde_pipeline
+from anubis.utils.rpc import enqueue_webhook_deliveries
 
 webhook = Blueprint("public-webhook", __name__, url_prefix="/public/webhook")
 
@@ -53,7 +40,10 @@ def webhook_log_msg() -> Union[str, None]:
 def public_webhook():
     """
     This route should be hit by the github when a push happens.
-    We should take the the github repo url and enqueue it as a job.
+
+    Github gives up on (and retries) deliveries that are slow to
+    respond, so all that is done here is verifying the webhook and
+    recording the delivery. The push is processed by a worker.
 
     :return:
     """
@@ -67,137 +57,28 @@ def public_webhook():
         message='Unable to verify webhook'
     )
 
-    # Load the basics from the webhook
-    repo_url, repo_name, pusher_username, commit, before, ref = parse_webhook(request.json)
-
-    # Attempt to find records for the relevant models
-    assignment = Assignment.query.filter(
-        Assignment.unique_code.in_(repo_name.split("-"))
-    ).first()
-
-    # Verify that we can match this push to an assignment
-    req_assert(assignment is not None, message='assignment not found', status_code=406)
-
-    # Get github username from the repository name
-    user, github_username_guess = guess_github_username(assignment, repo_name)
-
-    # The before Hash will be all 0s on for the first hash.
-    # We will want to ignore both this first push (the initialization of the repo)
-    # and all branches that are not master.
-    if before == "0000000000000000000000000000000000000000":
-        # Record that a new repo was created (and therefore, someone just
-        # started their assignment)
-        logger.debug(
-            "new student repo ",
-            extra={
-                "repo_url": repo_url,
-                "github_username": github_username_guess,
-                "pusher": pusher_username,
-                "commit": commit,
-            },
-        )
-
-        repo = check_repo(assignment, repo_url, github_username_guess, user)
-
-        if repo.owner_id == None:
-            return success_response("initial dangling")
-
-        return success_response("initial commit")
-
-    repo = (
-        AssignmentRepo.query
-            .join(Assignment).join(Course).join(InCourse).join(User)
-            .filter(
-            User.github_username == github_username_guess,
-            Assignment.unique_code == assignment.unique_code,
-            AssignmentRepo.repo_url == repo_url,
-        )
-            .first()
+    # Verify the webhook came from github
+    req_assert(
+        verify_webhook_signature(request.get_data(), request.headers.get("X-Hub-Signature-256", None)),
+        message='Unable to verify webhook signature',
+        status_code=401,
     )
 
-    logger.debug(
-        "webhook data",
-        extra={
-            "assignment": assignment.name,
-            "repo_url": repo_url,
-            "commit": commit,
-            "unique_code": assignment.unique_code,
-        },
-    )
+    # Retries of a delivery have the same delivery id. If there
+    # is no delivery id, the payload itself is used.
+    delivery_id = request.headers.get("X-GitHub-Delivery", None) \
+                  or hashlib.sha256(request.get_data()).hexdigest()
 
-    org_name = assignment.course.github_org
-    if not is_debug() and org_name is not None and org_name != '':
-        # Make sure that the repo we're about to process actually belongs to
-        # a github organization that matches the course.
-        if not repo_url.startswith(f'https://github.com/{org_name}'):
-            logger.error(
-                "Invalid github organization in webhook.",
-                extra={
-                    "repo_url": repo_url,
-                    "pusher_username": pusher_username,
-                    "commit": commit,
-                },
-            )
-            return error_response("invalid repo"), 406
-
-    # if we dont have a record of the repo, then add it
-    if repo is None:
-        repo = check_repo(assignment, repo_url, github_username_guess, user)
+    # Record the delivery. If we have seen it before, then
+    # there is nothing more to do.
+    if not record_webhook_delivery(delivery_id, request.json):
+        return success_response("duplicate delivery")
 
-    req_assert(
-        ref == 'refs/heads/master' or ref == 'refs/heads/main',
-        message='not a push to master or main',
-    )
+    # Hand the delivery off to a worker. The delivery is already
+    # recorded, so if this fails the reaper will pick it back up.
+    try:
+        enqueue_webhook_deliveries()
+    except Exception as e:
+        logger.error(f'Unable to enqueue webhook deliveries {e}')
 
-    # Try to find a submission matching the commit
-    submission = Submission.query.filter_by(commit=commit).first()
-
-    # If the submission does not exist, then create one
-    if submission is None:
-        # Create a shiny new submission
-        submission = Submission(
-            assignment=assignment,
-            repo=repo,
-            owner=user,
-            commit=commit,
-            state="Waiting for resources...",
-        )
-        db.session.add(submission)
-        db.session.commit()
-
-    # If the submission did already exist, then we can just pass
-    # back that status
-    elif submission.created < datetime.now() - timedelta(minutes=3):
-        return success_response({'status': 'already created'})
-
-    # Create the related submission models
-    init_submission(submission)
-
-    # If a user has not given us their github username
-    # the submission will stay in a "dangling" state
-    req_assert(user is not None, message='dangling submission')
-
-    # If the github username is not found, create a dangling submission
-    if assignment.autograde_enabled:
-
-        # Check that the current assignment is still accepting submissions
-        if not assignment.accept_late and datetime.now() < get_assignment_due_date(user, assignment, grace=True):
-            reject_late_submission(submission)
-
-    else:
-        submission.processed = True
-        submission.accepted = False
-        submission.state = 'autograde disabled for this assignment'
-
-    db.session.commit()
-
-    # If the submission was accepted, then enqueue the job
-    if submission.accepted and user is not None:
-        enqueue_autograde_pipeline(submission.id)
-
-    # Delete cached submissions
-    cache.delete_memoized(get_submissions, user.netid)
-    cache.delete_memoized(get_submissions, user.netid, assignment.course_id)
-    cache.delete_memoized(get_submissions, user.netid, assignment.course_id, assignment.id)
-
-    return success_response("submission accepted")
+    return success_response("delivery accepted")
@@ -0,0 +1,115 @@
+import time
+import traceback
+
+from kubernetes import config, client
+
+from anubis.app import create_app
+from anubis.rpc.pipeline import schedule_submission_pipelines
+from anubis.utils.k8s.informer import get_pipeline_job_informer, INFORMER_DELETED
+from anubis.utils.k8s.pipeline import (
+    reap_pipeline_jobs,
+    is_pipeline_job_finished,
+    get_pipeline_job_submission_id,
+    delete_pipeline_job,
+)
+from anubis.utils.logging import logger
+from anubis.utils.pipeline.scheduler import (
+    release_pipeline_slot,
+    reconcile_pipeline_slots,
+    get_pipeline_scheduler_stats,
+)
+
+app = create_app()
+
+
+def reconcile():
+    """
+    Go through the cached pipeline jobs. Finished jobs are cleaned
+    up, and any slots that are not backed by an active job are
+    released. This is done periodically so that a missed watch event
+    can never leak a slot.
+
+    :return:
+    """
+
+    # Clean up finished jobs, and get the active ones from the cache
+    active_submission_ids = reap_pipeline_jobs(get_pipeline_job_informer().list())
+
+    # Release any slots without a job
+    released = reconcile_pipeline_slots(active_submission_ids)
+    if len(released) > 0:
+        logger.warning('released {} stale pipeline slots'.format(len(released)))
+
+    # Launch pending pipelines for any free slots
+    schedule_submission_pipelines()
+
+    logger.info('pipeline scheduler reconciled {}'.format(get_pipeline_scheduler_stats()))
+
+
+def handle_job_event(event_type: str, job: client.V1Job):
+    """
+    When a pipeline job finishes (or is deleted), give back its slot
+    and launch the next pending pipeline. The slot is only given back
+    if this job is the one holding it, so an old job for the same
+    submission can not free the slot of its regrade.
+
+    * Called from the informer thread *
+
+    :param event_type:
+    :param job:
+    :return:
+    """
+
+    # Skip events for jobs that are still running
+    if event_type != INFORMER_DELETED and not is_pipeline_job_finished(job):
+        return
+
+    # Get the submission for the job
+    submission_id = get_pipeline_job_submission_id(job)
+    if submission_id is None:
+        return
+
+    # Give back the slot
+    released = release_pipeline_slot(submission_id, job.metadata.name)
+
+    # Clean up the job if it succeeded
+    if event_type != INFORMER_DELETED and job.status.succeeded is not None and job.status.succeeded >= 1:
+        delete_pipeline_job(job)
+
+    # Use the free slot
+    if released:
+        with app.app_context():
+            schedule_submission_pipelines()
+
+
+def scheduler():
+    """
+    Watch the pipeline jobs, launching pending pipelines
+    as soon as a slot frees up.
+
+    :return:
+    """
+
+    # Start watching the pipeline jobs
+    informer = get_pipeline_job_informer()
+    informer.add_handler(handle_job_event)
+    informer.start()
+    informer.wait_for_sync()
+
+    # The handler does the real work. Reconcile every
+    # so often as a safety net.
+    while True:
+        try:
+            with app.app_context():
+                reconcile()
+        except Exception as e:
+            logger.error('pipeline scheduler error {}'.format(e))
+            logger.error(traceback.format_exc())
+
+        time.sleep(60)
+
+
+if __name__ == "__main__":
+    config.load_incluster_config()
+
+    scheduler()
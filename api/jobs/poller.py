@@ -1,25 +1,67 @@
 import time
+import traceback
 from typing import List
 from datetime import datetime, timedelta
 
-from kubernetes import config
+from kubernetes import config, client
 
+from anubis.app import create_app
 from anubis.models import TheiaSession
-from anubis.utils.data import with_context
-from anubis.utils.k8s.theia import update_theia_session
+from anubis.rpc.theia import reap_stale_theia_sessions
+from anubis.utils.k8s.informer import get_theia_pod_informer, INFORMER_DELETED
+from anubis.utils.k8s.theia import update_theia_session_from_pod
+from anubis.utils.logging import logger
 
+app = create_app()
 
-@with_context
-def poller():
+
+def handle_pod_event(event_type: str, pod: client.V1Pod):
     """
-    Poll Database for sessions created within the last 10 minutes
-    if they are active and dont have a cluster_address.
+    When a theia pod changes, update the theia session. We only
+    care about sessions that are still starting up (no cluster_address),
+    or sessions whose pod has failed.
 
-    If the session is running match the pod to the cluster_address
+    * Called from the informer thread *
 
-    If the session has failed, update the session to failed.
+    :param event_type:
+    :param pod:
+    :return:
     """
-    # Get all theia sessions within the last 10 minutes that are 
+
+    # Deleted pods are handled by the reaper
+    if event_type == INFORMER_DELETED:
+        return
+
+    # Get the session id from the pod labels
+    session_id = pod.metadata.labels["session"]
+
+    with app.app_context():
+        # Get the database entry for the theia session
+        theia_session: TheiaSession = TheiaSession.query.filter(
+            TheiaSession.id == session_id,
+            TheiaSession.active == True,
+        ).first()
+
+        # Make sure we have a session to work on
+        if theia_session is None:
+            return
+
+        # Update the session if it is still starting, or it failed
+        if theia_session.cluster_address is None or pod.status.phase == 'Failed':
+            update_theia_session_from_pod(theia_session, pod)
+
+
+def poll_unscheduled_sessions():
+    """
+    Check sessions created within the last 10 minutes that are active
+    and dont have a cluster_address. Sessions without a pod in the
+    informer cache have not been scheduled yet.
+
+    Pods that do exist are handled by the informer events.
+    """
+    informer = get_theia_pod_informer()
+
+    # Get all theia sessions within the last 10 minutes that are
     # active and dont have cluster_address
     theia_sessions: List[TheiaSession] = TheiaSession.query.filter(
         TheiaSession.active == True,
@@ -29,12 +71,43 @@ def poller():
 
     for session in theia_sessions:
         # Try to update the session info
-        update_theia_session(session)
+        update_theia_session_from_pod(session, informer.get(session.id))
+
+
+def poller():
+    """
+    Watch theia pods, updating theia sessions as their pods change.
+    Every so often, reap stale theia sessions using the pods in the
+    informer cache instead of listing them from the kube api.
+
+    :return:
+    """
+
+    # Start watching theia pods
+    informer = get_theia_pod_informer()
+    informer.add_handler(handle_pod_event)
+    informer.start()
+    informer.wait_for_sync()
+
+    last_reap = 0
+    while True:
+        try:
+            with app.app_context():
+                poll_unscheduled_sessions()
+
+                # Reap stale sessions every 5 minutes
+                if time.time() - last_reap >= 5 * 60:
+                    reap_stale_theia_sessions()
+                    last_reap = time.time()
+
+        except Exception as e:
+            logger.error('theia poller error {}'.format(e))
+            logger.error(traceback.format_exc())
+
+        time.sleep(5)
 
 
 if __name__ == "__main__":
     config.load_incluster_config()
 
-    while True:
-        poller()
-        time.sleep(1)
+    poller()
@@ -4,12 +4,14 @@ from datetime import datetime, timedelta
 from typing import List
 
 from anubis.models import db, Submission, Assignment, Course
+from anubis.rpc.webhook import retry_webhook_deliveries
 from anubis.utils.data import with_context
 from anubis.lms.autograde import bulk_autograde
-from anubis.lms.submissions import init_submission
+from anubis.lms.submissions import init_submission, offload_submission_logs
+from anubis.utils.http.files import offload_static_files
 from anubis.utils.github.fix import fix_github_missing_submissions, fix_github_broken_repos
 from anubis.utils.logging import logger
-from anubis.utils.rpc import enqueue_ide_reap_stale, enqueue_autograde_pipeline
+from anubis.utils.rpc import enqueue_autograde_pipeline
 from anubis.utils.config import get_config_int
 
 
@@ -72,6 +74,48 @@ def reap_recent_assignments():
         bulk_autograde(assignment.id)
 
 
+def reap_inline_logs():
+    """
+    Move a batch of submission logs that are still stored inline
+    in the database into the log store.
+
+    :return:
+    """
+
+    print("Moving inline submission logs into the log store")
+
+    moved = offload_submission_logs(limit=1000)
+    if moved > 0:
+        logger.info('moved {} submission logs into the log store'.format(moved))
+
+
+def reap_inline_static_files():
+    """
+    Move a batch of static files that are still stored in the
+    database into the static store.
+
+    :return:
+    """
+
+    print("Moving static files into the static store")
+
+    moved = offload_static_files(limit=50)
+    if moved > 0:
+        logger.info('moved {} static files into the static store'.format(moved))
+
+
+def reap_webhook_deliveries():
+    """
+    Webhook deliveries are recorded, then processed by an rpc worker. If
+    the enqueue failed or the worker died mid batch, the deliveries would
+    sit pending until the next push came in. Pick those back up, and
+    retry deliveries that failed.
+
+    :return:
+    """
+    retry_webhook_deliveries()
+
+
 def reap_github():
     """
     For reasons not clear to me yet, the webhooks are sometimes missing
@@ -113,18 +157,27 @@ def reap_github():
 
 @with_context
 def reap():
-    # Enqueue a job to reap stale ide k8s resources
-    enqueue_ide_reap_stale()
+    # Stale ide k8s resources are reaped by the theia poller,
+    # which already has all the theia pods in its informer cache.
 
     # Reap the stale submissions
     reap_stale_submissions()
 
+    # Pick back up dropped webhook deliveries
+    reap_webhook_deliveries()
+
     # Reap broken repos
     reap_github()
 
     # Reap broken submissions in recent assignments
     reap_recent_assignments()
 
+    # Move old inline logs into the log store
+    reap_inline_logs()
+
+    # Move old static files into the static store
+    reap_inline_static_files()
+
 
 if __name__ == "__main__":
     print("")
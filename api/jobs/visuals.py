@@ -4,11 +4,15 @@ from typing import List
 from anubis.models import Assignment, Course
 from anubis.utils.data import with_context
 from anubis.utils.visuals.assignments import get_assignment_sundial
+from anubis.utils.visuals.rollups import update_usage_rollups
 from anubis.utils.visuals.usage import get_usage_plot
 
 
 @with_context
 def main():
+    # Roll up the usage since the last run
+    update_usage_rollups()
+
     # Get courses with visuals enabled
     courses_with_visuals: List[Course] = Course.query.filter(
         Course.display_visuals == True
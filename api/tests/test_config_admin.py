@@ -10,3 +10,6 @@ def test_config_admin():
     permission_test('/admin/config/save', method='post', json={'config': sample_config}, fail_for=[
         'student', 'professor', 'ta',
     ])
+    permission_test('/admin/config/cache-stats', fail_for=[
+        'student', 'professor', 'ta',
+    ])
@@ -6,6 +6,9 @@ def test_courses_admin():
     student = Session('student', new=True)
     student_id = student.get('/public/auth/whoami')['user']['id']
 
+    # Give the new user the same course context as the superuser
+    student._session.cookies['course'] = superuser._session.cookies['course']
+
     permission_test('/admin/courses/')
     permission_test('/admin/courses/list')
 
@@ -30,6 +33,11 @@ def test_courses_admin():
         fail_for=['student', 'ta']
     )
 
+    # A removed TA loses course admin access right away
+    student.get('/admin/courses/list/tas')
+    superuser.get(f'/admin/courses/remove/ta/{student_id}')
+    student.get('/admin/courses/list/tas', should_fail=True)
+
     permission_test(
         f'/admin/courses/make/professor/{student_id}',
         after=lambda: superuser.get(f'/admin/courses/remove/professor/{student_id}', skip_verify=True,
@@ -43,3 +51,8 @@ def test_courses_admin():
                                     return_request=True),
         fail_for=['student', 'ta', 'professor']
     )
+
+    # A removed professor loses course admin access right away
+    student.get('/admin/courses/list/tas')
+    superuser.get(f'/admin/courses/remove/professor/{student_id}')
+    student.get('/admin/courses/list/tas', should_fail=True)
@@ -1,3 +1,5 @@
+import json
+
 from utils import Session, create_repo
 
 
@@ -35,6 +37,12 @@ def test_ide_public():
     s.get(f'/public/ide/poll/{session_id}')
     s.get(f'/public/ide/redirect-url/{session_id}')
 
+    r = s.get(f'/public/ide/events/{session_id}', return_request=True, skip_verify=True)
+    assert r.status_code == 200
+    assert r.headers['Content-Type'].startswith('text/event-stream')
+    event = json.loads(r.text.split('data: ', 1)[1].split('\n\n', 1)[0])
+    assert event['session']['id'] == session_id
+
     s.get(f'/public/ide/stop/{session_id}')
 
     resp = s.get(f'/public/ide/active/{assignment_id}')
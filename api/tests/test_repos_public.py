@@ -1,6 +1,15 @@
+import hashlib
+import os
+
+from anubis.models import db, User, AssignmentRepo, Submission, StudentAssignmentBest, WebhookDelivery
+from anubis.utils.data import with_context
 from utils import Session, create_repo
 
 
+def gen_rand(n: int = 40):
+    return hashlib.sha256(os.urandom(12)).hexdigest()[:n]
+
+
 def test_repos_public():
     s = Session('student', new=True)
 
@@ -14,3 +23,76 @@ def test_repos_public():
     assert len(repos) == 1
     repos = s.get('/public/repos')['repos']
     assert len(repos) == 1
+
+
+@with_context
+def create_repo_with_submission(s: Session, assignment_id: str):
+    user = User.query.filter(User.netid == s.netid).first()
+    repo = AssignmentRepo(
+        owner=user,
+        assignment_id=assignment_id,
+        github_username=user.github_username,
+        repo_url=f'https://github.com/anubis-test/{gen_rand(12)}',
+    )
+    submission = Submission(
+        owner=user,
+        assignment_id=assignment_id,
+        repo=repo,
+        commit=gen_rand(40),
+        processed=True,
+        accepted=True,
+    )
+    db.session.add_all([repo, submission])
+    db.session.flush()
+
+    # Rows that reference the submission by foreign key
+    delivery = WebhookDelivery(
+        id=gen_rand(36),
+        repo_url=repo.repo_url,
+        repo_name=repo.repo_url.split('/')[-1],
+        pusher_username=user.github_username,
+        commit=submission.commit,
+        before='0' * 40,
+        ref='refs/heads/master',
+        state='processed',
+        submission_id=submission.id,
+    )
+    best = StudentAssignmentBest(
+        owner_id=user.id,
+        assignment_id=assignment_id,
+        submission_id=submission.id,
+    )
+    db.session.add_all([delivery, best])
+    db.session.commit()
+
+    return user.id, submission.id, delivery.id
+
+
+@with_context
+def check_repo_deleted(user_id: str, assignment_id: str, submission_id: str, delivery_id: str):
+    db.session.expire_all()
+    assert AssignmentRepo.query.filter(
+        AssignmentRepo.owner_id == user_id,
+        AssignmentRepo.assignment_id == assignment_id,
+    ).count() == 0
+    assert Submission.query.filter(Submission.id == submission_id).count() == 0
+    assert StudentAssignmentBest.query.filter(
+        StudentAssignmentBest.owner_id == user_id,
+        StudentAssignmentBest.assignment_id == assignment_id,
+    ).count() == 0
+
+    # The delivery is kept, but no longer points at the submission
+    delivery = WebhookDelivery.query.filter(WebhookDelivery.id == delivery_id).first()
+    assert delivery is not None
+    assert delivery.submission_id is None
+
+
+def test_repos_delete_public():
+    s = Session('student', new=True)
+    assignment_id = s.get('/public/assignments/list')['assignments'][0]['id']
+
+    user_id, submission_id, delivery_id = create_repo_with_submission(s, assignment_id)
+
+    s.delete(f'/public/repos/delete/{assignment_id}')
+
+    check_repo_deleted(user_id, assignment_id, submission_id, delivery_id)
@@ -1,3 +1,4 @@
+import hashlib
 import io
 
 import requests
@@ -14,6 +15,14 @@ def test_static_admin():
     student.post('/admin/static/upload', files={filename: logo_file}, should_fail=True)
 
     prof = Session('professor')
+
+    # Uploads are hashed as they are streamed into the store
+    logo_file = io.BytesIO(logo)
+    blob = prof.post('/admin/static/upload', files={filename: logo_file})['blob']
+    assert blob['etag'] == hashlib.sha256(logo).hexdigest()
+    assert blob['size'] == len(logo)
+    assert blob['content_type'] == 'image/png'
+
     for _ in range(5):
         logo_file = io.BytesIO(logo)
         prof.post('/admin/static/upload', files={filename: logo_file})
@@ -11,7 +11,8 @@ def test_static_public():
     filename = 'logo.png'
     prof = Session('professor')
     logo_file = io.BytesIO(logo)
-    blob_id = prof.post('/admin/static/upload', files={filename: logo_file})['blob']['path'].lstrip('/')
+    blob = prof.post('/admin/static/upload', files={filename: logo_file})['blob']
+    blob_id = blob['path'].lstrip('/')
 
     # Now test as a student
     student = Session('student')
@@ -23,6 +24,25 @@ def test_static_public():
     assert r.status_code == 200
     assert r.headers.get('content-type') == 'image/png'
 
+    assert r.content == logo
+
+    # Conditional requests get a 304
+    etag = r.headers.get('etag')
+    assert etag == f'"{blob["etag"]}"'
+    r = student.get(f'/public/static/{blob_id}/logo.png', return_request=True, skip_verify=True,
+                    headers={'If-None-Match': etag})
+    assert r.status_code == 304
+
+    # Range requests get part of the file
+    r = student.get(f'/public/static/{blob_id}/logo.png', return_request=True, skip_verify=True,
+                    headers={'Range': 'bytes=0-99'})
+    assert r.status_code == 206
+    assert r.content == logo[:100]
+
+    # Versioned urls are immutable
+    r = student.get(f'/public/static/{blob_id}/logo.png?v={blob["etag"]}', return_request=True, skip_verify=True)
+    assert 'immutable' in r.headers.get('cache-control')
+
     r = student.get(f'/public/static/{blob_id}/logo.pn', return_request=True, skip_verify=True)
     assert r.status_code == 404
     assert r.text.startswith('404 Not Found :(')
@@ -6,6 +6,7 @@ def test_students_admin():
     student_id = student.get('/public/auth/whoami')['user']['id']
 
     permission_test('/admin/students/list')
+    permission_test('/admin/students/list?limit=10')
     permission_test('/admin/students/list/basic')
     permission_test(f'/admin/students/info/{student_id}')
     permission_test(f'/admin/students/submissions/{student_id}')
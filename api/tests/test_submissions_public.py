@@ -0,0 +1,49 @@
+from anubis.models import SubmissionBuild
+from anubis.utils.data import with_context
+from anubis.utils.log_store import read_log
+from utils import Session
+
+
+@with_context
+def get_stored_build_log():
+    build = SubmissionBuild.query.filter(SubmissionBuild.stdout_key != None).first()
+    return build.id, read_log(build.stdout_key)
+
+
+def test_submissions_public():
+    s = Session('student', new=True)
+
+    # Offset pages always have the total
+    r = s.get('/public/submissions/')
+    assert r['submissions'] == []
+    assert r['total'] == 0
+    assert r['next_cursor'] is None
+
+    # Cursor pages only have the total when asked for
+    r = s.get('/public/submissions/?limit=5&cursor=')
+    assert r['submissions'] == []
+    assert r['total'] is None
+    r = s.get('/public/submissions/?limit=5&cursor=&total=1')
+    assert r['total'] == 0
+
+    # Bad cursors are rejected
+    s.get('/public/submissions/?cursor=not-a-cursor', should_fail=True)
+
+
+def test_submission_log_public():
+    build_id, stdout = get_stored_build_log()
+    superuser = Session('superuser')
+
+    # Full log
+    r = superuser.get(f'/public/submissions/log/build/{build_id}', skip_verify=True)
+    assert r.status_code == 200
+    assert r.text == stdout
+
+    # Range of the log
+    r = superuser.get(f'/public/submissions/log/build/{build_id}', skip_verify=True, headers={'Range': 'bytes=1-'})
+    assert r.status_code == 206
+    assert r.text == stdout[1:]
+
+    # Only the owner and course admins can see the log
+    student = Session('student', new=True)
+    student.get(f'/public/submissions/log/build/{build_id}', should_fail=True)
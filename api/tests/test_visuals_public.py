@@ -23,3 +23,9 @@ def test_visuals_public():
         # Just make sure it didn't 500
         assert usage.status_code == 200
 
+
+        # Get the raw series behind the visual
+        usage = student.get(f'/public/visuals/raw-usage/{course_id}')['usage']
+        for series in usage:
+            assert len(series['data']) > 0
+            assert all(point['y'] > 0 for point in series['data'])
@@ -4,7 +4,7 @@ import os
 
 import requests
 
-from anubis.models import db, User, Assignment, InCourse, Course
+from anubis.models import db, User, Assignment, InCourse, Course, Submission, WebhookDelivery
 from anubis.utils.data import with_context
 
 
@@ -34,13 +34,30 @@ def gen_webhook(name, code, username, after=None, before=None, ref="refs/heads/m
     }
 
 
-def post_webhook(webhook):
+def post_webhook(webhook, delivery_id=None):
+    if delivery_id is None:
+        delivery_id = gen_rand(36)
+
     return requests.post(
         'http://localhost:5000/public/webhook/', json=webhook,
-        headers={'Content-Type': 'application/json', 'X-GitHub-Event': 'push'},
+        headers={'Content-Type': 'application/json', 'X-GitHub-Event': 'push', 'X-GitHub-Delivery': delivery_id},
     )
 
 
+def get_delivery(delivery_id) -> WebhookDelivery:
+    db.session.expire_all()
+    return WebhookDelivery.query.filter(WebhookDelivery.id == delivery_id).first()
+
+
+def post_webhook_delivery(webhook) -> WebhookDelivery:
+    # Deliveries are processed by a worker, which is run
+    # inline in MINDEBUG.
+    delivery_id = gen_rand(36)
+    r = post_webhook(webhook, delivery_id).json()
+    assert r['data'] == 'delivery accepted'
+    return get_delivery(delivery_id)
+
+
 def gen_rand(n: int = 40):
     return hashlib.sha256(os.urandom(12)).hexdigest()[:n]
 
@@ -70,9 +87,10 @@ def do_webhook_tests_user(github_username):
     print(assignment_name, assignment_unique_code)
 
     db.session.expire_all()
-    r = post_webhook(
-        gen_webhook(assignment_name, assignment_unique_code, user_github_username, "0" * 40, "0" * 40)).json()
-    assert r['data'] == 'initial commit'
+    delivery = post_webhook_delivery(
+        gen_webhook(assignment_name, assignment_unique_code, user_github_username, "0" * 40, "0" * 40))
+    assert delivery.state == 'processed'
+    assert delivery.message == 'initial commit'
     db.session.expire_all()
     response = db.engine.execute(
         'select count(id) from assignment_repo where assignment_id = \'{}\' and owner_id = \'{}\';'.format(
@@ -81,9 +99,9 @@ def do_webhook_tests_user(github_username):
     )
     assert response.fetchone()[0] == 1
 
-    r = post_webhook(gen_webhook(assignment_name, assignment_unique_code, user_github_username)).json()
+    delivery = post_webhook_delivery(gen_webhook(assignment_name, assignment_unique_code, user_github_username))
     db.session.expire_all()
-    assert r['data'] != 'initial commit'
+    assert delivery.message != 'initial commit'
     response = db.engine.execute(
         'select count(id) from assignment_repo where assignment_id = \'{}\' and owner_id = \'{}\';'.format(
             assignment_id, user_id
@@ -91,18 +109,29 @@ def do_webhook_tests_user(github_username):
     )
     assert response.fetchone()[0] == 1
 
-    r = post_webhook(gen_webhook(assignment_name, assignment_unique_code + 'abc', user_github_username)).json()
-    assert r['data'] is None
-    assert r['error'] == 'assignment not found'
-
-    r = post_webhook(gen_webhook(assignment_name, assignment_unique_code, user_github_username, ref="abc123")).json()
-    assert r['error'] == 'not a push to master or main'
-
-    r = post_webhook(gen_webhook(assignment_name, assignment_unique_code, gen_rand(6))).json()
-    assert r['error'] == 'dangling submission'
-
-    r = post_webhook(gen_webhook(assignment_name, assignment_unique_code, user_github_username)).json()
-    assert r['data'] == 'submission accepted'
+    delivery = post_webhook_delivery(gen_webhook(assignment_name, assignment_unique_code + 'abc', user_github_username))
+    assert delivery.state == 'rejected'
+    assert delivery.message == 'assignment not found'
+
+    delivery = post_webhook_delivery(
+        gen_webhook(assignment_name, assignment_unique_code, user_github_username, ref="abc123"))
+    assert delivery.state == 'rejected'
+    assert delivery.message == 'not a push to master or main'
+
+    delivery = post_webhook_delivery(gen_webhook(assignment_name, assignment_unique_code, gen_rand(6)))
+    assert delivery.state == 'rejected'
+    assert delivery.message == 'dangling submission'
+
+    webhook = gen_webhook(assignment_name, assignment_unique_code, user_github_username)
+    delivery = post_webhook_delivery(webhook)
+    assert delivery.state == 'processed'
+    assert delivery.message == 'submission accepted'
+    assert delivery.submission_id is not None
+
+    # Retries of the same delivery are only processed once
+    r = post_webhook(webhook, delivery.id).json()
+    assert r['data'] == 'duplicate delivery'
+    assert Submission.query.filter(Submission.commit == webhook['after']).count() == 1
 
 
 def test_webhooks():
@@ -268,6 +268,15 @@ class Session(object):
             **kwargs,
         )
 
+    def delete(
+            self, path, return_request=False, should_succeed=True,
+            should_fail=False, skip_verify=False, **kwargs,
+    ):
+        return self._make_request(
+            path, self._session.delete, return_request, should_succeed,
+            should_fail, skip_verify, **kwargs,
+        )
+
 
 def pp(data: dict):
     print(json.dumps(data, indent=2))
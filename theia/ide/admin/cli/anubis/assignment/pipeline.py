@@ -1,8 +1,10 @@
 #!/usr/bin/env python3
 
+import gzip
 import json
 import logging
 import os
+import threading
 import traceback
 
 import git
@@ -14,9 +16,51 @@ root_logger.setLevel(logging.DEBUG)
 root_logger.addHandler(logging.StreamHandler())
 
 
-def post(path: str, data: dict, params=None):
+# Buffered reporting. When enabled, state, build and test reports are
+# held in memory and sent to the pipeline API as a single batch. The
+# buffer is flushed at the end of the run, or when it has grown past
+# the size threshold, or by a timer once its oldest report is past the
+# time threshold (so a slow test never holds back earlier results).
+BUFFER_REPORTS = os.environ.get('BUFFER_REPORTS', default='1') == '1'
+BUFFER_MAX_SIZE = int(os.environ.get('BUFFER_MAX_SIZE', default='16'))
+BUFFER_MAX_AGE = float(os.environ.get('BUFFER_MAX_AGE', default='5'))
+
+report_buffer = []
+report_timer = None
+
+# The buffer is flushed from both the main thread and the timer
+# thread. Sends are done while holding the lock so that batches
+# always go out in order.
+report_lock = threading.RLock()
+
+# Report bodies bigger than this many bytes are gzipped before they are
+# sent. Build and test logs compress very well.
+COMPRESS_REPORTS = os.environ.get('COMPRESS_REPORTS', default='1') == '1'
+COMPRESS_MIN_SIZE = 1024
+
+
+def post(path: str, data: dict, params=None, buffered: bool = False):
+    global report_timer
+
     if params is None:
         params = {}
+
+    # Hold the report in the buffer if buffering is on
+    if buffered and BUFFER_REPORTS:
+        with report_lock:
+
+            # Flush the buffer once its first report is too old
+            if len(report_buffer) == 0:
+                report_timer = threading.Timer(BUFFER_MAX_AGE, flush_timer)
+                report_timer.daemon = True
+                report_timer.start()
+            report_buffer.append((path, data, params))
+
+            # Flush if we have hit the size threshold
+            if len(report_buffer) >= BUFFER_MAX_SIZE:
+                flush()
+        return None
+
     headers = {'Content-Type': 'application/json'}
     params['token'] = TOKEN
 
@@ -24,13 +68,19 @@ def post(path: str, data: dict, params=None):
         logging.info("post: {} data: {}".format(path, data))
         return None
 
+    # Compress large bodies
+    body = json.dumps(data).encode()
+    if COMPRESS_REPORTS and len(body) > COMPRESS_MIN_SIZE:
+        body = gzip.compress(body)
+        headers['Content-Encoding'] = 'gzip'
+
     # Attempt to contact the pipeline API
     try:
         res = requests.post(
             'http://anubis-pipeline-api:5000' + path,
             headers=headers,
             params=params,
-            json=data,
+            data=body,
         )
     except:
         logging.error('UNABLE TO REPORT POST TO PIPELINE API')
@@ -45,6 +95,73 @@ def post(path: str, data: dict, params=None):
     return res
 
 
+def flush():
+    """
+    Send all the buffered reports to the pipeline API in a single
+    batch request. Only the latest state is sent, as the intermediate
+    states would be immediately overwritten anyway.
+
+    :return:
+    """
+    global report_buffer, report_timer
+
+    with report_lock:
+        if report_timer is not None:
+            report_timer.cancel()
+            report_timer = None
+
+        if len(report_buffer) == 0:
+            return None
+
+        reports, report_buffer = report_buffer, []
+        return _post_batch(reports)
+
+
+def flush_timer():
+    """
+    Flush the buffer from the timer thread.
+
+    :return:
+    """
+    try:
+        flush()
+    except SystemExit:
+        # A failed report calls exit, which would only end this
+        # thread. Take the pipeline down with it, the same as a
+        # failed report on the main thread would.
+        os._exit(0)
+
+
+def _post_batch(reports: list):
+    """
+    Send buffered reports as a single batch report.
+
+    :param reports: list of (path, data, params) reports
+    :return:
+    """
+    data = {'token': TOKEN, 'commit': COMMIT, 'build': None, 'tests': [], 'state': None}
+    params = {}
+
+    # Coalesce the buffered reports into the batch shape
+    for path, report, report_params in reports:
+        report_type = path.split('/')[3]
+        if report_type == 'state':
+            data['state'] = report['state']
+            params.update(report_params)
+        elif report_type == 'build':
+            data['build'] = {'stdout': report['stdout'], 'passed': report['passed']}
+        elif report_type == 'test':
+            data['tests'].append({
+                'test_name': report['test_name'],
+                'stdout': report['stdout'],
+                'message': report['message'],
+                'passed': report['passed'],
+            })
+
+    logging.info('flush {} reports'.format(len(reports)))
+    return post('/pipeline/report/batch/{}'.format(SUBMISSION_ID), data, params=params)
+
+
 def report_panic(message: str, traceback: str, ):
     """
     Report and error to the API
@@ -61,6 +178,7 @@ def report_panic(message: str, traceback: str, ):
     }
     print(traceback)
     logging.info('report_error {}'.format(json.dumps(data, indent=2)))
+    flush()
     post('/pipeline/report/panic/{}'.format(SUBMISSION_ID), data)
 
 
@@ -105,7 +223,7 @@ def report_state(state: str, params=None):
         'state': state,
     }
     logging.info('report_state {}'.format(json.dumps(data, indent=2)))
-    post('/pipeline/report/state/{}'.format(SUBMISSION_ID), data, params=params)
+    post('/pipeline/report/state/{}'.format(SUBMISSION_ID), data, params=params, buffered=True)
 
 
 def report_build_results(stdout: str, passed: bool):
@@ -124,7 +242,7 @@ def report_build_results(stdout: str, passed: bool):
         'passed': passed,
     }
     logging.info('report_build {}'.format(json.dumps(data, indent=2)))
-    post('/pipeline/report/build/{}'.format(SUBMISSION_ID), data)
+    post('/pipeline/report/build/{}'.format(SUBMISSION_ID), data, buffered=True)
 
 
 def report_test_results(test_name: str, stdout: str, message: str, passed: bool):
@@ -147,7 +265,7 @@ def report_test_results(test_name: str, stdout: str, message: str, passed: bool)
         'passed': passed,
     }
     logging.info('report_test_results {}'.format(json.dumps(data, indent=2)))
-    post('/pipeline/report/test/{}'.format(SUBMISSION_ID), data)
+    post('/pipeline/report/test/{}'.format(SUBMISSION_ID), data, buffered=True)
 
 
 def get_assignment_data() -> dict:
@@ -215,6 +333,7 @@ def run_build(assignment_data: dict):
     result = build_function()
     report_build_results(result.stdout, result.passed)
     if not result.passed:
+        flush()
         exit(0)
 
 
@@ -243,6 +362,7 @@ def main():
         run_build(assignment_data)
         run_tests(assignment_data)
         report_state('Finished!', params={'processed': '1'})
+        flush()
     except Panic as e:
         report_panic(repr(e), traceback.format_exc())
     except Exception as e:
@@ -60,22 +60,10 @@ const checkSession = (id, state, enqueueSnackbar, after = null) => {
     return;
   }
 
-  const {setLoading, setSession, setSessionState, setShowStop} = state;
-
   axios.get(`/api/public/ide/poll/${id}`).then((response) => {
     const data = standardStatusHandler(response, enqueueSnackbar);
 
-    setSessionState(data.session?.state ?? '');
-    if (!data.loading) {
-      if (data.session.state === 'Running') {
-        setSession(data.session);
-        setLoading(false);
-        setShowStop(true);
-      } else {
-        setSession(null);
-        setLoading(false);
-        setShowStop(false);
-      }
+    if (applySessionStatus(data, state)) {
       return;
     }
 
@@ -85,6 +73,28 @@ const checkSession = (id, state, enqueueSnackbar, after = null) => {
   }).catch(standardErrorHandler(enqueueSnackbar));
 };
 
+// Update the dialog state from a session status (from either the poll
+// or the events endpoint). Returns true if the session is done loading.
+const applySessionStatus = (data, state) => {
+  const {setLoading, setSession, setSessionState, setShowStop} = state;
+
+  setSessionState(data.session?.state ?? '');
+  if (!data.loading) {
+    if (data.session.state === 'Running') {
+      setSession(data.session);
+      setLoading(false);
+      setShowStop(true);
+    } else {
+      setSession(null);
+      setLoading(false);
+      setShowStop(false);
+    }
+    return true;
+  }
+
+  return false;
+};
+
 
 const pollSession = (id, state, enqueueSnackbar, n = 0) => () => {
   const {setShowStop} = state;
@@ -105,6 +115,41 @@ const pollSession = (id, state, enqueueSnackbar, n = 0) => () => {
   );
 };
 
+// Wait for the session to come up using the server sent events
+// endpoint. Falls back to polling if the browser does not support
+// EventSource, or if the stream errors out.
+const watchSession = (id, state, enqueueSnackbar) => {
+  if (typeof EventSource === 'undefined') {
+    pollSession(id, state, enqueueSnackbar)();
+    return;
+  }
+
+  const {setShowStop} = state;
+  const events = new EventSource(`/api/public/ide/events/${id}`);
+  const showStopTimeout = setTimeout(() => setShowStop(true), 30 * 1000);
+  const giveUpTimeout = setTimeout(() => events.close(), 600 * 1000);
+
+  const close = () => {
+    events.close();
+    clearTimeout(showStopTimeout);
+    clearTimeout(giveUpTimeout);
+  };
+
+  events.onmessage = (event) => {
+    if (applySessionStatus(JSON.parse(event.data), state)) {
+      close();
+    }
+  };
+
+  events.onerror = () => {
+    // The browser will reconnect on its own unless the stream is closed
+    if (events.readyState === EventSource.CLOSED) {
+      close();
+      pollSession(id, state, enqueueSnackbar)();
+    }
+  };
+};
+
 const startSession = (state, enqueueSnackbar) => () => {
   const {autosaveEnabled, persistentStorage, setSession, session, selectedTheia, setLoading, setShowStop} = state;
   if (session) {
@@ -130,7 +175,7 @@ const startSession = (state, enqueueSnackbar) => () => {
     } else {
       setShowStop(false);
       setSession(data.session);
-      pollSession(data.session.id, state, enqueueSnackbar)();
+      watchSession(data.session.id, state, enqueueSnackbar);
     }
   }).catch(standardErrorHandler(enqueueSnackbar));
 };
@@ -216,7 +261,7 @@ export default function IDEDialog({selectedTheia, setSelectedTheia}) {
       }
       if (data?.session?.state === 'Initializing') {
         setLoading(true);
-        pollSession(data.session.id, state, enqueueSnackbar)();
+        watchSession(data.session.id, state, enqueueSnackbar);
       }
       if (data?.session?.state === 'Running') {
         setShowStop(true);
@@ -9,6 +9,7 @@ import CheckCircleIcon from '@material-ui/icons/CheckCircle';
 import CancelIcon from '@material-ui/icons/Cancel';
 import BuildIcon from '@material-ui/icons/Build';
 import Fab from '@material-ui/core/Fab';
+import Link from '@material-ui/core/Link';
 import {makeStyles} from '@material-ui/core/styles';
 import green from '@material-ui/core/colors/green';
 
@@ -77,6 +78,11 @@ export default function SubmissionBuild({build, stop}) {
                 </Typography>
               )) :
             null}
+          {build.stdout_truncated ? (
+            <Link href={build.stdout_url} target={'_blank'}>
+              View full build log
+            </Link>
+          ) : null}
         </div>
       </AccordionDetails>
     </Accordion>
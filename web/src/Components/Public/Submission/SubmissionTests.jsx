@@ -10,6 +10,7 @@ import CheckCircleIcon from '@material-ui/icons/CheckCircle';
 import green from '@material-ui/core/colors/green';
 import CancelIcon from '@material-ui/icons/Cancel';
 import Fab from '@material-ui/core/Fab';
+import Link from '@material-ui/core/Link';
 import AssessmentIcon from '@material-ui/icons/Assessment';
 import HighlightOffIcon from '@material-ui/icons/HighlightOff';
 import {Tooltip} from '@material-ui/core';
@@ -110,6 +111,11 @@ export default function SubmissionTests({tests, stop}) {
                       <br/>
                   )) :
                 null}
+              {test.result.stdout_truncated ? (
+                <Link href={test.result.stdout_url} target={'_blank'}>
+                  View full test output
+                </Link>
+              ) : null}
             </div>
           </AccordionDetails>
         </Accordion>
@@ -47,7 +47,8 @@ const useColumns = (state, enqueueSnackbar) => ([
           style={{display: 'inline'}}
           component={'a'}
           target={'_blank'}
-          href={`${window.location.origin}/api/public/static${row.static_file.path}/${row.static_file.filename}`}
+          href={`${window.location.origin}/api/public/static${row.static_file.path}/${row.static_file.filename}` +
+            (row.static_file.etag ? `?v=${row.static_file.etag}` : '')}
         >
           {row.static_file.filename}
         </Typography>
@@ -44,7 +44,8 @@ const useColumns = (state, enqueueSnackbar) => ([
           style={{display: 'inline'}}
           component={'a'}
           target={'_blank'}
-          href={`${window.location.origin}/api/public/static${row.path}/${row.filename}`}
+          href={`${window.location.origin}/api/public/static${row.path}/${row.filename}` +
+            (row.etag ? `?v=${row.etag}` : '')}
         >
           {row.filename}
         </Typography>
@@ -41,7 +41,8 @@ export default function Repos() {
   }, []);
 
   const get_href = (row) => (
-    `${window.location.origin}/api/public/static${row.static_file.path}/${row.static_file.filename}`
+    `${window.location.origin}/api/public/static${row.static_file.path}/${row.static_file.filename}` +
+    (row.static_file.etag ? `?v=${row.static_file.etag}` : '')
   );
 
   return (